@@ -0,0 +1,84 @@
+import sys
+import json
+import argparse
+
+from benchmarks.harness import DEFAULT_MIX, AppServer, Counters, Workload, compare, load_baseline, save_baseline
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(','):
+        operation, _, weight = item.partition('=')
+        if operation not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError('Unknown operation {!r}, expected one of {}'.format(
+                operation, ', '.join(DEFAULT_MIX)))
+        mix[operation] = float(weight or 1)
+    return mix
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks',
+        description='Load test the API hot paths against a local Postgres and a stubbed IEX.')
+    parser.add_argument('--url', help='Benchmark an app already running at URL instead of starting one. '
+        'It must use the stub (see --stub-port), and queries per request are not reported.')
+    parser.add_argument('--port', type=int, default=5055, help='Port of the app started by the benchmark.')
+    parser.add_argument('--stub-port', type=int, default=8765, help='Port of the IEX stub.')
+    parser.add_argument('--latency', type=float, default=0.02, help='Mean latency of the IEX stub in seconds.')
+    parser.add_argument('--jitter', type=float, default=0.005, help='Latency standard deviation in seconds.')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of failing IEX stub calls.')
+    parser.add_argument('--concurrency', type=int, default=8, help='Number of client threads.')
+    parser.add_argument('--users', type=int, default=32, help='Number of users, at least --concurrency.')
+    parser.add_argument('--positions', type=int, default=20, help='Positions opened by each user.')
+    parser.add_argument('--symbols', type=int, default=200, help='Number of symbols traded.')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds to measure.')
+    parser.add_argument('--warmup', type=float, default=5, help='Seconds to run before measuring.')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+        help='Weighted operations, e.g. get_account=50,trade=10 (default: {}).'.format(
+            ','.join('{}={}'.format(k, v) for k, v in DEFAULT_MIX.items())))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', metavar='PATH', help='Write the results as a baseline to PATH.')
+    parser.add_argument('--compare', metavar='PATH', help='Fail if the results regressed from the baseline at PATH.')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+        help='Allowed regression from the baseline, as a fraction.')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = {k: v for k, v in vars(args).items() if k not in ('save', 'compare', 'url')}
+
+    # Imported here so the app process can set up its configuration first.
+    from trader.services.market_data.synthetic import SyntheticMarket
+    from trader.services.market_data.stub_server import StubServer
+
+    market = SyntheticMarket(seed=args.seed)
+    symbols = ['S{:04d}'.format(i) for i in range(args.symbols)]
+    stub = StubServer(market, port=args.stub_port, latency=args.latency, jitter=args.jitter,
+        error_rate=args.error_rate, seed=args.seed).start()
+
+    app = None
+    if args.url is None:
+        app = AppServer(stub.url, port=args.port).start()
+    try:
+        workload = Workload(args.url or app.url, market, symbols, args.mix, args.positions, args.seed)
+        workload.setup(args.users)
+        if args.warmup:
+            workload.run(args.concurrency, args.warmup)
+        result = workload.run(args.concurrency, args.duration, Counters(app.queries if app else None, stub))
+    finally:
+        if app is not None:
+            app.stop()
+        stub.stop()
+
+    json.dump(result, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+    if args.save:
+        save_baseline(args.save, result, config)
+    if args.compare:
+        regressions = compare(load_baseline(args.compare), result, args.tolerance)
+        for r in regressions:
+            sys.stderr.write('REGRESSION {scope} {metric}: {baseline} -> {result}\n'.format(**r))
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,308 @@
+import os
+import json
+import time
+import uuid
+import random
+import logging
+import threading
+import multiprocessing
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+# Operations of a workload, and their default share of requests.
+DEFAULT_MIX = {
+    'get_account': 50,
+    'get_exchange': 25,
+    'trade': 12,
+    'open_position': 5,
+    'deposit': 8
+}
+
+def _serve(host, port, stub_url, queries, ready):
+    """
+    Run the app in a spawned process, pointed at the IEX stub, counting the
+    SQL statements it executes into the shared `queries` counter.
+    """
+    # The configuration reads these at import time.
+    os.environ['MARKET_DATA_SOURCE'] = 'iex'
+    os.environ['IEX_API_URL'] = stub_url
+
+    from sqlalchemy import event
+    from werkzeug.serving import make_server
+    from trader import create_app
+    from trader.extensions import db
+
+    app = create_app()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        with queries.get_lock():
+            queries.value += 1
+    for engine in db.engines:
+        event.listen(engine, 'before_cursor_execute', count)
+
+    server = make_server(host, port, app, threaded=True)
+    ready.set()
+    server.serve_forever()
+
+class AppServer:
+    """
+    The app under test, served by the Werkzeug threaded server in a child
+    process.
+    """
+    def __init__(self, stub_url, host='127.0.0.1', port=5055):
+        self.url = 'http://{}:{}'.format(host, port)
+        context = multiprocessing.get_context('spawn')
+        self.queries = context.Value('L', 0)
+        self._ready = context.Event()
+        self._process = context.Process(target=_serve, args=(host, port, stub_url, self.queries, self._ready),
+            daemon=True)
+
+    def start(self, timeout=60):
+        self._process.start()
+        if not self._ready.wait(timeout):
+            self.stop()
+            raise RuntimeError('The app did not start within {} seconds'.format(timeout))
+        return self
+
+    def stop(self):
+        self._process.terminate()
+        self._process.join()
+
+class Counters:
+    """
+    Reads the server-side counters a run reports per request: SQL statements
+    executed by the app and calls made to the upstream stub. Either may be
+    unavailable when benchmarking an external server.
+    """
+    def __init__(self, queries=None, stub=None):
+        self.queries = queries
+        self.stub = stub
+
+    def snapshot(self):
+        return {
+            'queries': self.queries.value if self.queries is not None else None,
+            'upstream_calls': self.stub.requests if self.stub is not None else None
+        }
+
+class User:
+    """
+    A benchmark user with an account and the positions it holds, driven by
+    one worker at a time.
+    """
+    def __init__(self, email, password):
+        self.email = email
+        self.password = password
+        self.account_id = None
+        self.positions = {}
+        self.session = requests.Session()
+        self.session.auth = (email, password)
+
+class Workload:
+    """
+    A weighted mix of the hot API operations, run against `base_url` by
+    users trading the symbols of `market`.
+
+    Params
+    ------
+    base_url : str
+        Root URL of the app.
+    market : SyntheticMarket
+        Source of the prices the stub serves, used to price trades.
+    symbols : list of str
+        Symbols traded and looked up.
+    mix : dict
+        `{operation: weight}`, see `DEFAULT_MIX`.
+    positions : int
+        Positions every user opens before the run.
+    seed : int
+        Seed of the operation and symbol draws.
+    """
+    def __init__(self, base_url, market, symbols, mix=None, positions=20, seed=0):
+        self.base_url = base_url.rstrip('/')
+        self.market = market
+        self.symbols = symbols
+        self.mix = mix or DEFAULT_MIX
+        self.positions = positions
+        self.seed = seed
+        self.users = []
+
+    def setup(self, count, cash=1000000.0):
+        """
+        Register `count` users, each with an account holding `positions`
+        positions.
+        """
+        run = uuid.uuid4().hex[:8]
+        rng = random.Random(self.seed)
+        for i in range(count):
+            user = User('bench-{}-{}@example.com'.format(run, i), 'benchmark')
+            self._post('/api/users', {'email': user.email, 'password': user.password,
+                'first_name': 'Bench', 'last_name': str(i)}, session=requests)
+            res = self._post('/api/accounts', {'initial_amount': cash}, session=user.session)
+            user.account_id = res.json()['result']['id']
+            for symbol in rng.sample(self.symbols, min(self.positions, len(self.symbols))):
+                self.open_position(user, rng, symbol)
+            self.users.append(user)
+
+    def run(self, concurrency, duration, counters=None):
+        """
+        Run the mix for `duration` seconds from `concurrency` threads. Every
+        user is driven by a single thread, so there must be at least as many
+        users as threads.
+
+        Returns a dict of results, see `summarize`.
+        """
+        if len(self.users) < concurrency:
+            raise ValueError('Need at least as many users ({}) as threads ({})'.format(len(self.users), concurrency))
+        operations = list(self.mix)
+        weights = [self.mix[op] for op in operations]
+        deadline = time.perf_counter() + duration
+
+        def worker(index):
+            rng = random.Random(self.seed + index)
+            users = self.users[index::concurrency]
+            samples = []
+            while time.perf_counter() < deadline:
+                user = rng.choice(users)
+                operation = rng.choices(operations, weights)[0]
+                started = time.perf_counter()
+                try:
+                    status = getattr(self, operation)(user, rng)
+                except requests.RequestException:
+                    status = 0
+                samples.append((operation, status, time.perf_counter() - started))
+            return samples
+
+        before = counters.snapshot() if counters else {}
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            samples = [s for result in executor.map(worker, range(concurrency)) for s in result]
+        elapsed = time.perf_counter() - started
+        after = counters.snapshot() if counters else {}
+        return summarize(samples, elapsed, before, after)
+
+    def get_account(self, user, rng):
+        return user.session.get(self.base_url + '/api/accounts').status_code
+
+    def get_exchange(self, user, rng):
+        params = [('stock', s) for s in rng.sample(self.symbols, min(5, len(self.symbols)))]
+        return user.session.get(self.base_url + '/api/exchange', params=params).status_code
+
+    def deposit(self, user, rng):
+        return user.session.patch(self.base_url + '/api/accounts/deposit', json={'amount': 100}).status_code
+
+    def trade(self, user, rng):
+        """
+        Buy or sell one share of a held position, never closing it.
+        """
+        if not user.positions:
+            return self.open_position(user, rng)
+        symbol = rng.choice(sorted(user.positions))
+        stock_id, shares = user.positions[symbol]
+        trade_type = 'sell' if shares > 1 and rng.random() < 0.5 else 'buy'
+        res = user.session.put('{}/api/accounts/{}/stocks/{}'.format(self.base_url, user.account_id, stock_id),
+            json={'symbol': symbol, 'shares': 1, 'price': self._price(symbol), 'trade_type': trade_type})
+        if res.ok:
+            user.positions[symbol] = (stock_id, shares + (1 if trade_type == 'buy' else -1))
+        return res.status_code
+
+    def open_position(self, user, rng, symbol=None):
+        """
+        Buy a symbol the user doesn't hold yet.
+        """
+        if symbol is None:
+            candidates = [s for s in self.symbols if s not in user.positions]
+            if not candidates:
+                return self.trade(user, rng)
+            symbol = rng.choice(candidates)
+        res = user.session.post('{}/api/accounts/{}/stocks'.format(self.base_url, user.account_id),
+            json={'symbol': symbol, 'shares': 10, 'price': self._price(symbol)})
+        if res.ok:
+            user.positions[symbol] = (res.json()['result']['stock_id'], 10)
+        return res.status_code
+
+    def _price(self, symbol):
+        return self.market.quotes([symbol])[symbol]['latestPrice']
+
+    def _post(self, path, data, session):
+        res = session.post(self.base_url + path, json=data)
+        if not res.ok:
+            raise RuntimeError('POST {} failed with {}: {}'.format(path, res.status_code, res.text[:200]))
+        return res
+
+def percentiles(latencies):
+    values = np.percentile(np.asarray(latencies) * 1000, [50, 95, 99]) if latencies else [None] * 3
+    return {k: round(float(v), 2) if v is not None else None for k, v in zip(('p50_ms', 'p95_ms', 'p99_ms'), values)}
+
+def summarize(samples, elapsed, before, after):
+    """
+    Aggregate `(operation, status, seconds)` samples into overall and
+    per-operation latency percentiles, throughput and error counts, with
+    the server-side counters divided by the number of requests.
+    """
+    total = len(samples)
+    result = {
+        'requests': total,
+        'seconds': round(elapsed, 3),
+        'throughput_rps': round(total / elapsed, 2) if elapsed else None,
+        'errors': sum(1 for _, status, _ in samples if not 200 <= status < 400)
+    }
+    result.update(percentiles([s for _, _, s in samples]))
+    for counter in ('queries', 'upstream_calls'):
+        if before.get(counter) is not None and after.get(counter) is not None and total:
+            result[counter + '_per_request'] = round((after[counter] - before[counter]) / total, 3)
+
+    operations = {}
+    for operation in sorted({op for op, _, _ in samples}):
+        op_samples = [(status, s) for op, status, s in samples if op == operation]
+        operations[operation] = dict({
+            'requests': len(op_samples),
+            'errors': sum(1 for status, _ in op_samples if not 200 <= status < 400)
+        }, **percentiles([s for _, s in op_samples]))
+    result['operations'] = operations
+    return result
+
+# Metrics compared against a baseline, and whether higher values are worse.
+COMPARED = {
+    'p50_ms': True,
+    'p95_ms': True,
+    'p99_ms': True,
+    'throughput_rps': False,
+    'queries_per_request': True,
+    'upstream_calls_per_request': True
+}
+
+def compare(baseline, result, tolerance=0.2):
+    """
+    List the regressions of `result` against `baseline`: latencies, query
+    and upstream call counts more than `tolerance` (a fraction) above the
+    baseline, or a throughput more than `tolerance` below it.
+    """
+    regressions = []
+
+    def check(name, old, new):
+        for metric, higher_is_worse in COMPARED.items():
+            if old.get(metric) is None or new.get(metric) is None:
+                continue
+            limit = old[metric] * (1 + tolerance) if higher_is_worse else old[metric] * (1 - tolerance)
+            if (new[metric] > limit) if higher_is_worse else (new[metric] < limit):
+                regressions.append({'scope': name, 'metric': metric, 'baseline': old[metric], 'result': new[metric]})
+
+    check('overall', baseline, result)
+    for operation, old in baseline.get('operations', {}).items():
+        if operation in result.get('operations', {}):
+            check(operation, old, result['operations'][operation])
+    return regressions
+
+def load_baseline(path):
+    with open(path) as f:
+        return json.load(f)['result']
+
+def save_baseline(path, result, config):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({'config': config, 'result': result}, f, indent=2, sort_keys=True)
+        f.write('\n')
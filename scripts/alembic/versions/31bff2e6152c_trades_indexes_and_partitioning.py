@@ -0,0 +1,123 @@
+"""trades indexes and partitioning
+
+Revision ID: 31bff2e6152c
+Revises: 3e17257ffadd
+Create Date: 2026-10-18 10:12:41.503112
+
+"""
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+
+log = logging.getLogger('alembic.runtime.migration')
+
+
+# revision identifiers, used by Alembic.
+revision = '31bff2e6152c'
+down_revision = '3e17257ffadd'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # `trades` becomes a table partitioned by month on `process_date`. The
+    # primary key of a partitioned table has to include the partition key.
+    # `stock_id` gets no foreign key since positions are deleted once they
+    # are sold off, while their trades are kept.
+    op.rename_table('trades', 'trades_legacy')
+    op.execute("ALTER TABLE trades_legacy RENAME CONSTRAINT trades_pkey TO trades_legacy_pkey")
+    op.execute("""
+        CREATE TABLE trades (
+            id integer NOT NULL DEFAULT nextval('trades_id_seq'),
+            user_id integer NOT NULL REFERENCES users (id),
+            account_id integer NOT NULL REFERENCES accounts (id) ON DELETE CASCADE,
+            stock_id integer NOT NULL,
+            symbol varchar(5),
+            trade_type varchar(4) NOT NULL CHECK (trade_type IN ('buy', 'sell')),
+            process_date timestamp without time zone NOT NULL,
+            price numeric(19, 2) NOT NULL,
+            shares integer NOT NULL,
+            CONSTRAINT trades_pkey PRIMARY KEY (id, process_date)
+        ) PARTITION BY RANGE (process_date)
+    """)
+    op.execute("ALTER SEQUENCE trades_id_seq OWNED BY trades.id")
+
+    op.execute("CREATE TABLE trades_default PARTITION OF trades DEFAULT")
+    op.execute("""
+        CREATE OR REPLACE FUNCTION create_trades_partition(month date) RETURNS text AS $$
+        DECLARE
+            start_date date := date_trunc('month', month);
+            partition_name text := 'trades_' || to_char(start_date, 'YYYY_MM');
+        BEGIN
+            EXECUTE format(
+                'CREATE TABLE IF NOT EXISTS %I PARTITION OF trades FOR VALUES FROM (%L) TO (%L)',
+                partition_name, start_date, start_date + interval '1 month');
+            RETURN partition_name;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    # One partition per month of existing history, plus the next few months.
+    op.execute("""
+        SELECT create_trades_partition(month::date)
+        FROM generate_series(
+            date_trunc('month', COALESCE((SELECT min(process_date) FROM trades_legacy), now())),
+            date_trunc('month', now()) + interval '3 months',
+            interval '1 month'
+        ) AS month
+    """)
+
+    op.create_index('trades_account_id_process_date_idx', 'trades',
+        ['account_id', sa.text('process_date DESC'), sa.text('id DESC')])
+    op.create_index('trades_user_id_process_date_idx', 'trades',
+        ['user_id', sa.text('process_date DESC')])
+    op.create_index('trades_stock_id_idx', 'trades', ['stock_id'])
+
+    # Accounts used to be deleted without their trades, which the new
+    # foreign keys don't allow (and Postgres can't add them NOT VALID to a
+    # partitioned table), so those trades are left behind.
+    orphans = op.get_bind().execute(sa.text("""
+        SELECT t.account_id, count(*)
+        FROM trades_legacy t
+        LEFT JOIN accounts a ON a.id = t.account_id
+        LEFT JOIN users u ON u.id = t.user_id
+        WHERE a.id IS NULL OR u.id IS NULL
+        GROUP BY t.account_id
+        ORDER BY t.account_id
+    """)).fetchall()
+    if orphans:
+        log.warning('Dropping %d trades of deleted accounts or users, of accounts %s',
+            sum(count for _, count in orphans), ', '.join(str(account_id) for account_id, _ in orphans))
+    op.execute("""
+        INSERT INTO trades (id, user_id, account_id, stock_id, symbol, trade_type, process_date, price, shares)
+        SELECT t.id, t.user_id, t.account_id, t.stock_id, s.symbol, t.trade_type, t.process_date, t.price, t.shares
+        FROM trades_legacy t
+        JOIN accounts a ON a.id = t.account_id
+        JOIN users u ON u.id = t.user_id
+        LEFT JOIN stocks s ON s.id = t.stock_id
+    """)
+    op.drop_table('trades_legacy')
+
+
+def downgrade():
+    op.rename_table('trades', 'trades_partitioned')
+    op.execute("ALTER TABLE trades_partitioned RENAME CONSTRAINT trades_pkey TO trades_partitioned_pkey")
+    op.create_table('trades',
+    sa.Column('id', sa.Integer(), server_default=sa.text("nextval('trades_id_seq')"), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('account_id', sa.Integer(), nullable=False),
+    sa.Column('stock_id', sa.Integer(), nullable=False),
+    sa.Column('trade_type', sa.Enum('buy', 'sell', native_enum=False), nullable=False),
+    sa.Column('process_date', sa.DateTime(), nullable=False),
+    sa.Column('price', sa.Numeric(precision=19, scale=2, asdecimal=False), nullable=False),
+    sa.Column('shares', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id', name='trades_pkey')
+    )
+    op.execute("ALTER SEQUENCE trades_id_seq OWNED BY trades.id")
+    op.execute("""
+        INSERT INTO trades (id, user_id, account_id, stock_id, trade_type, process_date, price, shares)
+        SELECT id, user_id, account_id, stock_id, trade_type, process_date, price, shares
+        FROM trades_partitioned
+    """)
+    op.drop_table('trades_partitioned')
+    op.execute("DROP FUNCTION create_trades_partition(date)")
@@ -0,0 +1,70 @@
+"""
+Fixtures for the service tests.
+
+Redis is the server at `TEST_REDIS_URL`, whose database is flushed around
+every test, or fakeredis (with Lua support) if it isn't set. Tests that need
+Postgres use the database at `TEST_DATABASE_URL`, whose tables are dropped
+and recreated, and are skipped if it isn't set.
+"""
+import os
+
+import pytest
+
+from flask import Flask
+from redis import Redis
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker, scoped_session
+
+from trader.database import TraderDB
+from trader.models import Base
+
+@pytest.fixture
+def redis():
+    url = os.environ.get('TEST_REDIS_URL')
+    if url:
+        client = Redis.from_url(url)
+    else:
+        fakeredis = pytest.importorskip('fakeredis')
+        pytest.importorskip('lupa')
+        client = fakeredis.FakeStrictRedis()
+    client.flushdb()
+    yield client
+    client.flushdb()
+
+@pytest.fixture(scope='session')
+def engine():
+    url = os.environ.get('TEST_DATABASE_URL')
+    if not url:
+        pytest.skip('TEST_DATABASE_URL is not set')
+    engine = create_engine(url)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    engine.execute('CREATE TABLE trades_default PARTITION OF trades DEFAULT')
+    yield engine
+    # Closes the connections, and with them the journal's temporary tables.
+    engine.dispose()
+    Base.metadata.drop_all(engine)
+
+@pytest.fixture
+def db(redis, request):
+    """
+    A `TraderDB` on the test Redis, and on the test database for tests that
+    also use the `engine` fixture.
+    """
+    db = TraderDB()
+    db.redis = redis
+    if 'engine' in request.fixturenames:
+        engine = request.getfixturevalue('engine')
+        tables = ', '.join(table.name for table in Base.metadata.sorted_tables)
+        engine.execute('TRUNCATE {} RESTART IDENTITY CASCADE'.format(tables))
+        db.engine = engine
+        db.Session = scoped_session(sessionmaker(bind=engine, expire_on_commit=False))
+    yield db
+    if db.Session is not None:
+        db.Session.remove()
+
+@pytest.fixture
+def app():
+    app = Flask('trader')
+    app.config['TRADE_JOURNAL_ENABLED'] = True
+    return app
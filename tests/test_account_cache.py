@@ -0,0 +1,21 @@
+from types import SimpleNamespace
+
+from flask import Flask
+
+from trader.services.account_cache import AccountCache
+
+def test_trades_mark_the_user_written_before_bumping_the_version(db, redis, monkeypatch):
+    db.replicas = [db.engine]
+    cache = AccountCache()
+    cache.init_app(Flask('trader'), redis, db=db)
+
+    written = []
+    invalidate = cache._invalidate
+    def check(user_id):
+        written.append(redis.exists('db:wrote:{}'.format(user_id)))
+        invalidate(user_id)
+    monkeypatch.setattr(cache, '_invalidate', check)
+
+    cache.on_trade(SimpleNamespace(account=SimpleNamespace(user_id=1)))
+    assert written == [1]
+    assert redis.get('account:ver:1') == b'1'
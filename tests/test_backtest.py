@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+
+from trader.backtest import run_backtest
+
+def panel(rows):
+    return pd.DataFrame(rows, columns=['AAA', 'BBB'], index=pd.date_range('2020-01-01', periods=len(rows)))
+
+def test_orders_within_the_cash_are_filled_in_full():
+    prices = panel([[10.0, 20.0]] * 4)
+    signals = panel([[0.5, 0.25]] * 4)
+    result = run_backtest(prices, signals, initial_cash=1000.0, fee=1.0)
+    assert result.positions[1].tolist() == [50, 12]
+    assert result.cash[-1] == 1000.0 - 500.0 - 240.0 - 2.0
+
+def test_buys_are_cut_down_to_the_cash_available():
+    prices = panel([[10.0, 20.0], [10.0, 20.0], [5.0, 20.0], [5.0, 20.0]])
+    signals = panel([[1.0, 1.0]] * 2 + [[0.0, 1.0]] * 2)
+    result = run_backtest(prices, signals, initial_cash=1000.0, fee=1.0)
+
+    assert result.cash.min() >= 0
+    # Half the cash, less the fees, goes to each symbol.
+    assert result.positions[1].tolist() == [49, 24]
+    # BBB stays short of its target, which doesn't change.
+    assert result.positions[3].tolist() == [0, 24]
+    assert np.isclose(result.equity[-1], result.cash[-1] + 24 * 20.0)
+
+def test_sales_fund_buys_on_the_same_bar():
+    prices = panel([[10.0, 10.0]] * 4)
+    signals = panel([[1.0, 0.0]] * 2 + [[0.0, 1.0]] * 2)
+    result = run_backtest(prices, signals, initial_cash=100.0, fee=1.0)
+    assert result.positions[1].tolist() == [9, 0]
+    assert result.positions[3].tolist() == [0, 9]
+    assert result.cash.min() >= 0
@@ -0,0 +1,22 @@
+from flask import Flask
+
+from trader.services.cache import QuoteCache
+
+def test_invalidate_drops_every_field_of_the_symbol_without_scanning(redis, monkeypatch):
+    cache = QuoteCache()
+    cache.init_app(Flask('trader'), redis)
+    loader = lambda symbols, fields: {s: {f: {'symbol': s, 'field': f} for f in fields} for s in symbols}
+    cache.get_many(['AAPL', 'MSFT'], ['quote', 'chart:1m'], loader)
+    cache.get_many(['AAPL'], ['news:5'], loader)
+    redis.set(cache.key('AAPL', 'lock'), 'token')
+
+    def scan(*args, **kwargs):
+        raise AssertionError('invalidate scanned the keyspace')
+    monkeypatch.setattr(redis, 'scan_iter', scan)
+    monkeypatch.setattr(redis, 'scan', scan)
+    cache.invalidate('aapl')
+
+    assert sorted(k.decode() for k in redis.keys('iex:*:AAPL')) == ['iex:lock:AAPL']
+    assert not [k for k in cache.local.keys() if k.endswith(':AAPL')]
+    assert redis.exists(cache.key('MSFT', 'quote'), cache.key('MSFT', 'chart:1m')) == 2
+    assert redis.smembers(cache.fields_key('MSFT')) == {b'quote', b'chart:1m'}
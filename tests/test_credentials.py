@@ -0,0 +1,26 @@
+from flask import Flask
+
+from trader.models import User
+from trader.services.credentials import CredentialCache
+
+def make_cache(redis):
+    app = Flask('trader')
+    app.config['SECRET_KEY'] = 'secret'
+    cache = CredentialCache()
+    cache.init_app(app, redis)
+    return cache
+
+def test_remember_caches_credentials_at_the_version_read_before(redis):
+    cache = make_cache(redis)
+    user = User(id=1, email='user@example.com', first_name='A', last_name='B')
+    cache.remember('user@example.com', 'password', user, cache.version(1))
+    assert cache.get_user('user@example.com', 'password').id == 1
+
+def test_remember_skips_credentials_changed_since_the_version_was_read(redis):
+    cache = make_cache(redis)
+    user = User(id=1, email='user@example.com', first_name='A', last_name='B')
+    version = cache.version(1)
+    cache.invalidate_user(1)
+    cache.remember('user@example.com', 'password', user, version)
+    assert cache.get_user('user@example.com', 'password') is None
+    assert not redis.keys('auth:cred:*')
@@ -0,0 +1,270 @@
+from datetime import datetime
+from http import HTTPStatus
+from types import SimpleNamespace
+
+import pytest
+
+from trader.lib.definitions import ResponseErrors
+from trader.models import User, Account
+from trader.schemas.dumpers import dump_account, dump_positions
+from trader.services.journal import TradeJournal, FencedOut, cents, dollars
+from trader.services.portfolio import PortfolioRepository
+from trader.services.trading import TradeExecutor, TradeError, Position, apply_balance
+
+NOW = datetime(2020, 1, 2, 15, 30)
+
+# symbol, trade_type, shares, price, open_position
+TRADES = [
+    ('AAA', 'buy', 10, 10.00, True),
+    ('AAA', 'buy', 1, 10.00, True),
+    ('AAA', 'buy', 5, 12.34, False),
+    ('AAA', 'sell', 3, 13.01, False),
+    ('AAA', 'sell', 100, 13.00, False),
+    ('BBB', 'buy', 1, 50.00, False),
+    ('CCC', 'sell', 1, 5.00, False),
+    ('BBB', 'buy', 1000, 50.00, True),
+    ('BBB', 'buy', 7, 33.33, True),
+    ('AAA', 'sell', 12, 11.50, False),
+    ('AAA', 'buy', 4, 9.99, True),
+    ('AAA', 'sell', 4, 10.49, False),
+    ('AAA', 'buy', 2, 10.01, True),
+    ('BBB', 'sell', 7, 30.10, False),
+]
+
+def make_journal(app, db, consumer='test:1'):
+    journal = TradeJournal(db, TradeExecutor(db))
+    journal.init_app(app)
+    journal._consumer = consumer
+    return journal
+
+def seed_ledger(journal, user_id, cash, positions=()):
+    """
+    Write a ledger for `user_id` (whose account id is the same) the way
+    `load_ledger` would, from `(symbol, shares, bought_at)` positions.
+    """
+    key = journal.keys(user_id)['ledger']
+    fields = {'account_id': user_id, 'user_id': user_id, 'cash': cents(cash),
+        'equity': cents(sum(shares*bought_at for _, shares, bought_at in positions)), 'initial': cents(cash)}
+    for i, (symbol, shares, bought_at) in enumerate(positions, 900):
+        fields['pos:' + symbol] = '{},{},{},{},{}'.format(i, shares, cents(bought_at), cents(shares*bought_at),
+            NOW.isoformat())
+    pipe = journal.redis.pipeline()
+    for field, value in fields.items():
+        pipe.hset(key, field, value)
+    pipe.rpush('journal:ids:stocks', *range(1, 100))
+    pipe.rpush('journal:ids:trades', *range(1, 100))
+    pipe.execute()
+
+def trade_data(symbol, trade_type, shares, price):
+    return {'symbol': symbol, 'trade_type': trade_type, 'shares': shares, 'price': price, 'amount': shares*price,
+        'process_date': NOW}
+
+def journal_trade(journal, user_id, symbol, trade_type, shares, price, open_position):
+    try:
+        result = journal.trade(user_id, user_id, trade_data(symbol, trade_type, shares, price), open_position)
+    except TradeError as e:
+        return type(e), e.message
+    assert result is not None
+    return 'ok'
+
+def reference_trade(account, positions, symbol, trade_type, shares, price, open_position):
+    """
+    Apply a trade the way `TradeExecutor.apply_trade` does in the database.
+    """
+    data = trade_data(symbol, trade_type, shares, price)
+    stock = positions.get(symbol)
+    try:
+        if open_position and stock is not None:
+            raise TradeError(ResponseErrors.STOCK_EXISTS, HTTPStatus.METHOD_NOT_ALLOWED)
+        if not open_position and stock is None:
+            raise TradeError(ResponseErrors.STOCK_DNE, HTTPStatus.NOT_FOUND)
+        closed = apply_balance(account, stock, data)
+    except TradeError as e:
+        return type(e), e.message
+
+    if stock is None:
+        positions[symbol] = Position(symbol, shares, price)
+    if closed:
+        del positions[symbol]
+    # Balances are stored to the cent after every trade.
+    account.cash_amount = float(dollars(cents(account.cash_amount)))
+    account.equity_amount = float(dollars(cents(account.equity_amount)))
+    return 'ok'
+
+def decoded(entries):
+    return [{k.decode(): v.decode() for k, v in fields.items()} for _, fields in entries]
+
+@pytest.mark.parametrize('cash, positions, trades', [
+    (1000.00, [], TRADES),
+    (21.99, [], [('AAA', 'buy', 2, 10.00, True), ('AAA', 'sell', 1, 10.00, False),
+        ('AAA', 'buy', 1, 0.01, False)]),
+    (1.98, [('ZZZ', 5, 10.00)], [('ZZZ', 'sell', 1, 10.00, False), ('ZZZ', 'buy', 1, 0.01, False)]),
+    (500.00, [('ZZZ', 5, 10.00)], [('ZZZ', 'buy', 5, 12.00, True), ('ZZZ', 'sell', 5, 9.00, False),
+        ('ZZZ', 'buy', 1, 8.00, True), ('ZZZ', 'sell', 2, 8.00, False)]),
+])
+def test_append_applies_the_account_rules(app, db, cash, positions, trades):
+    journal = make_journal(app, db)
+    seed_ledger(journal, 1, cash, positions)
+    account = SimpleNamespace(cash_amount=cash,
+        equity_amount=float(dollars(cents(sum(shares*bought_at for _, shares, bought_at in positions)))))
+    held = {symbol: Position(symbol, shares, bought_at) for symbol, shares, bought_at in positions}
+
+    for trade in trades:
+        assert journal_trade(journal, 1, *trade) == reference_trade(account, held, *trade), trade
+        ledger, ledger_positions = journal.get_portfolio(1)
+        assert (ledger.cash_amount, ledger.equity_amount) == (account.cash_amount, account.equity_amount), trade
+        assert [(p.symbol, p.shares, p.bought_at) for p in ledger_positions] == \
+            [(p.symbol, p.shares, p.bought_at) for _, p in sorted(held.items())], trade
+
+    entries = decoded(db.redis.xrange(journal.stream))
+    assert len(entries) == db.redis.scard(journal.keys(1)['pending'])
+    if entries:
+        assert (entries[-1]['cash'], entries[-1]['equity']) == \
+            (str(cents(account.cash_amount)), str(cents(account.equity_amount)))
+
+def test_append_refuses_users_on_hold(app, db):
+    journal = make_journal(app, db)
+    seed_ledger(journal, 1, 1000.00)
+    db.redis.set(journal.keys(1)['parked'], 'error')
+    with pytest.raises(TradeError) as e:
+        journal.trade(1, 1, trade_data('AAA', 'buy', 1, 10.00), open_position=True)
+    assert e.value.status_code == HTTPStatus.SERVICE_UNAVAILABLE
+    assert not db.redis.xlen(journal.stream)
+
+def test_claim_pending_takes_over_entries_of_other_consumers(app, db, redis):
+    old, new = make_journal(app, db, 'host:1'), make_journal(app, db, 'host:2')
+    old._ensure_group()
+    ids = [redis.xadd(old.stream, {'n': i}) for i in range(5)]
+    redis.xreadgroup(old.group, old._consumer, {old.stream: '>'}, count=3)
+    redis.xreadgroup(new.group, new._consumer, {new.stream: '>'}, count=1)
+
+    new.batch_size = 2
+    new._claim_pending()
+
+    pending = redis.xpending_range(new.stream, new.group, '-', '+', 10)
+    assert [p['message_id'] for p in pending] == ids[:4]
+    assert {p['consumer'] for p in pending} == {b'host:2'}
+    assert [c['name'] for c in redis.xinfo_consumers(new.stream, new.group)] in ([b'host:2'], ['host:2'])
+    reply = redis.xreadgroup(new.group, new._consumer, {new.stream: '0'})
+    assert [entry_id for entry_id, _ in reply[0][1]] == ids[:4]
+
+def test_flush_releases_entries_deleted_in_flight(app, db, redis):
+    journal = make_journal(app, db)
+    journal.lock_wait = 0.1
+    journal._ensure_group()
+    seed_ledger(journal, 1, 1000.00)
+    journal_trade(journal, 1, 'AAA', 'buy', 10, 10.00, True)
+    # Read by a flush that failed, then deleted before the next one.
+    [(_, [(entry_id, _)])] = redis.xreadgroup(journal.group, journal._consumer, {journal.stream: '>'})
+    redis.xdel(journal.stream, entry_id)
+
+    assert journal.flush() == 0
+    assert not redis.scard(journal.keys(1)['pending'])
+    assert not redis.hlen(journal.owners)
+    assert not redis.xpending(journal.stream, journal.group)['pending']
+    with journal.exclusive(1):
+        pass
+
+@pytest.fixture
+def accounts(db, engine):
+    with db.session_scope() as session:
+        for user_id in (1, 2):
+            session.add(User(id=user_id, email='user{}@example.com'.format(user_id), password=b'x', salt=b'x'))
+            session.flush()
+            session.add(Account(id=user_id, user_id=user_id, cash_amount=10000, equity_amount=0,
+                initial_amount=10000))
+
+def snapshot(engine):
+    return [engine.execute(query).fetchall() for query in (
+        'SELECT * FROM trades ORDER BY id',
+        'SELECT * FROM stocks ORDER BY id',
+        'SELECT * FROM accounts ORDER BY id')]
+
+def dump_portfolio(account, positions):
+    data = dump_account(account)
+    data['stocks'] = dump_positions(positions)
+    return data
+
+def test_write_is_idempotent(app, db, engine, accounts):
+    journal = make_journal(app, db)
+    journal._epoch = journal.take_epoch()
+    for user_id in (1, 2):
+        for trade in TRADES:
+            journal_trade(journal, user_id, *trade)
+    entries = decoded(db.redis.xrange(journal.stream))
+
+    journal.write(entries)
+    written = snapshot(engine)
+    journal.write(entries)
+    assert snapshot(engine) == written
+    assert len(written[0]) == len(entries)
+
+    with db.session_scope() as session:
+        for user_id in (1, 2):
+            stored = PortfolioRepository(session).get_portfolio(user_id)
+            assert dump_portfolio(*stored) == dump_portfolio(*journal.get_portfolio(user_id))
+
+def test_write_is_fenced_off_after_a_takeover(app, db, engine, accounts):
+    old, new = make_journal(app, db, 'host:1'), make_journal(app, db, 'host:2')
+    old._epoch = old.take_epoch()
+    journal_trade(old, 1, 'AAA', 'buy', 10, 10.00, True)
+    entries = decoded(db.redis.xrange(old.stream))
+
+    new._epoch = new.take_epoch()
+    before = snapshot(engine)
+    with pytest.raises(FencedOut):
+        old.write(entries)
+    assert snapshot(engine) == before
+    new.write(entries)
+    assert snapshot(engine) != before
+
+def flush(journal):
+    journal._recovering = False
+    while journal.flush():
+        pass
+
+def test_flush_parks_entries_the_database_rejects(app, db, engine, accounts):
+    journal = make_journal(app, db)
+    assert journal._lead()
+    journal_trade(journal, 1, 'AAA', 'buy', 10, 10.00, True)
+    journal_trade(journal, 1, 'TOOLONG', 'buy', 1, 10.00, True)
+    journal_trade(journal, 1, 'AAA', 'sell', 5, 12.00, False)
+    journal_trade(journal, 2, 'BBB', 'buy', 3, 7.50, True)
+    flush(journal)
+
+    assert engine.execute('SELECT account_id, symbol, shares FROM stocks ORDER BY id').fetchall() == \
+        [(1, 'AAA', 10), (2, 'BBB', 3)]
+    parked = journal.parked()
+    assert list(parked) == ['1'] and parked['1'][0] == 2
+    assert not db.redis.scard(journal.keys(1)['pending'])
+    assert not db.redis.xlen(journal.stream)
+
+    assert journal_trade(journal, 1, 'AAA', 'buy', 1, 10.00, False) == (TradeError, ResponseErrors.ACCOUNT_ON_HOLD)
+    with pytest.raises(TradeError):
+        with journal.exclusive(1):
+            pass
+    assert journal_trade(journal, 2, 'BBB', 'buy', 1, 7.50, False) == 'ok'
+
+    assert journal.resolve(1, requeue=False) == 2
+    assert journal.parked() == {}
+    assert journal_trade(journal, 1, 'AAA', 'sell', 10, 12.00, False) == 'ok'
+    flush(journal)
+    assert engine.execute('SELECT account_id, symbol, shares FROM stocks ORDER BY id').fetchall() == \
+        [(2, 'BBB', 4)]
+
+def test_requeued_entries_are_written_once_fixed(app, db, engine, accounts):
+    journal = make_journal(app, db)
+    assert journal._lead()
+    engine.execute('DROP TABLE trades_default')
+    try:
+        journal_trade(journal, 1, 'AAA', 'buy', 10, 10.00, True)
+        flush(journal)
+        assert list(journal.parked()) == ['1']
+    finally:
+        engine.execute('CREATE TABLE IF NOT EXISTS trades_default PARTITION OF trades DEFAULT')
+
+    assert journal.resolve(1) == 1
+    flush(journal)
+    assert journal.parked() == {}
+    assert not db.redis.exists(journal.keys(1)['parked'])
+    assert engine.execute('SELECT account_id, symbol, shares FROM trades').fetchall() == [(1, 'AAA', 10)]
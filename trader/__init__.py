@@ -2,7 +2,6 @@ import os
 import sys
 import base64
 import logging
-import logging.handlers
 import datetime
 import traceback
 
@@ -13,21 +12,14 @@ from flask_wtf.csrf import CSRFProtect
 
 from trader.config import DevConfig, ProdConfig
 from trader.models import User
-from trader.extensions import ma, db
+from trader.extensions import ma, db, quote_cache, iex_api, price_stream, trade_executor, \
+    credential_cache, price_store, valuation_job, leaderboard, order_engine, \
+    replay_engine, metrics, account_cache, trade_journal
 from trader.views.auth import auth_bp, authenticate_user
 from trader.resources import api_blueprints
+from trader.commands import commands
 from trader.lib.definitions import ResponseErrors
-
-# Simple logging setup
-file_handler = logging.handlers.RotatingFileHandler('./logs/trading-simulator.log', maxBytes=10000)
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        file_handler,
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+from trader.lib import log
 
 def create_app():
     app = Flask(__name__, template_folder='templates', static_folder='frontend')
@@ -38,7 +30,23 @@ def create_app():
     else:
         app.config.from_object(DevConfig)
 
+    log.init_app(app)
     db.init_app(app)
+    quote_cache.init_app(app, db.redis)
+    price_store.init_app(app)
+    iex_api.init_app(app, quote_cache, price_store)
+    price_stream.init_app(app, iex_api)
+    trade_executor.init_app(app)
+    trade_journal.init_app(app)
+    app.before_first_request(trade_journal.start)
+    valuation_job.init_app(app)
+    leaderboard.init_app(app, db.redis, trade_executor, price_stream)
+    order_engine.init_app(app, price_stream)
+    app.before_first_request(order_engine.start)
+    replay_engine.init_app(app, price_store)
+    credential_cache.init_app(app, db.redis)
+    account_cache.init_app(app, db.redis, trade_executor, db)
+    metrics.init_app(app, db, iex_api)
 
     csrf = CSRFProtect(app)
 
@@ -50,8 +58,14 @@ def create_app():
 
     @login_manager.user_loader
     def load_user(user_id):
+        user = credential_cache.get_profile(user_id)
+        if user:
+            return user
         with db.session_scope() as session:
-            return session.query(User).filter_by(id=user_id).first()
+            user = session.query(User).filter_by(id=user_id).first()
+            if user:
+                credential_cache.set_profile(user)
+            return user
         return False
 
     @login_manager.request_loader
@@ -60,6 +74,10 @@ def create_app():
             return None
         
         auth_header = request.headers.get('Authorization')
+        if auth_header and auth_header.startswith('Bearer '):
+            if not credential_cache.tokens_enabled:
+                return None
+            return credential_cache.verify_token(auth_header.replace('Bearer ', '', 1))
         if auth_header:
             auth_header = auth_header.replace('Basic ', '', 1)
         try:
@@ -117,4 +135,7 @@ def create_app():
             app.register_blueprint(bp[0], url_prefix='/api{}'.format(bp[1]))
         app.register_blueprint(auth_bp)
 
+    for command in commands:
+        app.cli.add_command(command)
+
     return app
\ No newline at end of file
@@ -0,0 +1,3 @@
+""" Vectorized backtesting over historical price panels """
+from .engine import run_backtest, BacktestResult
+from .strategies import STRATEGIES, sma_crossover, momentum
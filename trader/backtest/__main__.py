@@ -0,0 +1,76 @@
+import os
+import sys
+import json
+import argparse
+
+import pandas as pd
+
+from trader.config import DevConfig, ProdConfig
+from trader.models import Account
+from trader.backtest import run_backtest, STRATEGIES
+from trader.services.market_data.store import PriceStore
+
+def load_prices(path):
+    """
+    Load a price panel from a CSV file, either wide (a date column followed
+    by one close price column per symbol) or long (`date`, `symbol`,
+    `close` columns).
+    """
+    frame = pd.read_csv(path)
+    columns = {c.lower(): c for c in frame.columns}
+    if {'date', 'symbol', 'close'}.issubset(columns):
+        frame = frame.pivot(index=columns['date'], columns=columns['symbol'], values=columns['close'])
+    else:
+        frame = frame.set_index(frame.columns[0])
+    frame.index = pd.to_datetime(frame.index)
+    return frame.sort_index()
+
+def open_store(path=None):
+    """
+    The local price store at `path`, or where the app is configured to
+    keep it, without creating the app.
+    """
+    config = ProdConfig if os.environ.get('FLASK_ENV') == 'production' else DevConfig
+    store = PriceStore(path or config.PRICE_STORE_PATH)
+    store.max_staleness = config.PRICE_STORE_MAX_STALENESS
+    return store
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='python -m trader.backtest',
+        description='Backtest a strategy over a historical price panel.')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--prices', help='CSV file of close prices.')
+    source.add_argument('--store', nargs='?', const='', metavar='PATH',
+        help='Read close prices from the local price store at PATH (default: PRICE_STORE_PATH).')
+    parser.add_argument('--symbols', help='Comma separated symbols to read from the store (default: all).')
+    parser.add_argument('--start', help='First date to backtest.')
+    parser.add_argument('--end', help='Last date to backtest.')
+    parser.add_argument('--strategy', choices=sorted(STRATEGIES), default='sma')
+    parser.add_argument('--param', action='append', default=[], metavar='NAME=VALUE',
+        help='Strategy parameter, e.g. --param fast=10. May be repeated.')
+    parser.add_argument('--cash', type=float, default=100000.0, help='Initial cash.')
+    parser.add_argument('--fee', type=float, default=Account.BROKERAGE_FEE, help='Flat fee per trade.')
+    parser.add_argument('--output', help='Write the per-bar equity curve to this CSV file.')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    params = dict(p.split('=', 1) for p in args.param)
+    params = {k: int(v) for k, v in params.items()}
+
+    if args.store is not None:
+        store = open_store(args.store)
+        symbols = args.symbols.split(',') if args.symbols else store.symbols()
+        prices = store.read_panel(symbols, args.start, args.end)
+    else:
+        prices = load_prices(args.prices).loc[args.start:args.end]
+    signals = STRATEGIES[args.strategy](prices, **params)
+    result = run_backtest(prices, signals, initial_cash=args.cash, fee=args.fee)
+
+    if args.output:
+        result.to_frame().to_csv(args.output)
+    json.dump(result.summary(), sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+import numpy as np
+import pandas as pd
+
+from trader.models import Account
+
+class BacktestResult:
+    """
+    Outcome of a backtest. Every per-bar series is aligned with the index of
+    the price panel it was run on.
+    """
+    def __init__(self, index, symbols, positions, trades, cash, market_value, fees, initial_cash):
+        self.index = index
+        self.symbols = symbols
+        self.positions = positions
+        self.trades = trades
+        self.cash = cash
+        self.market_value = market_value
+        self.fees = fees
+        self.initial_cash = initial_cash
+        self.equity = cash + market_value
+
+    def returns(self):
+        previous = np.concatenate(([self.initial_cash], self.equity[:-1]))
+        return self.equity / previous - 1
+
+    def summary(self, periods_per_year=252):
+        """
+        Headline statistics: total and annualized return, volatility, Sharpe
+        ratio, maximum drawdown, trade count and fees.
+        """
+        returns = self.returns()
+        years = max(len(returns) / periods_per_year, 1e-9)
+        final = self.equity[-1] if len(self.equity) else self.initial_cash
+        volatility = returns.std() * np.sqrt(periods_per_year) if len(returns) > 1 else 0.0
+        peak = np.maximum.accumulate(self.equity) if len(self.equity) else np.array([self.initial_cash])
+        drawdown = (self.equity / peak - 1).min() if len(self.equity) else 0.0
+
+        return {
+            'start': str(self.index[0]) if len(self.index) else None,
+            'end': str(self.index[-1]) if len(self.index) else None,
+            'initial_cash': round(float(self.initial_cash), 2),
+            'final_equity': round(float(final), 2),
+            'total_return': float(final / self.initial_cash - 1),
+            'annual_return': float((final / self.initial_cash) ** (1 / years) - 1) if final > 0 else -1.0,
+            'annual_volatility': float(volatility),
+            'sharpe': float(returns.mean() * periods_per_year / volatility) if volatility else 0.0,
+            'max_drawdown': float(drawdown),
+            'trades': int(np.count_nonzero(self.trades)),
+            'fees': round(float(self.fees.sum()), 2),
+            'min_cash': round(float(self.cash.min()), 2) if len(self.cash) else float(self.initial_cash)
+        }
+
+    def to_frame(self):
+        return pd.DataFrame({
+            'cash': self.cash,
+            'market_value': self.market_value,
+            'equity': self.equity,
+            'fees': self.fees
+        }, index=self.index)
+
+def run_backtest(prices, signals, initial_cash=100000.0, fee=Account.BROKERAGE_FEE, mode='weights', lag=1):
+    """
+    Simulate trading `signals` over a panel of `prices`.
+
+    All bars and symbols are processed at once with array operations; there
+    is no per-bar loop. Orders fill at the close of the bar they are executed
+    on and every change in a symbol's position pays a flat `fee`, as a trade
+    through `StockResource` does.
+
+    Cash never goes negative: if the orders would overdraw it, only the bars
+    with orders are replayed in turn, and on each the buys are cut down to
+    the cash left after that bar's sales and fees (see `_fund_orders`).
+
+    Params
+    ------
+    prices : DataFrame or ndarray
+        Close prices, one row per bar and one column per symbol. Missing
+        prices (e.g. before a listing) may be NaN.
+    signals : DataFrame or ndarray
+        Same shape as `prices`. Target portfolio weights when `mode` is
+        'weights', or target share counts when `mode` is 'shares'.
+    initial_cash : float
+        Starting cash.
+    fee : float
+        Flat fee per trade; defaults to `Account.BROKERAGE_FEE`.
+    mode : str
+        'weights' sizes each position as its weight times `initial_cash`,
+        fixed at the bar the weight changes. 'shares' holds the given counts.
+    lag : int
+        Number of bars between a signal and its execution, 1 to trade on the
+        close after the signal was computed and avoid look-ahead.
+    """
+    index = prices.index if isinstance(prices, pd.DataFrame) else pd.RangeIndex(len(prices))
+    symbols = list(prices.columns) if isinstance(prices, pd.DataFrame) else list(range(np.shape(prices)[1]))
+    price = np.asarray(prices, dtype=np.float64)
+    signal = np.asarray(signals, dtype=np.float64)
+    if price.shape != signal.shape:
+        raise ValueError('prices and signals must have the same shape')
+    if mode not in ('weights', 'shares'):
+        raise ValueError("mode must be 'weights' or 'shares'")
+
+    # Last known price for valuation, 0 before a symbol's first price.
+    filled = _ffill(price)
+    tradable = ~np.isnan(filled)
+    filled = np.where(tradable, filled, 0.0)
+
+    signal = np.nan_to_num(_shift(signal, lag))
+    if mode == 'weights':
+        target = _hold_on_change(signal, filled, initial_cash)
+    else:
+        target = np.trunc(signal)
+
+    # Positions can only change while a price is available.
+    changeable = tradable & ~np.isnan(price)
+    positions = _ffill(np.where(changeable, target, np.nan))
+    positions = np.nan_to_num(positions)
+
+    trades, fees, cash = _settle(positions, filled, initial_cash, fee)
+    if len(cash) and cash.min() < -1e-6:
+        positions = _fund_orders(trades, positions, filled, initial_cash, fee)
+        trades, fees, cash = _settle(positions, filled, initial_cash, fee)
+    market_value = (positions * filled).sum(axis=1)
+
+    return BacktestResult(index, symbols, positions, trades, cash, market_value, fees, initial_cash)
+
+def _settle(positions, price, initial_cash, fee):
+    """
+    Trades, fees and cash of each bar for holding `positions`.
+    """
+    trades = np.diff(positions, axis=0, prepend=np.zeros((1, positions.shape[1])))
+    fees = np.count_nonzero(trades, axis=1) * fee
+    cash = initial_cash - np.cumsum((trades * price).sum(axis=1) + fees)
+    return trades, fees, cash
+
+def _fund_orders(trades, target, price, initial_cash, fee):
+    """
+    Positions reached by placing the orders of `trades` bar by bar with the
+    cash available, as `apply_balance` refuses buys an account can't pay
+    for. On each bar with orders, sales go first and the buys are scaled
+    down together to what is left. A position cut short stays short until
+    its target changes again.
+    """
+    positions = np.zeros_like(target)
+    held = np.zeros(target.shape[1])
+    cash, last = initial_cash, 0
+    for bar in np.flatnonzero(np.any(trades != 0, axis=1)):
+        positions[last:bar] = held
+        orders = np.where(trades[bar] != 0, target[bar] - held, 0.0)
+        sells, buys = np.minimum(orders, 0.0), np.maximum(orders, 0.0)
+        cash -= (sells * price[bar]).sum() + np.count_nonzero(sells) * fee
+
+        cost = (buys * price[bar]).sum()
+        if cost + np.count_nonzero(buys) * fee > cash:
+            buys = np.floor(buys * max(cash - np.count_nonzero(buys) * fee, 0.0) / cost)
+        cash -= (buys * price[bar]).sum() + np.count_nonzero(buys) * fee
+        held = held + sells + buys
+        last = bar
+    positions[last:] = held
+    return positions
+
+def _shift(values, periods):
+    if periods <= 0:
+        return values
+    shifted = np.full_like(values, np.nan)
+    shifted[periods:] = values[:-periods]
+    return shifted
+
+def _ffill(values):
+    """
+    Forward fill NaNs down each column.
+    """
+    rows = np.where(np.isnan(values), 0, np.arange(values.shape[0])[:, None])
+    np.maximum.accumulate(rows, axis=0, out=rows)
+    return values[rows, np.arange(values.shape[1])]
+
+def _hold_on_change(weights, price, capital):
+    """
+    Convert target weights into share counts sized at the bar each weight
+    changes, then held until the next change.
+    """
+    previous = np.vstack((np.zeros((1, weights.shape[1])), weights[:-1]))
+    changed = weights != previous
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shares = np.where(price > 0, np.floor(weights * capital / price), 0.0)
+
+    rows = np.where(changed, np.arange(weights.shape[0])[:, None], 0)
+    np.maximum.accumulate(rows, axis=0, out=rows)
+    held = shares[rows, np.arange(weights.shape[1])]
+    # Nothing is held before the first change.
+    return np.where(np.maximum.accumulate(changed, axis=0), held, 0.0)
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+
+def sma_crossover(prices, fast=20, slow=50):
+    """
+    Hold every symbol whose fast moving average is above its slow moving
+    average, each with an equal slice of the capital.
+    """
+    fast_ma = prices.rolling(fast, min_periods=fast).mean()
+    slow_ma = prices.rolling(slow, min_periods=slow).mean()
+    return _equal_weight((fast_ma > slow_ma).to_numpy(), prices, prices.shape[1])
+
+def momentum(prices, lookback=126, top=10, rebalance=21):
+    """
+    Every `rebalance` bars, hold the `top` symbols with the highest return
+    over the last `lookback` bars, equally weighted.
+    """
+    trailing = (prices / prices.shift(lookback) - 1).to_numpy()
+    trailing = np.where(np.isnan(trailing), -np.inf, trailing)
+
+    ranks = np.argsort(np.argsort(-trailing, axis=1), axis=1)
+    held = (ranks < top) & np.isfinite(trailing)
+
+    # Only change holdings on rebalance bars.
+    rows = np.arange(len(prices))
+    rows = np.where(rows % rebalance == 0, rows, 0)
+    np.maximum.accumulate(rows, out=rows)
+    return _equal_weight(held[rows], prices, top)
+
+def _equal_weight(held, prices, slots):
+    """
+    Give each held symbol a fixed 1/`slots` weight, so a symbol's weight
+    only changes when it enters or leaves the portfolio.
+    """
+    weights = held.astype(np.float64) / max(slots, 1)
+    return pd.DataFrame(weights, index=prices.index, columns=prices.columns)
+
+STRATEGIES = {
+    'sma': sma_crossover,
+    'momentum': momentum
+}
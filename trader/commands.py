@@ -0,0 +1,167 @@
+import click
+
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import text
+
+from trader.extensions import db, iex_api, price_store, valuation_job, leaderboard, trade_journal
+from trader.services.third_party.iex import Chart
+from trader.services.market_data.synthetic import SyntheticMarket, TRADING_DAYS, MINUTES_PER_DAY
+from trader.services.market_data.providers import PROVIDERS
+from trader.services.market_data.stub_server import StubServer
+from trader.services.valuation import ValuationError
+
+@click.command('create-trade-partitions')
+@click.option('--months', default=3, help='Number of months ahead to create partitions for.')
+@with_appcontext
+def create_trade_partitions(months):
+    """
+    Create the monthly `trades` partitions for the current month and the
+    next `months` months. Meant to be run periodically (e.g. from cron) so
+    trades never land in the default partition.
+    """
+    with db.session_scope() as session:
+        rows = session.execute(text("""
+            SELECT create_trades_partition(month::date)
+            FROM generate_series(date_trunc('month', now()),
+                date_trunc('month', now()) + make_interval(months => :months), interval '1 month') AS month
+        """), {'months': months}).fetchall()
+    for row in rows:
+        click.echo(row[0])
+
+@click.command('ingest-prices')
+@click.argument('symbols', nargs=-1)
+@click.option('--source', type=click.Choice(['iex', 'yfinance', 'csv']), default='iex')
+@click.option('--range', 'range_', default='1m', help='IEX chart range to fetch, e.g. 1m, 1y, 5y.')
+@click.option('--csv', 'csv_path', type=click.Path(exists=True), help='CSV file to ingest with --source csv.')
+@click.option('--start', help='First date to download with --source yfinance.')
+@with_appcontext
+def ingest_prices(symbols, source, range_, csv_path, start):
+    """
+    Ingest daily bars for SYMBOLS into the local price store. Bars already
+    stored are left alone, so this can safely be re-run (e.g. nightly).
+    """
+    if source == 'csv':
+        if not csv_path:
+            raise click.UsageError('--csv is required with --source csv')
+        written = price_store.ingest_csv(csv_path, symbols[0] if len(symbols) == 1 else None)
+    elif source == 'yfinance':
+        written = price_store.ingest_yfinance(symbols or price_store.symbols(), start=start)
+    else:
+        charts = iex_api._fetch_one(symbols or price_store.symbols(), Chart(range_))
+        if charts is False:
+            raise click.ClickException('Could not fetch charts from IEX')
+        written = sum(price_store.ingest_iex_chart(symbol, chart) for symbol, chart in charts.items())
+    click.echo('{} bars written'.format(written))
+
+@click.command('generate-prices')
+@click.argument('symbols', nargs=-1)
+@click.option('--count', default=100, help='Number of symbols to generate when none are given.')
+@click.option('--start', default='2015-01-01', help='Date of the first bar.')
+@click.option('--years', default=1.0, help='Years of bars to generate.')
+@click.option('--freq', type=click.Choice(['1d', '1min']), default='1d')
+@with_appcontext
+def generate_prices(symbols, count, start, years, freq):
+    """
+    Fill the local price store with synthetic bars for SYMBOLS (or `--count`
+    made up symbols), for load tests and sandboxes without network access.
+    The same arguments and `SYNTHETIC_SEED` always generate the same bars.
+    """
+    market = SyntheticMarket()
+    market.init_app(current_app)
+    symbols = symbols or ['S{:04d}'.format(i) for i in range(count)]
+    periods = int(years * TRADING_DAYS * (MINUTES_PER_DAY if freq == '1min' else 1))
+    written = market.write_history(price_store, symbols, start, periods, freq)
+    click.echo('{} bars written for {} symbols'.format(written, len(symbols)))
+
+@click.command('iex-stub')
+@click.option('--source', type=click.Choice(sorted(PROVIDERS)), default='recorded',
+    help='Provider whose responses are served.')
+@click.option('--recordings', type=click.Path(), help='Recordings to serve with --source recorded.')
+@click.option('--host', default='127.0.0.1')
+@click.option('--port', default=8765)
+@click.option('--latency', default=0.0, help='Mean delay of a response in seconds.')
+@click.option('--jitter', default=0.0, help='Standard deviation of the delay in seconds.')
+@click.option('--error-rate', default=0.0, help='Fraction of requests failing with --error-status.')
+@click.option('--error-status', default=503)
+@click.option('--seed', type=int, help='Seed of the latency and error draws.')
+@with_appcontext
+def iex_stub(source, recordings, host, port, latency, jitter, error_rate, error_status, seed):
+    """
+    Serve market data over the IEX batch and search endpoints with injected
+    latency and errors. Point `IEX_API_URL` of the app under test at the
+    printed URL and keep `MARKET_DATA_SOURCE=iex`.
+    """
+    provider = PROVIDERS[source]()
+    if recordings and source == 'recorded':
+        provider.path = recordings
+        provider.load()
+    else:
+        provider.init_app(current_app)
+
+    server = StubServer(provider, host, port, latency, jitter, error_rate, error_status, seed)
+    click.echo('Serving {} market data on {}'.format(source, server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        click.echo('{} requests, {} injected errors'.format(server.requests, server.errors))
+
+@click.command('value-accounts')
+@with_appcontext
+def value_accounts():
+    """
+    Mark every account to market at the latest quotes and store the results
+    in `account_valuations`. Meant to be run periodically (e.g. nightly).
+    """
+    try:
+        summary = valuation_job.run()
+    except ValuationError as e:
+        raise click.ClickException(str(e))
+    click.echo(', '.join('{}: {}'.format(k, v) for k, v in summary.items()))
+
+@click.command('rebuild-leaderboard')
+@with_appcontext
+def rebuild_leaderboard():
+    """
+    Rebuild the leaderboard in Redis from every account and position in the
+    database, valued at the latest quotes.
+    """
+    if not leaderboard.enabled:
+        raise click.ClickException('The leaderboard is not enabled')
+    click.echo('{} accounts ranked'.format(leaderboard.rebuild(db, iex_api)))
+
+@click.command('journal-dead-letters')
+@with_appcontext
+def journal_dead_letters():
+    """
+    List the users on hold because the database rejected some of their
+    trade journal entries, with the number of parked entries and the first
+    error.
+    """
+    if not trade_journal.enabled:
+        raise click.ClickException('The trade journal is not enabled')
+    for user_id, (count, error) in sorted(trade_journal.parked().items(), key=lambda item: int(item[0])):
+        click.echo('{}: {} entries, {}'.format(user_id, count, error))
+
+@click.command('journal-resolve')
+@click.argument('user_id', type=int)
+@click.option('--discard', is_flag=True, help='Drop the parked entries instead of writing them again.')
+@with_appcontext
+def journal_resolve(user_id, discard):
+    """
+    Take USER_ID off hold, writing its parked trade journal entries again
+    once whatever the database rejected them for is fixed, or dropping them
+    with --discard, which reverts the account to what the database holds.
+    """
+    if not trade_journal.enabled:
+        raise click.ClickException('The trade journal is not enabled')
+    count = trade_journal.resolve(user_id, requeue=not discard)
+    if count is None:
+        raise click.ClickException('User {} still has trade journal entries in flight, try again'.format(user_id))
+    click.echo('{} entries {}'.format(count, 'discarded' if discard else 'requeued'))
+
+commands = [create_trade_partitions, ingest_prices, generate_prices, iex_stub, value_accounts, rebuild_leaderboard,
+    journal_dead_letters, journal_resolve]
@@ -9,6 +9,124 @@ class BaseConfig:
     TEMPLATES_FOLDER = 'templates'
     WEBPACK_DEV_SERVER = 'http://localhost:9000'
 
+    # Database connection pools, shared by the primary and the read replicas
+    # (seconds). Reads of a user stay on the primary for
+    # DATABASE_READ_YOUR_WRITES after they write.
+    DATABASE_POOL_SIZE = 10
+    DATABASE_MAX_OVERFLOW = 20
+    DATABASE_POOL_TIMEOUT = 30
+    DATABASE_POOL_RECYCLE = 1800
+    DATABASE_POOL_PRE_PING = True
+    DATABASE_REPLICA_HOSTS = [h for h in environ.get('DATABASE_REPLICA_HOSTS', '').split(',') if h]
+    DATABASE_READ_YOUR_WRITES = 5
+
+    # Market data cache (seconds)
+    QUOTE_CACHE_TTL = {'quote': 5, 'news': 300, 'chart': 3600}
+    QUOTE_CACHE_LOCAL_SIZE = 2048
+    QUOTE_CACHE_LOCAL_TTL = 1
+    QUOTE_CACHE_LOCK_TIMEOUT = 5
+    QUOTE_CACHE_LOCK_WAIT = 2
+
+    # IEX HTTP client
+    IEX_POOL_SIZE = 10
+    IEX_CONNECT_TIMEOUT = 3.05
+    IEX_READ_TIMEOUT = 10
+    IEX_MAX_RETRIES = 2
+    IEX_RETRY_BACKOFF = 0.2
+    IEX_BATCH_LIMIT = 100
+    IEX_BATCH_WINDOW = 0.005
+    IEX_BATCH_WORKERS = 4
+
+    # Market data source: 'iex', 'yfinance', 'recorded' (responses recorded
+    # with MARKET_DATA_RECORD), 'memory' or 'synthetic'
+    MARKET_DATA_SOURCE = environ.get('MARKET_DATA_SOURCE', 'iex')
+    MARKET_DATA_RECORD = environ.get('MARKET_DATA_RECORD') == '1'
+    MARKET_DATA_RECORDINGS = path.join(path.dirname(path.dirname(path.abspath(__file__))), 'data', 'recordings')
+    SYNTHETIC_SEED = 0
+    SYNTHETIC_CORRELATION = 0.3
+    SYNTHETIC_JUMP_INTENSITY = 2.0
+    SYNTHETIC_SPEED = 1.0
+    SYNTHETIC_TICK = 1.0
+
+    # Local historical price store
+    PRICE_STORE_PATH = path.join(path.dirname(path.dirname(path.abspath(__file__))), 'data', 'prices')
+    PRICE_STORE_MAX_STALENESS = 4
+    PRICE_STORE_QUEUE_SIZE = 256
+
+    # Server-sent price updates (seconds)
+    STREAM_POLL_INTERVAL = 5
+    STREAM_HEARTBEAT = 15
+    STREAM_QUEUE_SIZE = 100
+    STREAM_MAX_SYMBOLS = 50
+
+    # Trade execution
+    TRADE_MAX_RETRIES = 3
+    TRADE_LOCK_WAIT_WARNING = 0.5
+    TRADE_BATCH_LIMIT = 100
+
+    # Write-behind trade journal (seconds). Single trades are checked against
+    # a ledger in Redis and acknowledged once appended to a Redis Stream, and
+    # written to the database in batches of up to TRADE_JOURNAL_BATCH_SIZE.
+    TRADE_JOURNAL_ENABLED = environ.get('TRADE_JOURNAL_ENABLED') == '1'
+    TRADE_JOURNAL_BATCH_SIZE = 1000
+    TRADE_JOURNAL_FLUSH_INTERVAL = 0.05
+    TRADE_JOURNAL_LEASE = 10
+    TRADE_JOURNAL_LEDGER_TTL = 86400
+    TRADE_JOURNAL_LOCK_TIMEOUT = 10
+    TRADE_JOURNAL_LOCK_WAIT = 5
+    TRADE_JOURNAL_ID_BLOCK = 1000
+
+    # Resting limit and stop orders (seconds)
+    ORDERS_ENABLED = True
+    ORDER_RELOAD_INTERVAL = 30
+
+    # Historical replay sessions (speed in simulated seconds per second)
+    REPLAY_MAX_SESSIONS = 500
+    REPLAY_MAX_SESSIONS_PER_USER = 3
+    REPLAY_MAX_SYMBOLS = 20
+    REPLAY_MAX_STEP_DELAY = 5
+    REPLAY_DEFAULT_SPEED = 86400
+    REPLAY_SESSION_TTL = 600
+
+    # Batch mark-to-market
+    VALUATION_CHUNK_SIZE = 100000
+    VALUATION_WRITE_BATCH = 5000
+
+    # Cached account views, without prices (seconds)
+    ACCOUNT_CACHE_ENABLED = True
+    ACCOUNT_CACHE_TTL = 300
+    ACCOUNT_CACHE_RETRY_INTERVAL = 1
+
+    # Leaderboard
+    LEADERBOARD_ENABLED = True
+
+    # Logging, written from a background thread
+    LOG_LEVEL = 'INFO'
+    LOG_FORMAT = 'text'
+    LOG_FILE = './logs/trading-simulator.log'
+    LOG_FILE_MAX_BYTES = 10 * 1024 * 1024
+    LOG_FILE_BACKUPS = 5
+    LOG_QUEUE_SIZE = 10000
+    LOG_DEBUG_SAMPLE_RATE = 1.0
+
+    # Request instrumentation and /metrics. Without a token, /metrics is
+    # only served in debug mode.
+    METRICS_ENABLED = True
+    METRICS_TOKEN = environ.get('METRICS_TOKEN')
+    METRICS_TIMING_HEADERS = True
+    METRICS_SLOW_QUERY_MS = 200
+    METRICS_PROFILING_ENABLED = False
+    METRICS_PROFILE_RATE = 0.0
+    METRICS_PROFILE_INTERVAL = 0.005
+    METRICS_PROFILE_DIR = None
+
+    # API authentication (seconds)
+    AUTH_CACHE_TTL = 60
+    AUTH_CACHE_LOCAL_TTL = 5
+    AUTH_CACHE_LOCAL_SIZE = 1024
+    AUTH_TOKENS_ENABLED = False
+    AUTH_TOKEN_MAX_AGE = 3600
+
 class ProdConfig(BaseConfig):
     DEBUG = False
     TESTING = False
@@ -17,8 +135,10 @@ class ProdConfig(BaseConfig):
     DATABASE_NAME = Config.DATABASE_NAME
     DATABASE_USER = Config.DATABASE_USER
     DATABASE_PASS = Config.DATABASE_PASS
-    IEX_API_URL = 'https://cloud.iexapis.com/stable'
+    IEX_API_URL = environ.get('IEX_API_URL', 'https://cloud.iexapis.com/stable')
     IEX_SECRET_TOKEN = Config.IEX_SECRET_TOKEN
+    LOG_FORMAT = 'json'
+    METRICS_TIMING_HEADERS = False
 
 class DevConfig(BaseConfig):
     DEBUG = True
@@ -28,5 +148,6 @@ class DevConfig(BaseConfig):
     DATABASE_NAME = Config.DATABASE_NAME
     DATABASE_USER = Config.DATABASE_USER
     DATABASE_PASS = Config.DATABASE_PASS
-    IEX_API_URL = 'https://sandbox.iexapis.com/stable'
-    IEX_SECRET_TOKEN = Config.IEX_SB_SECRET_TOKEN
\ No newline at end of file
+    IEX_API_URL = environ.get('IEX_API_URL', 'https://sandbox.iexapis.com/stable')
+    IEX_SECRET_TOKEN = Config.IEX_SB_SECRET_TOKEN
+    LOG_LEVEL = 'DEBUG'
\ No newline at end of file
@@ -1,26 +1,57 @@
+import itertools
+import logging
+
 from contextlib import contextmanager
+from flask import g, has_request_context
+from flask_login import current_user
 from redis import Redis, RedisError
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.ext.declarative import declarative_base
 
+from trader.services.cache import LRUCache
+
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE')
+
 class TraderDB(object):
     """
     Simple object that handles database connectivity.
+
+    Writes go to the primary. Read-only endpoints can use
+    `read_session_scope`, which spreads them over the replica engines,
+    except for users who wrote within the last `read_your_writes` seconds:
+    their reads stay on the primary so they see their own changes despite
+    replication lag.
     """
     def __init__(self):
         self.engine = None
         self.Session = None
+        self.replicas = []
+        self.ReadSession = None
+        self.read_your_writes = 5
+        self.recent_writes = LRUCache(4096)
+
+        self._next_replica = itertools.count()
 
         # Stores
         self.redis = None
 
+    @property
+    def engines(self):
+        """
+        The primary engine followed by the replica engines.
+        """
+        return [self.engine] + self.replicas
+
     def init_app(self, app):
         """
         Gather configuration data and create the SQLAlchemy engine and scoped
         session factory object to be used for calling the Session for database
         interaction. Redis is also initialized here, as an additional storage
         (or caching) option.
+
+        An engine with the same credentials is created for each host of
+        `DATABASE_REPLICA_HOSTS`, all with the `DATABASE_POOL_*` settings.
         """
         username = app.config['DATABASE_USER']
         password = app.config['DATABASE_PASS']
@@ -28,9 +59,25 @@ class TraderDB(object):
         host = app.config['DATABASE_HOST']
         db = app.config['DATABASE_NAME']
 
-        self.engine = create_engine('{}://{}:{}@{}/{}'.format(driver, username, password, host, db))
+        pool = {
+            'pool_size': app.config.get('DATABASE_POOL_SIZE', 10),
+            'max_overflow': app.config.get('DATABASE_MAX_OVERFLOW', 20),
+            'pool_timeout': app.config.get('DATABASE_POOL_TIMEOUT', 30),
+            'pool_recycle': app.config.get('DATABASE_POOL_RECYCLE', 1800),
+            'pool_pre_ping': app.config.get('DATABASE_POOL_PRE_PING', True)
+        }
+        url = '{}://{}:{}@{}/{}'
+        self.engine = create_engine(url.format(driver, username, password, host, db), **pool)
         self.Session = scoped_session(sessionmaker(bind=self.engine, expire_on_commit=False))
 
+        self.replicas = [create_engine(url.format(driver, username, password, replica, db), **pool)
+            for replica in app.config.get('DATABASE_REPLICA_HOSTS', [])]
+        self.ReadSession = sessionmaker(expire_on_commit=False)
+        self.read_your_writes = app.config.get('DATABASE_READ_YOUR_WRITES', self.read_your_writes)
+        if self.replicas and not event.contains(self.engine, 'after_cursor_execute', self._after_cursor_execute):
+            event.listen(self.engine, 'after_cursor_execute', self._after_cursor_execute)
+            app.teardown_request(self._record_request_writes)
+
         self.redis = Redis(host='redis', db=0, socket_connect_timeout=2, socket_timeout=2)
 
         app.teardown_appcontext(self.teardown)
@@ -43,7 +90,7 @@ class TraderDB(object):
         """
         Taken from the SQLAlchemy documentation to be used as a context manager
         that simplifies committing database changes with the session object.
-        As noted in the documentation, it "provides a transactional scope 
+        As noted in the documentation, it "provides a transactional scope
         around a series of operations."
         """
         session = self.Session()
@@ -54,4 +101,58 @@ class TraderDB(object):
             session.rollback()
             raise
         finally:
-            session.close()
\ No newline at end of file
+            session.close()
+
+    @contextmanager
+    def read_session_scope(self, user_id=None):
+        """
+        Session for read-only queries, bound to the next replica in turn.
+        Falls back to `session_scope` on the primary when there are no
+        replicas or `user_id` wrote within the read-your-writes window.
+
+        Params
+        ------
+        user_id : int, optional
+            User whose data is read.
+        """
+        if not self.replicas or (user_id is not None and self.wrote_recently(user_id)):
+            with self.session_scope() as session:
+                yield session
+            return
+
+        replica = self.replicas[next(self._next_replica) % len(self.replicas)]
+        session = self.ReadSession(bind=replica)
+        try:
+            yield session
+        finally:
+            session.close()
+
+    def mark_written(self, user_id):
+        """
+        Keep the reads of `user_id` on the primary for the read-your-writes
+        window, in this process and, through Redis, in the other workers.
+        """
+        self.recent_writes.set(user_id, True, self.read_your_writes)
+        try:
+            self.redis.set('db:wrote:{}'.format(user_id), 1, px=int(self.read_your_writes*1000))
+        except RedisError as e:
+            logging.error({'exception': str(e), 'user_id': user_id})
+
+    def wrote_recently(self, user_id):
+        if self.recent_writes.get(user_id):
+            return True
+        try:
+            return bool(self.redis.exists('db:wrote:{}'.format(user_id)))
+        except RedisError as e:
+            # Without Redis we can't tell, so be consistent rather than fast.
+            logging.error({'exception': str(e), 'user_id': user_id})
+            return True
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if has_request_context() and statement.lstrip()[:6].upper() in WRITE_STATEMENTS:
+            g.db_wrote = True
+
+    def _record_request_writes(self, exception=None):
+        # The user is only looked up for requests that wrote.
+        if g.get('db_wrote') and current_user.is_authenticated:
+            self.mark_written(current_user.id)
@@ -1,5 +1,31 @@
 from trader.database import TraderDB
+from trader.services.cache import QuoteCache
+from trader.services.credentials import CredentialCache
+from trader.services.account_cache import AccountCache
+from trader.services.streaming import PriceStream
+from trader.services.trading import TradeExecutor
+from trader.services.journal import TradeJournal
+from trader.services.valuation import ValuationJob
+from trader.services.leaderboard import Leaderboard
+from trader.services.orders import OrderEngine
+from trader.services.replay import ReplayEngine
+from trader.services.metrics import Metrics
+from trader.services.third_party.iex import IEXApi
+from trader.services.market_data.store import PriceStore
 from flask_marshmallow import Marshmallow
 
 db = TraderDB()
-ma = Marshmallow()
\ No newline at end of file
+ma = Marshmallow()
+quote_cache = QuoteCache()
+price_store = PriceStore()
+iex_api = IEXApi()
+price_stream = PriceStream()
+trade_executor = TradeExecutor(db)
+trade_journal = TradeJournal(db, trade_executor)
+valuation_job = ValuationJob(db, iex_api)
+leaderboard = Leaderboard()
+order_engine = OrderEngine(db, trade_executor)
+replay_engine = ReplayEngine()
+credential_cache = CredentialCache()
+account_cache = AccountCache()
+metrics = Metrics()
\ No newline at end of file
@@ -10,6 +10,10 @@ export const SEARCH_STOCKS = createDispatchActions('SEARCH_STOCKS');
 export const GET_STOCK_INFO = createDispatchActions('GET_STOCK_INFO');
 export const SET_STOCK_SYMBOL = 'SET_STOCK_SYMBOL';
 export const TRADE_STOCK = createDispatchActions('TRADE_STOCK');
+export const UPDATE_QUOTE = 'UPDATE_QUOTE';
+
+// Matches STREAM_MAX_SYMBOLS on the server.
+const STREAM_MAX_SYMBOLS = 50;
 
 
 // #TODO : Make the process of the below functions reusable.
@@ -144,4 +148,33 @@ export function tradeExistingStock(account_id, stock_id, data){
             });
         });
     };
-}
\ No newline at end of file
+}
+
+export function updateQuote(event){
+    return dispatch => {
+        dispatch({
+            type: UPDATE_QUOTE,
+            data: event
+        });
+    };
+}
+
+// Streams quote updates of `symbols` to `onQuote`, over as many connections
+// as the server's symbol limit requires. Returns an object whose `close`
+// ends the subscription.
+export function subscribeToPrices(symbols, onQuote){
+    let sources = [];
+    for(let i = 0; i < symbols.length; i += STREAM_MAX_SYMBOLS){
+        const query = symbols.slice(i, i + STREAM_MAX_SYMBOLS)
+            .map((symbol) => `stock=${encodeURIComponent(symbol)}`).join('&');
+        const source = new EventSource(`${baseURL}/exchange/stream?${query}`);
+        source.addEventListener('quote', (event) => {
+            onQuote(JSON.parse(event.data));
+        });
+        sources.push(source);
+    }
+    return {
+        close: () => sources.forEach((source) => source.close())
+    };
+}
+
@@ -2,7 +2,7 @@ import React from 'react';
 import { bindActionCreators } from 'redux';
 import { connect } from 'react-redux';
 import { formatCurrency } from 'utils';
-import { getAccountInfo } from 'actions';
+import { getAccountInfo, updateQuote, subscribeToPrices } from 'actions';
 import Table from 'react-bootstrap/Table';
 import { ArrowUp } from 'react-bootstrap-icons';
 import { Link } from 'react-router-dom';
@@ -23,12 +23,34 @@ const mapStateToProps = (state) => {
 class Account extends React.Component {
     constructor(props) {
         super(props);
+        this.priceStream = null;
+        this.streamedSymbols = '';
     }
 
     componentDidMount(){
         this.props.getAccountInfo();
     }
 
+    componentDidUpdate(){
+        this.streamPrices();
+    }
+
+    componentWillUnmount(){
+        if(this.priceStream) this.priceStream.close();
+    }
+
+    // Keep the prices of the positions held up to date from the price
+    // stream, resubscribing when the positions change.
+    streamPrices(){
+        const { accountInfo } = this.props;
+        const symbols = accountInfo && accountInfo.stocks ? Object.keys(accountInfo.stocks).sort() : [];
+        if(symbols.join(',') == this.streamedSymbols) return;
+
+        if(this.priceStream) this.priceStream.close();
+        this.priceStream = symbols.length > 0 ? subscribeToPrices(symbols, this.props.updateQuote) : null;
+        this.streamedSymbols = symbols.join(',');
+    }
+
     render() {
         const { accountInfo, accountInfoError } = this.props;
 
@@ -111,7 +133,7 @@ class Account extends React.Component {
 
 const mapDispatchToProps = (dispatch) => {
     return bindActionCreators(
-        { getAccountInfo },
+        { getAccountInfo, updateQuote },
         dispatch
     );
 }
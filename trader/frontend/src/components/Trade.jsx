@@ -4,7 +4,7 @@ import Form from 'react-bootstrap/Form';
 import Row from 'react-bootstrap/Row';
 import { bindActionCreators } from 'redux';
 import { connect } from 'react-redux';
-import { getAccountInfo, getStockInfo, buyNewStock, tradeExistingStock } from 'actions';
+import { getAccountInfo, getStockInfo, buyNewStock, tradeExistingStock, updateQuote, subscribeToPrices } from 'actions';
 import Dialog from './Dialog';
 import StockData from './StockData';
 
@@ -39,6 +39,9 @@ class Trade extends React.Component {
             numberOfShares: 1
         }
 
+        this.priceStream = null;
+        this.streamedSymbol = null;
+
         this.buyStock = this.buyStock.bind(this);
         this.sellStock = this.sellStock.bind(this);
         this.showModal = this.showModal.bind(this);
@@ -56,6 +59,25 @@ class Trade extends React.Component {
             }
         }
         this.props.getAccountInfo();
+        this.streamPrice();
+    }
+
+    componentDidUpdate(){
+        this.streamPrice();
+    }
+
+    componentWillUnmount(){
+        if(this.priceStream) this.priceStream.close();
+    }
+
+    // Keep the quote of the selected stock up to date from the price stream.
+    streamPrice(){
+        const { selectedStockSymbol } = this.props;
+        if(selectedStockSymbol == this.streamedSymbol) return;
+
+        if(this.priceStream) this.priceStream.close();
+        this.priceStream = selectedStockSymbol ? subscribeToPrices([selectedStockSymbol], this.props.updateQuote) : null;
+        this.streamedSymbol = selectedStockSymbol;
     }
 
     showModal(modalName, show){
@@ -193,7 +215,7 @@ Trade.propTypes = {
 
 const mapDispatchToProps = (dispatch) => {
     return bindActionCreators(
-        { getAccountInfo, getStockInfo, buyNewStock, tradeExistingStock },
+        { getAccountInfo, getStockInfo, buyNewStock, tradeExistingStock, updateQuote },
         dispatch
     );
 }
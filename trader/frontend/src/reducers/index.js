@@ -4,11 +4,35 @@ import {
     SEARCH_STOCKS,
     GET_STOCK_INFO,
     SET_STOCK_SYMBOL,
-    TRADE_STOCK
+    TRADE_STOCK,
+    UPDATE_QUOTE
 } from 'actions';
 
 const INITIAL_STATE = {};
 
+// Replace the quote of a streamed symbol in the exchange data, if shown.
+const withQuote = (stockInfo, { symbol, quote }) => {
+    if(!stockInfo || !stockInfo[symbol]) return stockInfo;
+    return {
+        ...stockInfo,
+        [symbol]: { ...stockInfo[symbol], quote: quote }
+    };
+};
+
+// Reprice a streamed symbol in the account's positions, if held.
+const withPrice = (accountInfo, { symbol, quote }) => {
+    if(!accountInfo || !accountInfo.stocks || !accountInfo.stocks[symbol]) return accountInfo;
+    const stock = accountInfo.stocks[symbol];
+    const price = parseFloat(quote.latestPrice);
+    return {
+        ...accountInfo,
+        stocks: {
+            ...accountInfo.stocks,
+            [symbol]: { ...stock, price: price.toFixed(2), value: (price*stock.shares).toFixed(2) }
+        }
+    };
+};
+
 const rootReducer = (state = INITIAL_STATE, action) => {
     switch(action.type){
         case CREATE_ACCOUNT.REQUEST:
@@ -101,6 +125,12 @@ const rootReducer = (state = INITIAL_STATE, action) => {
                 isTradingStock: false,
                 tradeStockError: action.data
             };
+        case UPDATE_QUOTE:
+            return {
+                ...state,
+                stockInfo: withQuote(state.stockInfo, action.data),
+                accountInfo: withPrice(state.accountInfo, action.data)
+            };
         default:
             return state;
     }
@@ -0,0 +1,46 @@
+import contextvars
+
+from contextlib import contextmanager
+from datetime import datetime
+
+class WallClock:
+    """
+    The real time.
+    """
+    def now(self):
+        return datetime.now()
+
+class ReplayClock:
+    """
+    Simulated time of a replay session, moved forward by the session as it
+    steps through historical bars.
+    """
+    def __init__(self, start):
+        self.current = start
+
+    def now(self):
+        return self.current
+
+    def advance_to(self, when):
+        if when > self.current:
+            self.current = when
+
+_clock = contextvars.ContextVar('clock', default=WallClock())
+
+def now():
+    """
+    Get the current time of the clock in use, the wall clock unless inside
+    `use_clock`.
+    """
+    return _clock.get().now()
+
+@contextmanager
+def use_clock(clock):
+    """
+    Resolve `now()` against `clock` for the duration of the block.
+    """
+    token = _clock.set(clock)
+    try:
+        yield clock
+    finally:
+        _clock.reset(token)
@@ -1,15 +1,34 @@
 class ResponseErrors:
     DEFAULT = 'An unexpected error occurred while processing this request'
     INVALID_JSON = 'Unable to parse JSON from the request body'
+    INVALID_CURSOR = 'Invalid pagination cursor'
     INVALID_LOGIN = 'The username/password you specified is invalid'
     USER_DNE = 'User does not exist'
+    TOKENS_DISABLED = 'API tokens are not enabled'
+    TOKENS_UNAVAILABLE = 'API tokens are temporarily unavailable, please try again'
     ACCOUNT_DNE = 'Account does not exist'
     ACCOUNT_NO_ACCESS = 'Invalid account'
     ACCOUNT_EXISTS = 'Account already exists for this user'
     ACCOUNT_INVALID_ACTION = 'Invalid action for account'
     ACCOUNT_INSUFFICIENTFUNDS = 'Insufficient funds'
+    ACCOUNT_ON_HOLD = 'This account is on hold, please try again later'
     STOCK_DNE = 'Stock does not exist'
     STOCK_EXISTS = 'Stock already exists'
     STOCK_DATA_UNAVAILABLE = 'Stock data is currently unavailable'
+    STREAM_NO_SYMBOLS = 'At least one stock symbol is required'
+    STREAM_TOO_MANY_SYMBOLS = 'Too many stock symbols requested'
     NOT_ENOUGH_FUNDS = 'Not enough funds to make this trade'
-    TOO_MANY_SHARES = 'Shares passed is greater than what is owned'
\ No newline at end of file
+    TOO_MANY_SHARES = 'Shares passed is greater than what is owned'
+    TRADE_INVALID_TYPE = 'Trade type must be either buy or sell'
+    TRADE_UNAVAILABLE = 'Trading is temporarily unavailable, please try again'
+    ORDERS_REQUIRED = 'A non-empty list of orders is required'
+    ORDERS_TOO_MANY = 'Too many orders in one batch'
+    ORDER_DNE = 'Order does not exist'
+    ORDER_NOT_OPEN = 'Order is no longer open'
+    ORDERS_DISABLED = 'Limit and stop orders are not enabled'
+    REPLAY_DNE = 'Replay session does not exist'
+    REPLAY_NO_DATA = 'No stored price history for the requested symbols and period'
+    REPLAY_TOO_MANY = 'Too many replay sessions running'
+    REPLAY_FINISHED = 'Replay session has finished'
+    REPLAY_INVALID_ACTION = 'Invalid action for replay session'
+    LEADERBOARD_DISABLED = 'The leaderboard is not enabled'
\ No newline at end of file
@@ -0,0 +1,171 @@
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+
+from datetime import datetime, timezone
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+class JSONFormatter(logging.Formatter):
+    """
+    One JSON object per record. Records logged as dicts, as most of the app
+    does, have their keys merged into the object.
+    """
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName
+        }
+        if isinstance(record.msg, dict) and not record.args:
+            entry.update(record.msg)
+        else:
+            entry['message'] = record.getMessage()
+        if record.exc_info:
+            entry['traceback'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class SamplingFilter(logging.Filter):
+    """
+    Lets through only a `rate` fraction of the records below `level`, so
+    debug logging on hot paths can stay on without flooding the pipeline.
+    """
+    def __init__(self, rate, level=logging.INFO):
+        super().__init__()
+        self.rate = rate
+        self.level = level
+
+    def filter(self, record):
+        return record.levelno >= self.level or random.random() < self.rate
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the listener thread without ever blocking the caller:
+    when the queue is full the record is dropped and counted.
+
+    The listener runs in the same process, so records are queued as they
+    are and formatted on the listener thread.
+    """
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class QueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # Wait for room rather than failing to stop when the queue is full.
+        self.queue.put(self._sentinel)
+
+class Pipeline:
+    """
+    The handlers records are written by on the listener thread, and the
+    handler queueing records to them from every other thread.
+    """
+    def __init__(self, handlers, queue_size):
+        self.queue = queue.Queue(queue_size)
+        self.handler = QueueHandler(self.queue)
+        self.handlers = handlers
+        self.listener = None
+
+    def start(self):
+        self.listener = QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self):
+        if self.listener is not None and self.listener._thread is not None:
+            self.listener.stop()
+
+    def restart(self):
+        # Threads don't survive a fork, so forked workers start their own
+        # listener on a fresh queue.
+        self.queue = self.handler.queue = queue.Queue(self.queue.maxsize)
+        self.start()
+
+_pipeline = None
+
+def configure(level='INFO', format='text', path=None, max_bytes=10 * 1024 * 1024, backups=5, queue_size=10000,
+        debug_sample_rate=1.0, stream=sys.stdout):
+    """
+    Route every log record through a bounded queue to a listener thread
+    writing to `stream` and, if `path` is given, to a rotating file, so
+    logging never does I/O on the calling thread. Calling it again replaces
+    the previous pipeline.
+
+    Params
+    ------
+    level : str or int
+        Level of the root logger.
+    format : str
+        'text' or 'json'.
+    path : str, optional
+        Log file, rotated once it reaches `max_bytes`, keeping `backups`
+        old files.
+    queue_size : int
+        Records held before new ones are dropped.
+    debug_sample_rate : float
+        Fraction of debug records kept.
+    """
+    global _pipeline
+
+    formatter = JSONFormatter() if format == 'json' else logging.Formatter(TEXT_FORMAT)
+    handlers = [logging.StreamHandler(stream)]
+    if path:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        handlers.append(logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups,
+            delay=True))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    pipeline = Pipeline(handlers, queue_size)
+    if debug_sample_rate < 1:
+        pipeline.handler.addFilter(SamplingFilter(debug_sample_rate))
+
+    root = logging.getLogger()
+    if _pipeline is not None:
+        root.removeHandler(_pipeline.handler)
+        _pipeline.stop()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(pipeline.handler)
+    root.setLevel(level)
+
+    pipeline.start()
+    _pipeline = pipeline
+    return pipeline
+
+def init_app(app):
+    configure(
+        level=app.config.get('LOG_LEVEL', 'INFO'),
+        format=app.config.get('LOG_FORMAT', 'text'),
+        path=app.config.get('LOG_FILE'),
+        max_bytes=app.config.get('LOG_FILE_MAX_BYTES', 10 * 1024 * 1024),
+        backups=app.config.get('LOG_FILE_BACKUPS', 5),
+        queue_size=app.config.get('LOG_QUEUE_SIZE', 10000),
+        debug_sample_rate=app.config.get('LOG_DEBUG_SAMPLE_RATE', 1.0)
+    )
+
+def _after_fork():
+    if _pipeline is not None:
+        _pipeline.restart()
+
+def _shutdown():
+    # Flush what is still queued.
+    if _pipeline is not None:
+        _pipeline.stop()
+
+os.register_at_fork(after_in_child=_after_fork)
+atexit.register(_shutdown)
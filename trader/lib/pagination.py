@@ -0,0 +1,22 @@
+import base64
+
+from datetime import datetime
+
+def encode_cursor(process_date, id):
+    """
+    Encode the sort key of the last row of a page into an opaque cursor.
+    """
+    raw = '{}|{}'.format(process_date.isoformat(), id)
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor made by `encode_cursor` into `(process_date, id)`.
+    Raises ValueError if the cursor is malformed.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        process_date, id = raw.split('|')
+        return datetime.fromisoformat(process_date), int(id)
+    except (TypeError, UnicodeDecodeError, base64.binascii.Error) as e:
+        raise ValueError(str(e))
@@ -0,0 +1,68 @@
+import json
+import decimal
+
+from flask import current_app
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+class RawJSON(bytes):
+    """
+    Already encoded JSON, such as cached upstream payloads, written to
+    responses as is instead of being decoded and encoded again.
+    """
+
+def _default(obj):
+    if isinstance(obj, decimal.Decimal):
+        return str(obj)
+    if hasattr(obj, 'tolist'):
+        # numpy scalars and arrays
+        return obj.tolist()
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(obj).__name__))
+
+def dumps(obj):
+    """
+    Encode `obj` as compact JSON bytes, with orjson when it is installed.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_default, separators=(',', ':')).encode()
+
+def loads(data):
+    """
+    Decode JSON `data`, with orjson when it is installed.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def raw_object(mapping):
+    """
+    Encode a dict whose values may be `RawJSON` into a `RawJSON` object,
+    splicing the raw values in and encoding the others.
+    """
+    return RawJSON(b'{' + b','.join(
+        dumps(str(key)) + b':' + (value if isinstance(value, RawJSON) else dumps(value))
+        for key, value in mapping.items()) + b'}')
+
+def encode(data):
+    """
+    Encode a response body. `RawJSON` is accepted as the body itself or as
+    a value of the response dict, e.g. the `result` of `success_response`.
+    """
+    if isinstance(data, RawJSON):
+        return bytes(data)
+    if isinstance(data, dict) and any(isinstance(v, RawJSON) for v in data.values()):
+        return bytes(raw_object(data))
+    return dumps(data)
+
+def output_json(data, code, headers=None):
+    """
+    Flask-RESTful representation for `application/json`, registered on
+    every `Api` in place of the default, `json.dumps` based one.
+    """
+    response = current_app.response_class(encode(data), status=code, mimetype='application/json')
+    response.headers.extend(headers or {})
+    return response
@@ -2,11 +2,13 @@ from decimal import Decimal
 from datetime import datetime
 
 from flask_login import UserMixin
-from sqlalchemy import Column, ForeignKey, Enum, Integer, String, Binary, DateTime, Numeric, \
-    UniqueConstraint
+from sqlalchemy import Column, ForeignKey, Enum, Integer, BigInteger, String, Binary, DateTime, Numeric, \
+    UniqueConstraint, Index, text
 from sqlalchemy.orm import relationship, backref
 from sqlalchemy.ext.declarative import declarative_base, declared_attr
 
+from trader.lib import clock
+
 Base = declarative_base()
 
 class User(Base, UserMixin):
@@ -55,14 +57,85 @@ class Stock(Base):
     shares = Column(Integer, nullable=False)
 
 class Trade(Base):
+    # Partitioned by month on `process_date`, which is therefore part of the
+    # primary key. See migration 31bff2e6152c.
     __tablename__ = 'trades'
-    id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, nullable=False)
-    account_id = Column(Integer, nullable=False)
+    __table_args__ = (
+        Index('trades_account_id_process_date_idx', 'account_id', text('process_date DESC'), text('id DESC')),
+        Index('trades_user_id_process_date_idx', 'user_id', text('process_date DESC')),
+        Index('trades_stock_id_idx', 'stock_id'),
+        {'postgresql_partition_by': 'RANGE (process_date)'},
+    )
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    account_id = Column(Integer, ForeignKey('accounts.id', ondelete='CASCADE'), nullable=False)
     stock_id = Column(Integer, nullable=False)
+    symbol = Column(String(5))
     trade_type = Column(Enum('buy', 'sell', native_enum=False), nullable=False)
-    process_date = Column(DateTime, nullable=False, default=datetime.now)
+    process_date = Column(DateTime, primary_key=True, default=clock.now)
     price = Column(
         Numeric(precision=19, scale=2, asdecimal=False, decimal_return_scale=None), 
         nullable=False)
-    shares = Column(Integer, nullable=False)
\ No newline at end of file
+    shares = Column(Integer, nullable=False)
+
+class AccountValuation(Base):
+    # Latest mark-to-market of each account, written in bulk by the
+    # valuation job (see `trader.services.valuation`).
+    __tablename__ = 'account_valuations'
+    account_id = Column(Integer, ForeignKey('accounts.id', ondelete='CASCADE'), primary_key=True)
+    valued_at = Column(DateTime, nullable=False)
+    cash_amount = Column(
+        Numeric(precision=19, scale=2, asdecimal=False, decimal_return_scale=None),
+        nullable=False)
+    cost_basis = Column(
+        Numeric(precision=19, scale=2, asdecimal=False, decimal_return_scale=None),
+        nullable=False)
+    market_value = Column(
+        Numeric(precision=19, scale=2, asdecimal=False, decimal_return_scale=None),
+        nullable=False)
+    unrealized_pnl = Column(
+        Numeric(precision=19, scale=2, asdecimal=False, decimal_return_scale=None),
+        nullable=False)
+    total_amount = Column(
+        Numeric(precision=19, scale=2, asdecimal=False, decimal_return_scale=None),
+        nullable=False)
+    pct_change = Column(
+        Numeric(precision=12, scale=2, asdecimal=False, decimal_return_scale=None),
+        nullable=False)
+    positions = Column(Integer, nullable=False, default=0)
+
+class Order(Base):
+    # Resting limit, stop and stop-limit orders, triggered by the order
+    # engine (see `trader.services.orders`).
+    __tablename__ = 'orders'
+    __table_args__ = (
+        Index('orders_account_id_created_at_idx', 'account_id', text('created_at DESC')),
+        Index('orders_open_symbol_idx', 'symbol', postgresql_where=text("status = 'open'")),
+    )
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    account_id = Column(Integer, ForeignKey('accounts.id', ondelete='CASCADE'), nullable=False)
+    symbol = Column(String(5), nullable=False)
+    trade_type = Column(Enum('buy', 'sell', native_enum=False), nullable=False)
+    order_type = Column(Enum('limit', 'stop', 'stop_limit', native_enum=False), nullable=False)
+    status = Column(Enum('open', 'filled', 'cancelled', 'rejected', native_enum=False),
+        nullable=False, default='open')
+    shares = Column(Integer, nullable=False)
+    limit_price = Column(
+        Numeric(precision=19, scale=2, asdecimal=False, decimal_return_scale=None))
+    stop_price = Column(
+        Numeric(precision=19, scale=2, asdecimal=False, decimal_return_scale=None))
+    created_at = Column(DateTime, nullable=False, default=clock.now)
+    triggered_at = Column(DateTime)
+    closed_at = Column(DateTime)
+    fill_price = Column(
+        Numeric(precision=19, scale=2, asdecimal=False, decimal_return_scale=None))
+    trade_id = Column(Integer)
+    message = Column(String(100))
+
+class JournalFence(Base):
+    # Epoch of the trade journal flusher lease. Flushes only commit while it
+    # is still theirs (see `trader.services.journal`).
+    __tablename__ = 'journal_fence'
+    id = Column(Integer, primary_key=True)
+    epoch = Column(BigInteger, nullable=False)
@@ -1,9 +1,13 @@
 from .users import users_bp
 from .accounts import accounts_bp
 from .exchange import exchange_bp
+from .leaderboard import leaderboard_bp
+from .replay import replay_bp
 
 api_blueprints = [
     (users_bp, '/users'),
     (accounts_bp, '/accounts'),
-    (exchange_bp, '/exchange')
+    (exchange_bp, '/exchange'),
+    (leaderboard_bp, '/leaderboard'),
+    (replay_bp, '/replay')
 ]
\ No newline at end of file
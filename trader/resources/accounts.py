@@ -3,20 +3,27 @@ from decimal import Decimal
 from datetime import datetime
 from http import HTTPStatus
 
-from flask import request, Blueprint
+from flask import request, Blueprint, current_app
 from marshmallow import ValidationError
 from flask_login import login_required, current_user
 from flask_restful import Api, Resource
 
+from trader.lib import clock
 from trader.lib.definitions import ResponseErrors
-from trader.extensions import db
-from trader.schemas import AccountReadSchema, AccountCreationSchema, \
-    AccountUpdateSchema, TradeSchema
-from trader.models import Account, Stock, Trade
+from trader.lib.serialization import output_json
+from trader.lib.pagination import encode_cursor, decode_cursor
+from trader.extensions import db, trade_executor, leaderboard, order_engine, account_cache, trade_journal
+from trader.schemas import AccountCreationSchema, AccountUpdateSchema, \
+    TradeSchema, TradeReadSchema, TradeListSchema, OrderSchema, OrderListSchema, trade_amount
+from trader.schemas.dumpers import dump_account, dump_positions, add_prices
+from trader.models import Account, Stock, Trade, Order
+from trader.services.portfolio import PortfolioRepository
+from trader.services.trading import TradeError
 from trader.resources.base_resource import BaseResource, validate_request_json
 
 accounts_bp = Blueprint('accounts', __name__)
 accounts = Api(accounts_bp)
+accounts.representation('application/json')(output_json)
 
 class AccountResource(BaseResource):
     @login_required
@@ -30,40 +37,40 @@ class AccountResource(BaseResource):
         id : int
             Account identifier.
         """
-        with db.session_scope() as session:
-            account = session.query(Account).filter_by(user_id=current_user.id).first()
-            if not account:
-                return self.error_response(ResponseErrors.ACCOUNT_DNE, HTTPStatus.NOT_FOUND)
-
-            stocks = {}
-            for stock in account.stocks:
-                stocks[stock.symbol] = {
-                    'id': stock.id, 
-                    'symbol': stock.symbol, 
-                    'shares': stock.shares,
-                    'bought_at': format(stock.bought_at, '.2f'),
-                    'cost': format(stock.bought_at*stock.shares, '.2f')
-                }
-
-            stock_list = stocks.keys()
-            if len(stock_list) > 0:
-                stock_data = self.iex_api.get_stock_data(stock_list)
-                if stock_data:
-                    for symb, stock in stock_data.items():
-                        if symb in stocks:
-                            shares = stocks[symb]['shares']
-                            price = float(stock['quote']['latestPrice'])
-                            stocks[symb]['price'] = "{0:.2f}".format(price)
-                            stocks[symb]['value'] = "{0:.2f}".format(price*shares)
-                else:
-                    return self.error_response(ResponseErrors.DEFAULT)
-
-            schema = AccountReadSchema()
-            data = schema.dump(account)
-            data['stocks'] = stocks
+        # Journal trades reach the database, and the cache, one flush later.
+        portfolio = trade_journal.get_portfolio(current_user.id)
+        if portfolio is not None:
+            data = self.dump_portfolio(*portfolio)
+        else:
+            data = account_cache.get(current_user.id, self.load_account)
+        if data is None:
+            return self.error_response(ResponseErrors.ACCOUNT_DNE, HTTPStatus.NOT_FOUND)
+
+        stocks = data['stocks']
+        if stocks:
+            quotes = self.iex_api.get_quotes(list(stocks))
+            if not quotes:
+                return self.error_response(ResponseErrors.DEFAULT, HTTPStatus.SERVICE_UNAVAILABLE)
+            add_prices(stocks, quotes)
 
         return self.success_response(data)
 
+    def load_account(self):
+        """
+        Load the account of the current user with its holdings, without
+        prices, or None if they have no account.
+        """
+        with db.read_session_scope(current_user.id) as session:
+            account, positions = PortfolioRepository(session).get_portfolio(current_user.id)
+            if not account:
+                return None
+            return self.dump_portfolio(account, positions)
+
+    def dump_portfolio(self, account, positions):
+        data = dump_account(account)
+        data['stocks'] = dump_positions(positions)
+        return data
+
     @login_required
     @validate_request_json
     def patch(self, action):
@@ -80,24 +87,20 @@ class AccountResource(BaseResource):
         if action not in ['withdraw', 'deposit']:
             return self.error_response(ResponseErrors.ACCOUNT_INVALID_ACTION, HTTPStatus.BAD_REQUEST)
 
-        with db.session_scope() as session:
-            account = session.query(Account).filter_by(user_id=current_user.id).first()
-            if not account:
-                return self.error_response(ResponseErrors.ACCOUNT_DNE, HTTPStatus.NOT_FOUND)
+        schema = AccountUpdateSchema()
+        try:
+            data = schema.loads(request.get_data())
+        except ValidationError as err:
+            return self.error_response(err.messages, HTTPStatus.BAD_REQUEST)
 
-            schema = AccountUpdateSchema()
-            try:
-                data = schema.loads(request.get_data())
-            except ValidationError as err:
-                return self.error_response(err.messages, HTTPStatus.BAD_REQUEST)
-            
+        try:
             if action == 'deposit':
-                account.cash_amount += data['amount']
-            elif action == 'withdraw' and account.cash_amount >= data['amount']:
-                account.cash_amount -= data['amount']
+                trade_executor.deposit(current_user.id, data['amount'])
             else:
-                return self.error_response(err.messages, HTTPStatus.BAD_REQUEST)
-        
+                trade_executor.withdraw(current_user.id, data['amount'])
+        except TradeError as err:
+            return self.trade_error_response(err)
+
         return self.success_response(result='ok')
     
     @login_required
@@ -126,6 +129,7 @@ class AccountResource(BaseResource):
 
             created_account_id = account.id
 
+        leaderboard.update_account(account, name=leaderboard.display_name(current_user))
         return self.success_response(result={'id': created_account_id}, status_code=HTTPStatus.CREATED)
 
     @login_required
@@ -138,11 +142,19 @@ class AccountResource(BaseResource):
         id : int
             Account identifier.
         """
-        with db.session_scope() as session:
-            account = session.query(Account).filter_by(user_id=current_user.id)
-            if not account:
-                return self.error_response(ResponseErrors.ACCOUNT_DNE, HTTPStatus.NOT_FOUND)
-            account.delete()
+        try:
+            with trade_executor.exclusive(current_user.id), db.session_scope() as session:
+                account = session.query(Account).filter_by(user_id=current_user.id)
+                if not account:
+                    return self.error_response(ResponseErrors.ACCOUNT_DNE, HTTPStatus.NOT_FOUND)
+                account_ids = [row.id for row in account.with_entities(Account.id)]
+                account.delete()
+        except TradeError as err:
+            return self.trade_error_response(err)
+
+        for account_id in account_ids:
+            leaderboard.remove_account(account_id)
+        account_cache.invalidate(current_user.id)
         return self.success_response(result='ok')
 
 class StockResource(BaseResource):
@@ -160,61 +172,16 @@ class StockResource(BaseResource):
         stock_id : int
             Account stock identifier.
         """
-        result = {}
         schema = TradeSchema()
         try:
             data = schema.loads(request.get_data())
         except ValidationError as err:
             return self.error_response(err.messages, HTTPStatus.BAD_REQUEST)
         
-        with db.session_scope() as session:
-            account = session.query(Account).join(Account.stocks).\
-                filter(Account.id == account_id).first()
-            if not account:
-                return self.error_response(ResponseErrors.ACCOUNT_DNE, HTTPStatus.NOT_FOUND)
-            
-            stock = [v for i,v in enumerate(account.stocks) if v.symbol == data['symbol']][0]
-            if not stock:
-                return self.error_response(ResponseErrors.STOCK_DNE, HTTPStatus.NOT_FOUND)
-            if account.user_id != current_user.id:
-                return self.error_response(ResponseErrors.ACCOUNT_NO_ACCESS, HTTPStatus.FORBIDDEN)
-            
-            delete_flag = False
-
-            if data['trade_type'] == 'buy':
-                cost = data['amount'] + Account.BROKERAGE_FEE
-                if account.cash_amount < cost:
-                    return self.success_response(result=ResponseErrors.NOT_ENOUGH_FUNDS, success=False)
-                stock.shares += data['shares']
-                account.cash_amount -= cost
-                account.equity_amount += data['amount']
-            elif data['trade_type'] == 'sell':
-                if account.cash_amount < Account.BROKERAGE_FEE:
-                    return self.success_response(result=ResponseErrors.NOT_ENOUGH_FUNDS, success=False)
-                if stock.shares < data['shares']:
-                    return self.success_response(result=ResponseErrors.TOO_MANY_SHARES, success=False)
-                if stock.shares == data['shares']:
-                    delete_flag = True
-                    stock.sold_on = data['process_date']
-                stock.shares -= data['shares']
-                account.cash_amount -= Account.BROKERAGE_FEE
-                account.cash_amount += data['amount']
-                account.equity_amount -= (stock.bought_at*data['shares'])
-
-            trade = Trade(
-                user_id=account.user_id,
-                account_id=account.id,
-                stock_id=stock.id,
-                trade_type=data['trade_type'],
-                price=data['price'],
-                shares=data['shares'],
-            )
-            session.add(trade)
-
-            if delete_flag:
-                session.query(Stock).filter(Stock.id==stock.id).delete()
-            else:
-                session.add(stock)
+        try:
+            trade_executor.trade(current_user.id, account_id, data)
+        except TradeError as err:
+            return self.trade_error_response(err)
 
         return self.success_response('ok')
 
@@ -229,68 +196,214 @@ class StockResource(BaseResource):
         id : int
             Account identifier.
         """
-        result = {}
         schema = TradeSchema()
         try:
             data = schema.loads(request.get_data())
         except ValidationError as err:
             return self.error_response(err.messages, HTTPStatus.BAD_REQUEST)
         data['account_id'] = account_id
-        trade_type = 'buy'
-        
-        with db.session_scope() as session:
-            account = session.query(Account).filter_by(id=account_id).first()
-            if not account:
+        data['trade_type'] = 'buy'
+
+        try:
+            trade = trade_executor.trade(current_user.id, account_id, data, open_position=True)
+        except TradeError as err:
+            return self.trade_error_response(err)
+
+        result = {'stock_id': trade.stock_id, 'account': dump_account(trade.account)}
+        return self.success_response(result=result, status_code=HTTPStatus.CREATED)
+
+class TradeResource(BaseResource):
+
+    @login_required
+    def get(self, account_id):
+        """
+        Get the trade history of an account, newest first. Pages are
+        requested with the `cursor` returned as `next_cursor` by the previous
+        page.
+
+        Params
+        ------
+        account_id : int
+            Account identifier.
+        """
+        try:
+            args = TradeListSchema().load(request.args)
+            before = decode_cursor(args['cursor']) if 'cursor' in args else None
+        except ValidationError as err:
+            return self.error_response(err.messages, HTTPStatus.BAD_REQUEST)
+        except ValueError:
+            return self.error_response(ResponseErrors.INVALID_CURSOR, HTTPStatus.BAD_REQUEST)
+
+        with db.read_session_scope(current_user.id) as session:
+            user_id = session.query(Account.user_id).filter(Account.id == account_id).scalar()
+            if user_id is None:
                 return self.error_response(ResponseErrors.ACCOUNT_DNE, HTTPStatus.NOT_FOUND)
-            if account.user_id != current_user.id:
+            if user_id != current_user.id:
                 return self.error_response(ResponseErrors.ACCOUNT_NO_ACCESS, HTTPStatus.FORBIDDEN)
 
-            for stock in account.stocks:
-                if stock.symbol == data['symbol']:
-                    return self.error_response(ResponseErrors.STOCK_EXISTS, HTTPStatus.METHOD_NOT_ALLOWED)
-
-            total = data['amount'] + Account.BROKERAGE_FEE
-            if account.cash_amount < total:
-                return self.success_response(result=ResponseErrors.NOT_ENOUGH_FUNDS, success=False)
-
-            existing_s = session.query(Stock).filter_by(account_id=account_id, symbol=data['symbol']).first()
-            if existing_s:
-                return self.error_response(ResponseErrors.STOCK_EXISTS, HTTPStatus.BAD_REQUEST)
-
-            s = Stock(
-                account_id=account_id,
-                bought_at=data['price'],
-                bought_on=data['process_date'],
-                initial_cost=data['amount'],
-                shares=data['shares'],
-                symbol=data['symbol']
-            )
-            session.add(s)
+            trades = PortfolioRepository(session).get_trades(account_id, args['limit'] + 1, before)
+            next_cursor = None
+            if len(trades) > args['limit']:
+                trades = trades[:args['limit']]
+                next_cursor = encode_cursor(trades[-1].process_date, trades[-1].id)
+
+            schema = TradeReadSchema(many=True)
+            result = {'trades': schema.dump(trades), 'next_cursor': next_cursor}
+        return self.success_response(result=result)
+
+    @login_required
+    @validate_request_json
+    def post(self, account_id):
+        """
+        Submit a batch of buy and sell orders, given as `orders` with `symbol`,
+        `shares` and `trade_type` each. All orders are priced from a single
+        quote fetch and executed in one transaction.
+
+        Params
+        ------
+        account_id : int
+            Account identifier.
+        """
+        orders = (request.get_json() or {}).get('orders')
+        if not isinstance(orders, list) or not orders or not all(isinstance(o, dict) for o in orders):
+            return self.error_response(ResponseErrors.ORDERS_REQUIRED, HTTPStatus.BAD_REQUEST)
+        if len(orders) > current_app.config['TRADE_BATCH_LIMIT']:
+            return self.error_response(ResponseErrors.ORDERS_TOO_MANY, HTTPStatus.BAD_REQUEST)
+
+        # Prices come from the quotes, fetched once the orders are valid.
+        schema = TradeSchema(many=True, partial=('price',))
+        try:
+            data = schema.load(orders)
+        except ValidationError as err:
+            return self.error_response(err.messages, HTTPStatus.BAD_REQUEST)
+
+        symbols = {order['symbol'].upper() for order in data}
+        quotes = self.iex_api.get_quotes(symbols)
+        if quotes is False or not symbols.issubset(quotes):
+            return self.error_response(ResponseErrors.STOCK_DATA_UNAVAILABLE, HTTPStatus.BAD_REQUEST)
+        for order in data:
+            price = quotes[order['symbol'].upper()].get('latestPrice')
+            if price is None:
+                return self.error_response(ResponseErrors.STOCK_DATA_UNAVAILABLE, HTTPStatus.BAD_REQUEST)
+            order['price'] = float(price)
+            order['amount'] = trade_amount(order['shares'], order['price'])
+
+        try:
+            batch = trade_executor.trade_batch(current_user.id, account_id, data)
+        except TradeError as err:
+            return self.trade_error_response(err)
+
+        result = {'orders': batch.orders, 'account': dump_account(batch.account)}
+        return self.success_response(result=result)
+
+class OrderResource(BaseResource):
+
+    def account_error(self, session, account_id):
+        user_id = session.query(Account.user_id).filter(Account.id == account_id).scalar()
+        if user_id is None:
+            return self.error_response(ResponseErrors.ACCOUNT_DNE, HTTPStatus.NOT_FOUND)
+        if user_id != current_user.id:
+            return self.error_response(ResponseErrors.ACCOUNT_NO_ACCESS, HTTPStatus.FORBIDDEN)
+        return None
+
+    @login_required
+    def get(self, account_id):
+        """
+        Get the orders of an account, newest first, optionally only those
+        with the given `status`.
+
+        Params
+        ------
+        account_id : int
+            Account identifier.
+        """
+        try:
+            args = OrderListSchema().load(request.args)
+        except ValidationError as err:
+            return self.error_response(err.messages, HTTPStatus.BAD_REQUEST)
+
+        with db.read_session_scope(current_user.id) as session:
+            error = self.account_error(session, account_id)
+            if error:
+                return error
+
+            query = session.query(Order).filter(Order.account_id == account_id)
+            if 'status' in args:
+                query = query.filter(Order.status == args['status'])
+            orders = query.order_by(Order.created_at.desc()).limit(args['limit']).all()
+            result = {'orders': OrderSchema(many=True).dump(orders)}
+        return self.success_response(result=result)
+
+    @login_required
+    @validate_request_json
+    def post(self, account_id):
+        """
+        Place a resting `limit`, `stop` or `stop_limit` order, executed by the
+        order engine once the market reaches its price. Cash and shares are
+        checked when the order fills, not when it is placed.
+
+        Params
+        ------
+        account_id : int
+            Account identifier.
+        """
+        if not order_engine.enabled:
+            return self.error_response(ResponseErrors.ORDERS_DISABLED, HTTPStatus.NOT_FOUND)
+        schema = OrderSchema()
+        try:
+            data = schema.loads(request.get_data())
+        except ValidationError as err:
+            return self.error_response(err.messages, HTTPStatus.BAD_REQUEST)
+
+        with db.session_scope() as session:
+            error = self.account_error(session, account_id)
+            if error:
+                return error
+
+            order = Order(user_id=current_user.id, account_id=account_id, **data)
+            session.add(order)
             session.flush()
+            result = schema.dump(order)
 
-            s_id = s.id
-            if s_id:
-                account.cash_amount -= Account.BROKERAGE_FEE
-                account.cash_amount -= total
-                account.equity_amount += data['amount']
-                result['stock_id'] = s_id
-
-                ar_schema = AccountReadSchema()
-                ar_data = ar_schema.dump(account)
-                result['account'] = ar_data
-
-                trade = Trade(
-                    user_id=account.user_id,
-                    account_id=account.id,
-                    stock_id=s_id,
-                    trade_type=trade_type,
-                    price=data['price'],
-                    shares=data['shares'],
-                )
-                session.add(trade)
+        order_engine.start()
+        order_engine.add(order)
         return self.success_response(result=result, status_code=HTTPStatus.CREATED)
 
+    @login_required
+    def delete(self, account_id, order_id):
+        """
+        Cancel an open order.
+
+        Params
+        ------
+        account_id : int
+            Account identifier.
+        order_id : int
+            Order identifier.
+        """
+        with db.session_scope() as session:
+            error = self.account_error(session, account_id)
+            if error:
+                return error
+
+            order = session.query(Order).\
+                filter(Order.id == order_id, Order.account_id == account_id).\
+                with_for_update().first()
+            if order is None:
+                return self.error_response(ResponseErrors.ORDER_DNE, HTTPStatus.NOT_FOUND)
+            if order.status != 'open':
+                return self.error_response(ResponseErrors.ORDER_NOT_OPEN, HTTPStatus.BAD_REQUEST)
+            order.status = 'cancelled'
+            order.closed_at = clock.now()
+
+        order_engine.remove(order_id)
+        return self.success_response(result='ok')
+
 accounts.add_resource(AccountResource, '', methods=['POST', 'GET', 'DELETE'])
 accounts.add_resource(AccountResource, '/<string:action>', methods=['PATCH'], endpoint='account_patch')
 accounts.add_resource(StockResource, '/<int:account_id>/stocks', methods=['POST'])
-accounts.add_resource(StockResource, '/<int:account_id>/stocks/<int:stock_id>', methods=['PUT'], endpoint='stock_update')
\ No newline at end of file
+accounts.add_resource(StockResource, '/<int:account_id>/stocks/<int:stock_id>', methods=['PUT'], endpoint='stock_update')
+accounts.add_resource(TradeResource, '/<int:account_id>/trades', methods=['GET', 'POST'])
+accounts.add_resource(OrderResource, '/<int:account_id>/orders', methods=['GET', 'POST'])
+accounts.add_resource(OrderResource, '/<int:account_id>/orders/<int:order_id>', methods=['DELETE'],
+    endpoint='order_cancel')
\ No newline at end of file
@@ -6,11 +6,12 @@ from flask import request, jsonify
 from flask_restful import Resource
 
 from trader.lib.definitions import ResponseErrors
-from trader.services.third_party.iex import IEXApi
+from trader.extensions import iex_api
+from trader.services.trading import TradeRejected
 
 class BaseResource(Resource):
     def __init__(self):
-        self.iex_api = IEXApi()
+        self.iex_api = iex_api
 
     def http_response(self, response, status_code):
         return response, status_code
@@ -26,6 +27,15 @@ class BaseResource(Resource):
         response['success'] = success
         return self.http_response(response, status_code)
 
+    def trade_error_response(self, error):
+        """
+        Response for a `TradeError`. Trades rejected by the account rules are
+        reported as unsuccessful results rather than HTTP errors.
+        """
+        if isinstance(error, TradeRejected):
+            return self.success_response(result=error.message, success=False)
+        return self.error_response(error.message, error.status_code)
+
 def validate_request_json(f):
     @wraps(f)
     def decorated(*args, **kwargs):
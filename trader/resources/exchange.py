@@ -1,13 +1,18 @@
 import json
 import math
 
+from http import HTTPStatus
 from datetime import datetime, timedelta
-from flask import request, Blueprint
+from flask import request, Blueprint, Response, stream_with_context
 from flask_restful import Api, Resource
+from trader.extensions import price_stream
+from trader.lib.definitions import ResponseErrors
+from trader.lib.serialization import output_json
 from trader.resources.base_resource import BaseResource
 
 exchange_bp = Blueprint('exchange', __name__)
 exchange = Api(exchange_bp)
+exchange.representation('application/json')(output_json)
 
 class ExchangeResource(BaseResource):
     def get(self):
@@ -15,9 +20,9 @@ class ExchangeResource(BaseResource):
         Retrieve summaries and up-to-date price information for specified list of stocks.
         """
         stock_list = request.args.getlist("stock")
-        results = []
+        response = {}
         if len(stock_list) > 0:
-            response = self.iex_api.get_stock_data(stock_list)
+            response = self.iex_api.get_stock_data(stock_list, raw=True)
         return self.success_response(response)
 
 class ExchangeSearchResource(BaseResource):
@@ -32,5 +37,33 @@ class ExchangeSearchResource(BaseResource):
         response = self.iex_api.search_symbol(symbol)
         return self.success_response(response)
 
+class ExchangeStreamResource(BaseResource):
+    def get(self):
+        """
+        Stream quote updates for specified list of stocks as server-sent events.
+        """
+        stock_list = request.args.getlist("stock")
+        if not stock_list:
+            return self.error_response(ResponseErrors.STREAM_NO_SYMBOLS, HTTPStatus.BAD_REQUEST)
+        if len(stock_list) > price_stream.max_symbols:
+            return self.error_response(ResponseErrors.STREAM_TOO_MANY_SYMBOLS, HTTPStatus.BAD_REQUEST)
+
+        subscription = price_stream.subscribe(stock_list)
+
+        def events():
+            try:
+                while True:
+                    event = subscription.get(timeout=price_stream.heartbeat)
+                    if event is None:
+                        yield ': keep-alive\n\n'
+                    else:
+                        yield 'event: quote\ndata: {}\n\n'.format(json.dumps(event))
+            finally:
+                price_stream.unsubscribe(subscription)
+
+        headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        return Response(stream_with_context(events()), mimetype='text/event-stream', headers=headers)
+
 exchange.add_resource(ExchangeResource, '', methods=['GET'])
+exchange.add_resource(ExchangeStreamResource, '/stream', methods=['GET'])
 exchange.add_resource(ExchangeSearchResource, '/search/<string:symbol>', methods=['GET'])
\ No newline at end of file
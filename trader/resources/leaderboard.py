@@ -0,0 +1,46 @@
+from http import HTTPStatus
+
+from flask import request, Blueprint
+from marshmallow import ValidationError
+from flask_login import login_required, current_user
+from flask_restful import Api
+from redis import RedisError
+
+from trader.extensions import leaderboard
+from trader.lib.definitions import ResponseErrors
+from trader.lib.serialization import output_json
+from trader.schemas import LeaderboardQuerySchema
+from trader.resources.base_resource import BaseResource
+
+leaderboard_bp = Blueprint('leaderboard', __name__)
+leaderboard_api = Api(leaderboard_bp)
+leaderboard_api.representation('application/json')(output_json)
+
+class LeaderboardResource(BaseResource):
+    @login_required
+    def get(self):
+        """
+        Get the accounts with the best return, along with the rank of the
+        current user's account and the accounts ranked around it.
+
+        Params
+        ------
+        limit : int
+            Number of top accounts to return.
+        around : int
+            Number of accounts above and below the user's own to return.
+        """
+        if not leaderboard.enabled:
+            return self.error_response(ResponseErrors.LEADERBOARD_DISABLED, HTTPStatus.NOT_FOUND)
+        try:
+            args = LeaderboardQuerySchema().load(request.args)
+        except ValidationError as err:
+            return self.error_response(err.messages, HTTPStatus.BAD_REQUEST)
+
+        try:
+            result = leaderboard.get(current_user.id, args['limit'], args['around'])
+        except RedisError:
+            return self.error_response(ResponseErrors.DEFAULT, HTTPStatus.SERVICE_UNAVAILABLE)
+        return self.success_response(result=result)
+
+leaderboard_api.add_resource(LeaderboardResource, '', methods=['GET'])
@@ -0,0 +1,228 @@
+import json
+
+from http import HTTPStatus
+
+from flask import request, Blueprint, Response, stream_with_context
+from marshmallow import ValidationError
+from flask_login import login_required, current_user
+from flask_restful import Api
+
+from trader.extensions import replay_engine, price_stream
+from trader.lib import clock
+from trader.lib.definitions import ResponseErrors
+from trader.lib.serialization import output_json
+from trader.schemas import ReplaySessionSchema, TradeSchema, OrderSchema
+from trader.services.trading import TradeError
+from trader.resources.base_resource import BaseResource, validate_request_json
+
+replay_bp = Blueprint('replay', __name__)
+replay = Api(replay_bp)
+replay.representation('application/json')(output_json)
+
+class ReplayResource(BaseResource):
+    @login_required
+    @validate_request_json
+    def post(self):
+        """
+        Start a replay session over stored price history, given `symbols`,
+        `start` and optionally `end`, `speed` (simulated seconds per second)
+        and starting `cash`.
+        """
+        try:
+            data = ReplaySessionSchema().loads(request.get_data())
+        except ValidationError as err:
+            return self.error_response(err.messages, HTTPStatus.BAD_REQUEST)
+
+        try:
+            session = replay_engine.create(current_user.id, **data)
+        except TradeError as err:
+            return self.trade_error_response(err)
+        return self.success_response(result=session.state(), status_code=HTTPStatus.CREATED)
+
+class ReplaySessionResource(BaseResource):
+    @login_required
+    def get(self, session_id):
+        """
+        Get the quotes, positions and valuation of a replay session at its
+        clock.
+
+        Params
+        ------
+        session_id : str
+            Replay session identifier.
+        """
+        try:
+            session = replay_engine.get(session_id, current_user.id)
+        except TradeError as err:
+            return self.trade_error_response(err)
+
+        result = session.state()
+        result['quotes'] = session.quotes()
+        result['orders'] = session.order_list()
+        return self.success_response(result=result)
+
+    @login_required
+    def patch(self, session_id, action):
+        """
+        Pause or resume a replay session.
+
+        Params
+        ------
+        session_id : str
+            Replay session identifier.
+        action : str
+            'pause' or 'resume'
+        """
+        if action not in ['pause', 'resume']:
+            return self.error_response(ResponseErrors.REPLAY_INVALID_ACTION, HTTPStatus.BAD_REQUEST)
+        try:
+            session = replay_engine.get(session_id, current_user.id)
+        except TradeError as err:
+            return self.trade_error_response(err)
+
+        session.paused = action == 'pause'
+        return self.success_response(result=session.state())
+
+    @login_required
+    def delete(self, session_id):
+        """
+        Stop a replay session.
+
+        Params
+        ------
+        session_id : str
+            Replay session identifier.
+        """
+        try:
+            session = replay_engine.get(session_id, current_user.id)
+        except TradeError as err:
+            return self.trade_error_response(err)
+
+        replay_engine.stop(session)
+        return self.success_response(result='ok')
+
+class ReplayTradeResource(BaseResource):
+    @login_required
+    @validate_request_json
+    def post(self, session_id):
+        """
+        Buy or sell `shares` of `symbol` at the replay price.
+
+        Params
+        ------
+        session_id : str
+            Replay session identifier.
+        """
+        try:
+            session = replay_engine.get(session_id, current_user.id)
+        except TradeError as err:
+            return self.trade_error_response(err)
+
+        data = request.get_json() or {}
+        price = session.price(str(data.get('symbol', '')))
+        if price is None:
+            return self.error_response(ResponseErrors.STOCK_DATA_UNAVAILABLE, HTTPStatus.BAD_REQUEST)
+        data['price'] = price
+
+        with clock.use_clock(session.clock):
+            try:
+                data = TradeSchema().load(data)
+            except ValidationError as err:
+                return self.error_response(err.messages, HTTPStatus.BAD_REQUEST)
+
+        try:
+            trade = session.trade(data)
+        except TradeError as err:
+            return self.trade_error_response(err)
+        return self.success_response(result={'trade': trade, 'session': session.state()})
+
+class ReplayOrderResource(BaseResource):
+    @login_required
+    @validate_request_json
+    def post(self, session_id):
+        """
+        Place a resting order in a replay session, filled when a later bar
+        crosses its price.
+
+        Params
+        ------
+        session_id : str
+            Replay session identifier.
+        """
+        try:
+            session = replay_engine.get(session_id, current_user.id)
+            data = OrderSchema().loads(request.get_data())
+        except ValidationError as err:
+            return self.error_response(err.messages, HTTPStatus.BAD_REQUEST)
+        except TradeError as err:
+            return self.trade_error_response(err)
+
+        try:
+            order = session.place_order(data)
+        except TradeError as err:
+            return self.trade_error_response(err)
+        return self.success_response(result=order, status_code=HTTPStatus.CREATED)
+
+    @login_required
+    def delete(self, session_id, order_id):
+        """
+        Cancel an open order of a replay session.
+
+        Params
+        ------
+        session_id : str
+            Replay session identifier.
+        order_id : int
+            Order identifier.
+        """
+        try:
+            session = replay_engine.get(session_id, current_user.id)
+            session.cancel_order(order_id)
+        except TradeError as err:
+            return self.trade_error_response(err)
+        return self.success_response(result='ok')
+
+class ReplayStreamResource(BaseResource):
+    @login_required
+    def get(self, session_id):
+        """
+        Stream bars, trades and order updates of a replay session as
+        server-sent events.
+
+        Params
+        ------
+        session_id : str
+            Replay session identifier.
+        """
+        try:
+            session = replay_engine.get(session_id, current_user.id)
+        except TradeError as err:
+            return self.trade_error_response(err)
+
+        subscription = session.subscribe(replay_engine.queue_size)
+
+        def events():
+            try:
+                while True:
+                    event = subscription.get(timeout=price_stream.heartbeat)
+                    if event is None:
+                        yield ': keep-alive\n\n'
+                    else:
+                        yield 'event: {}\ndata: {}\n\n'.format(event['event'], json.dumps(event['data']))
+                        if event['event'] == 'finished':
+                            return
+            finally:
+                session.unsubscribe(subscription)
+
+        headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        return Response(stream_with_context(events()), mimetype='text/event-stream', headers=headers)
+
+replay.add_resource(ReplayResource, '', methods=['POST'])
+replay.add_resource(ReplaySessionResource, '/<string:session_id>', methods=['GET', 'DELETE'])
+replay.add_resource(ReplaySessionResource, '/<string:session_id>/<string:action>', methods=['PATCH'],
+    endpoint='replay_patch')
+replay.add_resource(ReplayTradeResource, '/<string:session_id>/trades', methods=['POST'])
+replay.add_resource(ReplayOrderResource, '/<string:session_id>/orders', methods=['POST'])
+replay.add_resource(ReplayOrderResource, '/<string:session_id>/orders/<int:order_id>', methods=['DELETE'],
+    endpoint='replay_order_cancel')
+replay.add_resource(ReplayStreamResource, '/<string:session_id>/stream', methods=['GET'])
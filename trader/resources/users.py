@@ -4,17 +4,20 @@ import logging
 
 from http import HTTPStatus
 from flask import request, Blueprint
+from flask_login import login_required, current_user
 from marshmallow import ValidationError
 from flask_restful import Api, Resource
 
-from trader.extensions import db
+from trader.extensions import db, credential_cache
 from trader.lib.definitions import ResponseErrors
+from trader.lib.serialization import output_json
 from trader.resources.base_resource import BaseResource, validate_request_json
 from trader.models import User
 from trader.schemas import UserVerifySchema, UserSchema, ClientSchema
 
 users_bp = Blueprint('users', __name__)
 users = Api(users_bp)
+users.representation('application/json')(output_json)
 
 class UserVerifyResource(BaseResource):
     @validate_request_json
@@ -48,7 +51,7 @@ class UserResource(BaseResource):
         id: int
             The identifier of the user
         """
-        with db.session_scope() as session:
+        with db.read_session_scope(id) as session:
             user = session.query(User).filter_by(id=id).first()
             if not user:
                 return self.error_response(ResponseErrors.USER_DNE, HTTPStatus.NOT_FOUND)
@@ -102,6 +105,22 @@ class UserResource(BaseResource):
         return self.success_response(result={'user_id': user_id, 'client_id': client_id}, \
             success=True, status_code=HTTPStatus.CREATED)
 
+class UserTokenResource(BaseResource):
+    @login_required
+    def post(self):
+        """
+        Issue an API token for the authenticated user, to be sent as
+        `Authorization: Bearer <token>` instead of the user's credentials.
+        """
+        if not credential_cache.tokens_enabled:
+            return self.error_response(ResponseErrors.TOKENS_DISABLED, HTTPStatus.NOT_FOUND)
+        token = credential_cache.issue_token(current_user)
+        if token is None:
+            return self.error_response(ResponseErrors.TOKENS_UNAVAILABLE, HTTPStatus.SERVICE_UNAVAILABLE)
+        return self.success_response(result={'token': token, 'expires_in': credential_cache.token_max_age},
+            status_code=HTTPStatus.CREATED)
+
 users.add_resource(UserResource, '', methods=['POST'])
 users.add_resource(UserResource, '/<int:id>', methods=['GET', 'PATCH'], endpoint='users_by_id')
-users.add_resource(UserVerifyResource, '/verify', methods=['POST'])
\ No newline at end of file
+users.add_resource(UserVerifyResource, '/verify', methods=['POST'])
+users.add_resource(UserTokenResource, '/token', methods=['POST'])
\ No newline at end of file
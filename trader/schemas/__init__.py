@@ -1,9 +1,10 @@
 from decimal import Decimal
 from datetime import datetime
-from marshmallow import validate, post_load, pre_dump
+from marshmallow import validate, post_load, pre_dump, validates_schema, ValidationError
 from marshmallow.fields import Float
 
 from trader.extensions import ma
+from trader.lib import clock
 
 class UserVerifySchema(ma.Schema):
     email = ma.Str(required=True, validate=validate.Length(min=3, max=254))
@@ -58,14 +59,6 @@ class AccountReadSchema(ma.Schema):
             data.pct_change = 0
         return data
 
-    @pre_dump
-    def calculate_pct_change(self, data, many, **kwargs):
-        """
-        Calculate 
-        """
-        data.pct_change = data.cash_amount + data.equity_amount
-        return data
-
 class AccountCreationSchema(ma.Schema):
     equity_amount = Float(default=float(0.00), validate=validate.Range(min=500))
     initial_amount = Float(required=True, validate=validate.Range(min=500))
@@ -78,10 +71,84 @@ class AccountCreationSchema(ma.Schema):
 class AccountUpdateSchema(ma.Schema):
     amount = Float(required=True, validate=validate.Range(min=20))
 
+class TradeReadSchema(ma.Schema):
+    id = ma.Integer()
+    stock_id = ma.Integer()
+    symbol = ma.Str()
+    trade_type = ma.Str()
+    process_date = ma.DateTime()
+    price = ma.Decimal(places=2, as_string=True)
+    shares = ma.Integer()
+
+class TradeListSchema(ma.Schema):
+    limit = ma.Integer(missing=50, validate=validate.Range(min=1, max=200))
+    cursor = ma.Str()
+
+class OrderSchema(ma.Schema):
+    id = ma.Integer(dump_only=True)
+    symbol = ma.Str(required=True, validate=validate.Length(min=1, max=5))
+    shares = ma.Integer(required=True, validate=validate.Range(min=1))
+    trade_type = ma.Str(required=True, validate=validate.OneOf(choices=['buy', 'sell']))
+    order_type = ma.Str(required=True, validate=validate.OneOf(choices=['limit', 'stop', 'stop_limit']))
+    limit_price = Float(validate=validate.Range(min=0.01))
+    stop_price = Float(validate=validate.Range(min=0.01))
+    status = ma.Str(dump_only=True)
+    created_at = ma.DateTime(dump_only=True)
+    triggered_at = ma.DateTime(dump_only=True)
+    closed_at = ma.DateTime(dump_only=True)
+    fill_price = ma.Decimal(places=2, as_string=True, dump_only=True)
+    trade_id = ma.Integer(dump_only=True)
+    message = ma.Str(dump_only=True)
+
+    @validates_schema
+    def validate_prices(self, data, **kwargs):
+        """
+        Limit orders need a `limit_price`, stop orders a `stop_price` and
+        stop-limit orders both.
+        """
+        order_type = data['order_type']
+        if order_type in ('limit', 'stop_limit') and data.get('limit_price') is None:
+            raise ValidationError('Required for limit orders.', 'limit_price')
+        if order_type in ('stop', 'stop_limit') and data.get('stop_price') is None:
+            raise ValidationError('Required for stop orders.', 'stop_price')
+
+    @post_load
+    def normalize(self, data, **kwargs):
+        data['symbol'] = data['symbol'].upper()
+        if data['order_type'] == 'stop':
+            data.pop('limit_price', None)
+        elif data['order_type'] == 'limit':
+            data.pop('stop_price', None)
+        return data
+
+class OrderListSchema(ma.Schema):
+    status = ma.Str(validate=validate.OneOf(choices=['open', 'filled', 'cancelled', 'rejected']))
+    limit = ma.Integer(missing=50, validate=validate.Range(min=1, max=200))
+
+class ReplaySessionSchema(ma.Schema):
+    symbols = ma.List(ma.Str(validate=validate.Length(min=1, max=5)), required=True,
+        validate=validate.Length(min=1))
+    start = ma.DateTime(required=True)
+    end = ma.DateTime()
+    speed = Float(validate=validate.Range(min=1))
+    cash = Float(missing=100000.0, validate=validate.Range(min=500))
+
+    @post_load
+    def normalize(self, data, **kwargs):
+        data['symbols'] = sorted({s.upper() for s in data['symbols']})
+        return data
+
+class LeaderboardQuerySchema(ma.Schema):
+    limit = ma.Integer(missing=10, validate=validate.Range(min=1, max=100))
+    around = ma.Integer(missing=5, validate=validate.Range(min=0, max=50))
+
+def trade_amount(shares, price):
+    return round(float(shares*price), 2)
+
 class TradeSchema(ma.Schema):
     account_id = ma.Integer(dump_only=True)
     price = Float(required=True, validate=validate.Range(min=0))
-    process_date = ma.DateTime(missing=datetime.today())
+    process_date = ma.DateTime(missing=clock.now)
     shares = ma.Integer(required=True, validate=validate.Range(min=1))
     symbol = ma.Str(required=True, validate=validate.Length(min=1, max=5))
     trade_type = ma.Str(load_only=True, validate=validate.OneOf(choices=['buy', 'sell']))
@@ -89,7 +156,9 @@ class TradeSchema(ma.Schema):
     @post_load
     def calculate_trade(self, data, **kwargs):
         """
-        Determine total amount of a trade.
+        Determine total amount of a trade, unless it is loaded without a
+        price to be priced later (see `trade_amount`).
         """
-        data['amount'] = round(float(data['shares']*data['price']), 2)
+        if 'price' in data:
+            data['amount'] = trade_amount(data['shares'], data['price'])
         return data
\ No newline at end of file
@@ -0,0 +1,75 @@
+"""
+Hand-written equivalents of the read schemas on the hottest endpoints,
+producing the same output without going through marshmallow's field
+machinery for every value.
+"""
+from decimal import Decimal
+
+CENTS = Decimal('0.01')
+
+def money(value):
+    """
+    Format `value` like `ma.Decimal(places=2, as_string=True)`.
+    """
+    return format(Decimal(str(value)).quantize(CENTS), 'f')
+
+def dump_account(account):
+    """
+    Same output as `AccountReadSchema().dump(account)`, without setting the
+    computed totals on `account`.
+    """
+    cash, equity, initial = account.cash_amount, account.equity_amount, account.initial_amount
+    total = cash + equity
+    if total < initial:
+        amt_change = total - initial
+        pct_change = (-1)*round(abs(amt_change)/initial, 2)*100
+    elif initial < total:
+        amt_change = total - initial
+        pct_change = round(amt_change/initial, 2)*100
+    else:
+        amt_change = 0
+        pct_change = 0
+
+    data = {
+        'id': account.id,
+        'user_id': account.user_id,
+        'amt_change': money(amt_change),
+        'pct_change': money(pct_change),
+        'cash_amount': money(cash),
+        'total_amount': money(total),
+        'equity_amount': money(equity),
+        'initial_amount': money(initial)
+    }
+    if hasattr(account, 'last_name'):
+        data['last_name'] = account.last_name
+    return data
+
+def dump_positions(positions):
+    """
+    Holdings of an account keyed by symbol, from position rows with `id`,
+    `symbol`, `shares` and `bought_at`.
+    """
+    stocks = {}
+    for position in positions:
+        shares, bought_at = position.shares, position.bought_at
+        stocks[position.symbol] = {
+            'id': position.id,
+            'symbol': position.symbol,
+            'shares': shares,
+            'bought_at': '%.2f' % bought_at,
+            'cost': '%.2f' % (bought_at*shares)
+        }
+    return stocks
+
+def add_prices(stocks, quotes):
+    """
+    Add the current `price` and `value` of each holding in `stocks` from
+    `quotes` (`{symbol: quote}`).
+    """
+    for symbol, stock in stocks.items():
+        quote = quotes.get(symbol)
+        if quote is not None:
+            price = float(quote['latestPrice'])
+            stock['price'] = '%.2f' % price
+            stock['value'] = '%.2f' % (price*stock['shares'])
+    return stocks
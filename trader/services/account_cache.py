@@ -0,0 +1,148 @@
+import os
+import time
+import logging
+import threading
+
+from redis import RedisError
+
+from trader.lib.serialization import dumps, loads
+
+class AccountCache:
+    """
+    Caches the database-derived part of each user's account view (totals
+    and holdings), so refreshing the dashboard costs no SQL queries. Prices
+    change far more often than the account, so they are not cached here but
+    merged in from the quote cache by the caller on every read.
+
+    Every user has a version in Redis, bumped by each committed trade,
+    batch and transfer (see `TradeExecutor.add_listener`). A view is only
+    served if it was loaded at the current version, so a load racing with a
+    trade can't put the old account back in the cache.
+
+    If a version can't be bumped, the user is marked dirty: this process
+    stops using the cache for them and keeps retrying the invalidation in
+    the background until it goes through or any cached view has expired.
+    """
+    def __init__(self):
+        self.redis = None
+        self.db = None
+        self.enabled = True
+        self.ttl = 300
+        self.retry_interval = 1
+
+        self._dirty = {}
+        self._lock = threading.Lock()
+        self._pid = None
+        self._retrier = None
+
+    def init_app(self, app, redis, executor=None, db=None):
+        """
+        Params
+        ------
+        executor : TradeExecutor, optional
+            Executor whose commits invalidate the views of their users.
+        db : TraderDB, optional
+            Database whose replicas the views are loaded from. Users of
+            invalidated views are marked as recent writers so the reload
+            reads the primary, which matters for trades committed outside
+            of their requests, such as order fills.
+        """
+        self.redis = redis
+        self.db = db
+        self.enabled = app.config.get('ACCOUNT_CACHE_ENABLED', self.enabled)
+        self.ttl = app.config.get('ACCOUNT_CACHE_TTL', self.ttl)
+        self.retry_interval = app.config.get('ACCOUNT_CACHE_RETRY_INTERVAL', self.retry_interval)
+        if self.enabled and executor is not None:
+            executor.add_listener(self.on_trade)
+
+    def get(self, user_id, loader):
+        """
+        Get the cached view of `user_id`, or call `loader()` and cache what
+        it returns. Nothing is cached when `loader` returns None.
+        """
+        if not self.enabled or self.is_dirty(user_id):
+            return loader()
+        view_key, ver_key = self._keys(user_id)
+        try:
+            raw, version = self.redis.mget([view_key, ver_key])
+        except RedisError as e:
+            logging.error({'exception': str(e), 'user_id': user_id})
+            return loader()
+
+        version = int(version or 0)
+        if raw is not None:
+            cached = loads(raw)
+            if cached['version'] == version:
+                return cached['view']
+
+        view = loader()
+        if view is not None:
+            try:
+                self.redis.setex(view_key, self.ttl, dumps({'version': version, 'view': view}))
+            except RedisError as e:
+                logging.error({'exception': str(e), 'user_id': user_id})
+        return view
+
+    def invalidate(self, user_id):
+        """
+        Bump the version of `user_id` and drop their view. Returns False if
+        Redis failed, in which case the user is marked dirty.
+        """
+        try:
+            self._invalidate(user_id)
+            return True
+        except RedisError as e:
+            logging.error({'exception': str(e), 'user_id': user_id})
+            self._mark_dirty(user_id)
+            return False
+
+    def is_dirty(self, user_id):
+        with self._lock:
+            deadline = self._dirty.get(user_id)
+        return deadline is not None and time.monotonic() < deadline
+
+    def _invalidate(self, user_id):
+        view_key, ver_key = self._keys(user_id)
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.incr(ver_key)
+        # Outlive any view loaded at the previous version.
+        pipe.expire(ver_key, self.ttl * 2)
+        pipe.delete(view_key)
+        pipe.execute()
+
+    def _mark_dirty(self, user_id):
+        with self._lock:
+            # A view cached before the failure is gone after `ttl` anyway.
+            self._dirty[user_id] = time.monotonic() + self.ttl
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._retrier = threading.Thread(target=self._run, name='account-cache-retry', daemon=True)
+                self._retrier.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.retry_interval)
+            with self._lock:
+                dirty = list(self._dirty.items())
+            now = time.monotonic()
+            for user_id, deadline in dirty:
+                if deadline > now:
+                    try:
+                        self._invalidate(user_id)
+                    except RedisError:
+                        continue
+                with self._lock:
+                    # Unless it failed again meanwhile.
+                    if self._dirty.get(user_id) == deadline:
+                        del self._dirty[user_id]
+
+    def on_trade(self, result):
+        user_id = result.account.user_id
+        # Before the version moves, so a load at the new version can't read a
+        # replica that is still behind the trade.
+        if self.db is not None and self.db.replicas:
+            self.db.mark_written(user_id)
+        self.invalidate(user_id)
+
+    def _keys(self, user_id):
+        return 'account:view:{}'.format(user_id), 'account:ver:{}'.format(user_id)
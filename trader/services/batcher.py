@@ -0,0 +1,133 @@
+import os
+import time
+import logging
+import threading
+
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+class BatchFetchError(Exception):
+    pass
+
+class BatchFetcher:
+    """
+    Coalesces per-symbol requests from concurrent callers into batched
+    upstream calls.
+
+    Requests arriving within `window` seconds of each other are collected,
+    deduplicated, split into chunks of at most `limit` symbols and fetched
+    concurrently on a thread pool. Each caller then gets back only the
+    symbols it asked for. Requests for a symbol that is already being
+    fetched join the in-flight call instead of issuing a new one.
+
+    Params
+    ------
+    fetch : callable
+        Called as `fetch(symbols, key)` for each chunk, returning a dict of
+        `{symbol: data}` or a falsy value on failure.
+    window : float
+        Seconds to wait for more callers before dispatching a batch.
+    limit : int
+        Maximum number of symbols per upstream call.
+    max_workers : int
+        Number of chunks fetched concurrently.
+    timeout : float
+        Seconds a caller waits for its results.
+    """
+    def __init__(self, fetch, window=0.005, limit=100, max_workers=4, timeout=15):
+        self.fetch_chunk = fetch
+        self.window = window
+        self.limit = limit
+        self.max_workers = max_workers
+        self.timeout = timeout
+
+        self._cond = threading.Condition()
+        self._pending = {}
+        self._inflight = {}
+        self._pid = None
+        self._executor = None
+        self._dispatcher = None
+
+    def fetch(self, symbols, key=()):
+        """
+        Get data for `symbols`, sharing upstream calls with any concurrent
+        caller asking for the same `key`.
+
+        Returns a dict of `{symbol: data}` for the symbols upstream knows
+        about, or False if any of the batches this caller depends on failed.
+        """
+        futures = {}
+        with self._cond:
+            self._ensure_started()
+            pending = self._pending.setdefault(key, {})
+            inflight = self._inflight.setdefault(key, {})
+            for symbol in symbols:
+                future = inflight.get(symbol) or pending.get(symbol)
+                if future is None:
+                    future = pending[symbol] = Future()
+                futures[symbol] = future
+            self._cond.notify()
+
+        done, not_done = wait(futures.values(), timeout=self.timeout)
+        if not_done:
+            logging.error({'exception': 'Batch fetch timed out', 'symbols': list(futures)})
+            return False
+
+        result = {}
+        for symbol, future in futures.items():
+            if future.exception() is not None:
+                return False
+            data = future.result()
+            if data is not None:
+                result[symbol] = data
+        return result
+
+    def _ensure_started(self):
+        # Threads don't survive a fork, so start them again in each worker.
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._pending = {}
+        self._inflight = {}
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        self._dispatcher = threading.Thread(target=self._run, name='batch-fetcher', daemon=True)
+        self._dispatcher.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not any(self._pending.values()):
+                    self._cond.wait()
+            # Give concurrent callers a moment to join this batch.
+            time.sleep(self.window)
+
+            with self._cond:
+                batches = self._pending
+                self._pending = {}
+                for key, futures in batches.items():
+                    self._inflight.setdefault(key, {}).update(futures)
+
+            for key, futures in batches.items():
+                symbols = list(futures)
+                for i in range(0, len(symbols), self.limit):
+                    chunk = symbols[i:i + self.limit]
+                    self._executor.submit(self._fetch, key, chunk, futures)
+
+    def _fetch(self, key, chunk, futures):
+        try:
+            data = self.fetch_chunk(chunk, key)
+            error = BatchFetchError('Upstream fetch failed') if data is False or data is None else None
+        except Exception as e:
+            logging.error({'exception': str(e), 'symbols': chunk})
+            data, error = None, e
+
+        with self._cond:
+            inflight = self._inflight.get(key, {})
+            for symbol in chunk:
+                if inflight.get(symbol) is futures[symbol]:
+                    del inflight[symbol]
+
+        for symbol in chunk:
+            if error is not None:
+                futures[symbol].set_exception(error)
+            else:
+                futures[symbol].set_result(data.get(symbol))
@@ -0,0 +1,375 @@
+import time
+import uuid
+import logging
+import threading
+
+from collections import OrderedDict
+from redis import RedisError
+
+from trader.lib.serialization import RawJSON, dumps, loads
+
+# Delete the refresh locks still held with our token. KEYS: locks; ARGV: token
+RELEASE = """
+local released = 0
+for _, key in ipairs(KEYS) do
+    if redis.call('GET', key) == ARGV[1] then
+        released = released + redis.call('DEL', key)
+    end
+end
+return released
+"""
+
+class LRUCache:
+    """
+    Small thread-safe, in-process LRU map where every entry carries its own
+    expiry time. Used as the first tier in front of Redis so that hot symbols
+    don't even cost a network round trip to the cache server.
+    """
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < now:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def keys(self):
+        with self._lock:
+            return list(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+class Entry:
+    """
+    A cached value along with its JSON encoding. Whichever one the entry
+    wasn't created from is computed on first use and kept, so values read
+    from Redis are only decoded, and loaded ones only encoded, if needed.
+    """
+    __slots__ = ('_value', '_raw')
+
+    def __init__(self, value=None, raw=None):
+        self._value = value
+        self._raw = raw
+
+    @property
+    def value(self):
+        if self._value is None:
+            self._value = loads(self._raw)
+        return self._value
+
+    @property
+    def raw(self):
+        if self._raw is None:
+            self._raw = RawJSON(dumps(self._value))
+        return self._raw
+
+class QuoteCache:
+    """
+    Two tier (in-process LRU + Redis) cache for per-symbol market data.
+
+    Entries are stored per symbol and per field (`quote`, `news:5`,
+    `chart:1m`, ...) so each kind of data can have its own TTL, and the
+    fields cached in Redis for each symbol are listed in a set next to them.
+    When several workers miss on the same symbol at once, only the one
+    holding the refresh lock goes upstream and the rest wait for it to fill
+    the cache.
+    """
+    DEFAULT_TTLS = {'quote': 5, 'news': 300, 'chart': 3600}
+
+    def __init__(self):
+        self.redis = None
+        self.local = LRUCache()
+        self.ttls = dict(self.DEFAULT_TTLS)
+        self.local_ttl = 1
+        self.lock_timeout = 5
+        self.lock_wait = 2
+        self.poll_interval = 0.05
+        self.prefix = 'iex'
+
+        self._release_script = None
+        self._stats = {'local_hits': 0, 'redis_hits': 0, 'misses': 0, 'refreshes': 0, 'lock_waits': 0}
+        self._stats_lock = threading.Lock()
+        self._local_locks = {}
+        self._local_locks_guard = threading.Lock()
+
+    def init_app(self, app, redis):
+        """
+        Read cache settings from the app configuration and bind the Redis
+        client created by `TraderDB.init_app`.
+        """
+        self.redis = redis
+        self._release_script = redis.register_script(RELEASE)
+        self.ttls.update(app.config.get('QUOTE_CACHE_TTL', {}))
+        self.local = LRUCache(app.config.get('QUOTE_CACHE_LOCAL_SIZE', 2048))
+        self.local_ttl = app.config.get('QUOTE_CACHE_LOCAL_TTL', self.local_ttl)
+        self.lock_timeout = app.config.get('QUOTE_CACHE_LOCK_TIMEOUT', self.lock_timeout)
+        self.lock_wait = app.config.get('QUOTE_CACHE_LOCK_WAIT', self.lock_wait)
+
+    def key(self, symbol, field):
+        return '{}:{}:{}'.format(self.prefix, field, symbol)
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def _incr(self, stat, amount=1):
+        if amount:
+            with self._stats_lock:
+                self._stats[stat] += amount
+
+    def get_many(self, symbols, fields, loader, raw=False):
+        """
+        Get `fields` for every symbol in `symbols`, going through the local
+        tier, then Redis, and only calling `loader` for what is still missing.
+
+        Params
+        ------
+        symbols : iterable of str
+            Stock symbols.
+        fields : iterable of str
+            Data fields to retrieve for each symbol, e.g. ('quote', 'chart:1m').
+        loader : callable
+            Called as `loader(symbols, fields)` and expected to return a dict
+            of `{symbol: {field: data}}`, or False on failure.
+        raw : bool
+            Return each data as its `RawJSON` encoding, as held in Redis.
+
+        Returns a dict of `{symbol: {field: data}}`, or False if the upstream
+        load failed.
+        """
+        entries = self._get_entries(symbols, fields, loader)
+        if entries is False:
+            return False
+        if raw:
+            return {s: {f: e.raw for f, e in values.items()} for s, values in entries.items()}
+        return {s: {f: e.value for f, e in values.items()} for s, values in entries.items()}
+
+    def _get_entries(self, symbols, fields, loader):
+        symbols = list(dict.fromkeys(s.upper() for s in symbols))
+        fields = tuple(fields)
+        result = {}
+
+        missing = self._read_local(symbols, fields, result)
+        missing = self._read_redis(missing, result)
+        self._incr('misses', len(missing))
+        if not missing:
+            return result
+
+        to_load = sorted({symbol for symbol, _ in missing})
+        owned, waiting, token = self._acquire(to_load)
+        try:
+            if owned:
+                # Only ask upstream for the fields each symbol is missing.
+                groups = {}
+                for symbol, field in missing:
+                    if symbol not in waiting:
+                        groups.setdefault(symbol, []).append(field)
+                by_fields = {}
+                for symbol, symbol_fields in groups.items():
+                    by_fields.setdefault(tuple(symbol_fields), []).append(symbol)
+
+                for group_fields, group_symbols in by_fields.items():
+                    self._incr('refreshes')
+                    data = loader(group_symbols, group_fields)
+                    if data is False:
+                        return False
+                    self._store(data, group_fields, result)
+        finally:
+            self._release(owned, token)
+
+        if waiting:
+            self._incr('lock_waits', len(waiting))
+            pending = [(s, f) for s, f in missing if s in waiting]
+            deadline = time.monotonic() + self.lock_wait
+            while pending and time.monotonic() < deadline:
+                time.sleep(self.poll_interval)
+                pending = self._read_redis(self._read_local_pairs(pending, result), result)
+
+            # The worker holding the lock didn't deliver in time; fetch ourselves.
+            if pending:
+                late = sorted({symbol for symbol, _ in pending})
+                late_fields = tuple(f for f in fields if any(f == pf for _, pf in pending))
+                data = loader(late, late_fields)
+                if data is False:
+                    return False
+                self._store(data, late_fields, result)
+
+        return result
+
+    def invalidate(self, symbol, fields=None):
+        """
+        Drop cached `fields` for `symbol` from both tiers, or all of its
+        entries if `fields` is None, whatever their parameters (`chart:1m`,
+        `chart:1y`, `news:5`, ...), as listed in the symbol's field set.
+        """
+        symbol = symbol.upper()
+        if fields is None:
+            keys = self._symbol_keys(symbol)
+        else:
+            keys = [self.key(symbol, f) for f in fields]
+        for key in keys:
+            self.local.delete(key)
+        if self.redis is not None and keys:
+            try:
+                self.redis.delete(*keys)
+            except RedisError as e:
+                logging.error({'exception': str(e), 'keys': keys})
+
+    def _symbol_keys(self, symbol):
+        prefix, suffix = '{}:'.format(self.prefix), ':{}'.format(symbol)
+        keys = {k for k in self.local.keys() if k.startswith(prefix) and k.endswith(suffix)}
+        if self.redis is not None:
+            try:
+                # Fields stored from now on are listed in a new set.
+                pipe = self.redis.pipeline()
+                pipe.smembers(self.fields_key(symbol))
+                pipe.delete(self.fields_key(symbol))
+                fields, _ = pipe.execute()
+                keys.update(self.key(symbol, f.decode()) for f in fields)
+            except RedisError as e:
+                logging.error({'exception': str(e), 'symbol': symbol})
+        return sorted(keys)
+
+    def fields_key(self, symbol):
+        return self.key(symbol, 'fields')
+
+    def _read_local(self, symbols, fields, result):
+        return self._read_local_pairs([(s, f) for s in symbols for f in fields], result)
+
+    def _read_local_pairs(self, pairs, result):
+        missing = []
+        for symbol, field in pairs:
+            entry = self.local.get(self.key(symbol, field))
+            if entry is None:
+                missing.append((symbol, field))
+            else:
+                result.setdefault(symbol, {})[field] = entry
+        self._incr('local_hits', len(pairs) - len(missing))
+        return missing
+
+    def _read_redis(self, pairs, result):
+        if not pairs or self.redis is None:
+            return pairs
+        try:
+            values = self.redis.mget([self.key(s, f) for s, f in pairs])
+        except RedisError as e:
+            logging.error({'exception': str(e)})
+            return pairs
+
+        missing = []
+        for (symbol, field), raw in zip(pairs, values):
+            if raw is None:
+                missing.append((symbol, field))
+                continue
+            entry = Entry(raw=RawJSON(raw))
+            self.local.set(self.key(symbol, field), entry, self._local_ttl(field))
+            result.setdefault(symbol, {})[field] = entry
+        self._incr('redis_hits', len(pairs) - len(missing))
+        return missing
+
+    def _store(self, data, fields, result):
+        pipe = self.redis.pipeline(transaction=False) if self.redis is not None else None
+        for symbol, values in data.items():
+            symbol = symbol.upper()
+            for field in fields:
+                if field not in values:
+                    continue
+                entry = Entry(value=values[field])
+                key = self.key(symbol, field)
+                self.local.set(key, entry, self._local_ttl(field))
+                if pipe is not None:
+                    pipe.setex(key, self.ttl(field), bytes(entry.raw))
+                    pipe.sadd(self.fields_key(symbol), field)
+                    # Outlives the entries it lists.
+                    pipe.expire(self.fields_key(symbol), max(self.ttls.values()))
+                result.setdefault(symbol, {})[field] = entry
+        if pipe is not None:
+            try:
+                pipe.execute()
+            except RedisError as e:
+                logging.error({'exception': str(e)})
+
+    def ttl(self, field):
+        """
+        TTL for `field`. Parameterised fields such as `chart:1m` use the TTL
+        of their base type.
+        """
+        return self.ttls.get(field.split(':', 1)[0], self.local_ttl)
+
+    def _local_ttl(self, field):
+        return min(self.ttl(field), self.local_ttl)
+
+    def _acquire(self, symbols):
+        """
+        Try to take the refresh lock for each symbol. Returns the symbols we
+        now own, the ones another worker is already refreshing, and the token
+        the Redis locks were taken with, or None if the locks are
+        process-local (Redis unavailable).
+
+        The token lets `_release` leave alone locks that expired during a slow
+        refresh and were taken by another worker since.
+        """
+        owned, waiting = [], set()
+        if self.redis is not None:
+            token = uuid.uuid4().hex
+            try:
+                pipe = self.redis.pipeline(transaction=False)
+                for symbol in symbols:
+                    pipe.set(self.key(symbol, 'lock'), token, nx=True, px=int(self.lock_timeout*1000))
+                for symbol, acquired in zip(symbols, pipe.execute()):
+                    if acquired:
+                        owned.append(symbol)
+                    else:
+                        waiting.add(symbol)
+                return owned, waiting, token
+            except RedisError as e:
+                logging.error({'exception': str(e)})
+
+        # Without Redis, only coordinate the threads of this process.
+        for symbol in symbols:
+            with self._local_locks_guard:
+                lock = self._local_locks.setdefault(symbol, threading.Lock())
+            if lock.acquire(blocking=False):
+                owned.append(symbol)
+            else:
+                waiting.add(symbol)
+        return owned, waiting, None
+
+    def _release(self, symbols, token):
+        if not symbols:
+            return
+        if token is None:
+            with self._local_locks_guard:
+                for symbol in symbols:
+                    self._local_locks[symbol].release()
+        else:
+            try:
+                self._release_script(keys=[self.key(s, 'lock') for s in symbols], args=[token])
+            except RedisError as e:
+                logging.error({'exception': str(e)})
@@ -0,0 +1,182 @@
+import hmac
+import json
+import hashlib
+import logging
+
+from redis import RedisError
+from sqlalchemy import event, inspect
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+
+from trader.models import User
+from trader.services.cache import LRUCache
+
+class CredentialCache:
+    """
+    Remembers recently verified credentials so that API requests using HTTP
+    Basic authentication don't run bcrypt and a user query every time.
+
+    Credentials are stored under an HMAC of the email and password keyed with
+    the app's `SECRET_KEY`, never in the clear. Every user has a credential
+    version in Redis which is bumped when their password changes; cached
+    credentials and issued tokens carry the version they were created with
+    and stop being accepted as soon as it moves on. While the version can't
+    be read, nothing is accepted from the cache and no token is valid.
+    """
+    PROFILE_FIELDS = ('id', 'email', 'first_name', 'last_name')
+
+    def __init__(self):
+        self.redis = None
+        self.secret = None
+        self.ttl = 60
+        self.token_max_age = 3600
+        self.tokens_enabled = False
+        self.serializer = None
+        self.local = LRUCache()
+        self.local_ttl = 5
+
+    def init_app(self, app, redis):
+        self.redis = redis
+        self.secret = app.config['SECRET_KEY'].encode()
+        self.ttl = app.config.get('AUTH_CACHE_TTL', self.ttl)
+        self.token_max_age = app.config.get('AUTH_TOKEN_MAX_AGE', self.token_max_age)
+        self.tokens_enabled = app.config.get('AUTH_TOKENS_ENABLED', self.tokens_enabled)
+        self.local = LRUCache(app.config.get('AUTH_CACHE_LOCAL_SIZE', 1024))
+        self.local_ttl = min(self.ttl, app.config.get('AUTH_CACHE_LOCAL_TTL', self.local_ttl))
+        self.serializer = URLSafeTimedSerializer(app.config['SECRET_KEY'], salt='api-token')
+
+        if not event.contains(User, 'after_update', self._password_changed):
+            event.listen(User, 'after_update', self._password_changed)
+
+    def get_user(self, email, password):
+        """
+        Get the user for previously verified credentials, or None if they
+        aren't cached (or are stale).
+        """
+        digest = self._digest(email, password)
+        cached = self.local.get(digest)
+        if cached is None:
+            try:
+                raw = self.redis.get('auth:cred:' + digest)
+            except RedisError as e:
+                logging.error({'exception': str(e)})
+                return None
+            if raw is None:
+                return None
+            cached = json.loads(raw)
+
+        user_id, version = cached
+        current = self.version(user_id)
+        if current is None or version != current:
+            return None
+        self.local.set(digest, cached, self.local_ttl)
+        return self.get_profile(user_id)
+
+    def remember(self, email, password, user, version):
+        """
+        Cache credentials that were just verified against the database.
+        `version` is the credential version of the user read before their
+        row was loaded; nothing is cached if it has moved on since, as the
+        password may have changed in between.
+        """
+        self.set_profile(user)
+        if version is None or self.version(user.id) != version:
+            return
+        digest = self._digest(email, password)
+        cached = [user.id, version]
+        self.local.set(digest, cached, self.local_ttl)
+        try:
+            self.redis.setex('auth:cred:' + digest, self.ttl, json.dumps(cached))
+        except RedisError as e:
+            logging.error({'exception': str(e)})
+
+    def get_profile(self, user_id):
+        """
+        Get a detached `User` with the public profile fields of `user_id`
+        from the cache, or None.
+        """
+        key = 'auth:profile:{}'.format(user_id)
+        profile = self.local.get(key)
+        if profile is None:
+            try:
+                raw = self.redis.get(key)
+            except RedisError as e:
+                logging.error({'exception': str(e)})
+                return None
+            if raw is None:
+                return None
+            profile = json.loads(raw)
+            self.local.set(key, profile, self.local_ttl)
+        return User(**profile)
+
+    def set_profile(self, user):
+        profile = {field: getattr(user, field) for field in self.PROFILE_FIELDS}
+        key = 'auth:profile:{}'.format(user.id)
+        self.local.set(key, profile, self.local_ttl)
+        try:
+            self.redis.setex(key, self.ttl, json.dumps(profile))
+        except RedisError as e:
+            logging.error({'exception': str(e)})
+
+    def issue_token(self, user):
+        """
+        Issue a signed API token for `user`, valid for `AUTH_TOKEN_MAX_AGE`
+        seconds or until their password changes. Returns None if their
+        credential version can't be read.
+        """
+        version = self.version(user.id)
+        if version is None:
+            return None
+        self.set_profile(user)
+        return self.serializer.dumps({'uid': user.id, 'ver': version})
+
+    def verify_token(self, token):
+        """
+        Get the user a token was issued to, or None if it is invalid,
+        expired or was issued before a password change.
+        """
+        try:
+            payload = self.serializer.loads(token, max_age=self.token_max_age)
+        except (BadSignature, SignatureExpired):
+            return None
+        version = self.version(payload['uid'])
+        if version is None or payload['ver'] != version:
+            return None
+        return self.get_profile(payload['uid'])
+
+    def invalidate_user(self, user_id):
+        """
+        Revoke every cached credential and token of `user_id`.
+
+        Raises the `RedisError` if the version can't be bumped. Called on
+        password changes, this aborts the flush so the password isn't
+        changed while the old credentials are still accepted.
+        """
+        self.local.delete('auth:profile:{}'.format(user_id))
+        try:
+            self.redis.incr('auth:ver:{}'.format(user_id))
+        except RedisError as e:
+            logging.error({'exception': str(e), 'user_id': user_id})
+            raise
+        try:
+            self.redis.delete('auth:profile:{}'.format(user_id))
+        except RedisError as e:
+            # The profile expires on its own and carries no credentials.
+            logging.error({'exception': str(e), 'user_id': user_id})
+
+    def version(self, user_id):
+        """
+        Credential version of `user_id`, or None if Redis can't be reached.
+        """
+        try:
+            return int(self.redis.get('auth:ver:{}'.format(user_id)) or 0)
+        except RedisError as e:
+            logging.error({'exception': str(e)})
+            return None
+
+    def _digest(self, email, password):
+        message = '{}\0{}'.format(email, password).encode()
+        return hmac.new(self.secret, message, hashlib.sha256).hexdigest()
+
+    def _password_changed(self, mapper, connection, target):
+        if inspect(target).attrs.password.history.has_changes():
+            self.invalidate_user(target.id)
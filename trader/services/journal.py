@@ -0,0 +1,750 @@
+import io
+import os
+import csv
+import time
+import uuid
+import socket
+import logging
+import threading
+import psycopg2
+
+from collections import namedtuple
+from contextlib import contextmanager
+from decimal import Decimal, ROUND_HALF_UP
+from http import HTTPStatus
+from redis import RedisError, ResponseError
+from sqlalchemy import select, text
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.dialects.postgresql import insert
+
+from trader.lib import clock
+from trader.lib.definitions import ResponseErrors
+from trader.models import Account, Stock, JournalFence
+from trader.services.trading import TradeError, TradeRejected, TradeResult
+
+# Amounts are kept in integer cents in Redis. Lua numbers are doubles, which
+# hold every cent amount exactly.
+
+# KEYS: ledger, lock, pending, stream, stock ids, trade ids, parked, owners
+# ARGV: account_id, symbol, trade_type, shares, price, amount, fee,
+# open_position, process_date, ledger ttl
+APPEND = """
+local function fmt(n)
+    return string.format('%.0f', n)
+end
+
+if redis.call('EXISTS', KEYS[7]) == 1 then
+    return {'parked'}
+end
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    return {'locked'}
+end
+local ledger = redis.call('HMGET', KEYS[1], 'account_id', 'user_id', 'cash', 'equity', 'initial')
+if not ledger[1] then
+    return {'missing'}
+end
+if ledger[1] ~= ARGV[1] then
+    return {'account'}
+end
+if redis.call('LLEN', KEYS[5]) == 0 or redis.call('LLEN', KEYS[6]) == 0 then
+    return {'ids'}
+end
+
+local cash, equity = tonumber(ledger[3]), tonumber(ledger[4])
+local symbol, trade_type = ARGV[2], ARGV[3]
+local shares, amount, fee = tonumber(ARGV[4]), tonumber(ARGV[6]), tonumber(ARGV[7])
+local field = 'pos:' .. symbol
+local position = redis.call('HGET', KEYS[1], field)
+
+-- id, shares, bought_at, initial_cost, bought_on
+local p = {}
+if position then
+    for v in string.gmatch(position, '[^,]+') do
+        p[#p + 1] = v
+    end
+    p[2] = tonumber(p[2])
+end
+if ARGV[8] == '1' then
+    if position then
+        return {'error', 'exists'}
+    end
+elseif not position then
+    return {'error', 'dne'}
+end
+
+local closed = '0'
+if trade_type == 'buy' then
+    if cash < amount + fee then
+        return {'rejected', 'funds'}
+    end
+    cash = cash - amount - fee
+    equity = equity + amount
+    if position then
+        p[2] = p[2] + shares
+    else
+        p = {redis.call('LPOP', KEYS[5]), shares, ARGV[5], ARGV[6], ARGV[9]}
+    end
+else
+    if cash < fee then
+        return {'rejected', 'funds'}
+    end
+    if p[2] < shares then
+        return {'rejected', 'shares'}
+    end
+    cash = cash - fee + amount
+    equity = equity - tonumber(p[3]) * shares
+    p[2] = p[2] - shares
+    if p[2] == 0 then
+        closed = '1'
+    end
+end
+p[2] = fmt(p[2])
+
+if closed == '1' then
+    redis.call('HDEL', KEYS[1], field)
+else
+    redis.call('HSET', KEYS[1], field, table.concat(p, ','))
+end
+redis.call('HMSET', KEYS[1], 'cash', fmt(cash), 'equity', fmt(equity))
+redis.call('EXPIRE', KEYS[1], ARGV[10])
+
+local trade_id = redis.call('LPOP', KEYS[6])
+local entry = redis.call('XADD', KEYS[4], '*',
+    'user_id', ledger[2], 'account_id', ARGV[1], 'trade_id', trade_id, 'trade_type', trade_type,
+    'symbol', symbol, 'shares', ARGV[4], 'price', ARGV[5], 'process_date', ARGV[9],
+    'stock_id', p[1], 'held', p[2], 'bought_at', p[3], 'initial_cost', p[4], 'bought_on', p[5],
+    'closed', closed, 'cash', fmt(cash), 'equity', fmt(equity), 'initial', ledger[5])
+redis.call('SADD', KEYS[3], entry)
+redis.call('HSET', KEYS[8], entry, ledger[2])
+return {'ok', p[1], trade_id, fmt(cash), fmt(equity), ledger[5]}
+"""
+
+# KEYS: ledger, lock, pending, epoch
+# ARGV: epoch, ledger ttl, then field, value pairs
+LOAD = """
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    return 'locked'
+end
+if (redis.call('GET', KEYS[4]) or '0') ~= ARGV[1] then
+    return 'stale'
+end
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 'ok'
+end
+if redis.call('SCARD', KEYS[3]) > 0 then
+    return 'busy'
+end
+for i = 3, #ARGV, 2 do
+    redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 'ok'
+"""
+
+# Take or renew a lease. KEYS: lease; ARGV: token, ms
+LEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    return 2
+end
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    return 1
+end
+return 0
+"""
+
+RELEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Move the dead letters of a user back to the stream, in order, or drop them
+# along with the ledger. Refused while the user has entries in flight.
+# KEYS: dead letters, stream, pending, parked, ledger, epoch, owners
+# ARGV: user_id, 'requeue' or 'discard'
+RESOLVE = """
+if redis.call('SCARD', KEYS[3]) > 0 then
+    return -1
+end
+local n = 0
+for _, item in ipairs(redis.call('XRANGE', KEYS[1], '-', '+')) do
+    local user, entry = nil, {}
+    for i = 1, #item[2], 2 do
+        local k, v = item[2][i], item[2][i + 1]
+        if k == 'user_id' then
+            user = v
+        end
+        if k ~= 'entry_id' and k ~= 'error' then
+            entry[#entry + 1] = k
+            entry[#entry + 1] = v
+        end
+    end
+    if user == ARGV[1] then
+        if ARGV[2] == 'requeue' then
+            local id = redis.call('XADD', KEYS[2], '*', unpack(entry))
+            redis.call('SADD', KEYS[3], id)
+            redis.call('HSET', KEYS[7], id, ARGV[1])
+        end
+        redis.call('XDEL', KEYS[1], item[1])
+        n = n + 1
+    end
+end
+redis.call('DEL', KEYS[4])
+if ARGV[2] == 'discard' then
+    redis.call('DEL', KEYS[5])
+    redis.call('INCR', KEYS[6])
+end
+return n
+"""
+
+REJECTIONS = {
+    'funds': ResponseErrors.NOT_ENOUGH_FUNDS,
+    'shares': ResponseErrors.TOO_MANY_SHARES
+}
+
+ERRORS = {
+    'exists': (ResponseErrors.STOCK_EXISTS, HTTPStatus.METHOD_NOT_ALLOWED),
+    'dne': (ResponseErrors.STOCK_DNE, HTTPStatus.NOT_FOUND)
+}
+
+# Errors in the entries themselves, raised through SQLAlchemy or, by COPY,
+# straight from psycopg2.
+DATA_ERRORS = (DataError, IntegrityError, psycopg2.DataError, psycopg2.IntegrityError)
+
+TRADE_COLUMNS = ('id', 'user_id', 'account_id', 'stock_id', 'symbol', 'trade_type', 'process_date', 'price',
+    'shares')
+
+LedgerAccount = namedtuple('LedgerAccount', 'id user_id cash_amount equity_amount initial_amount')
+LedgerPosition = namedtuple('LedgerPosition', 'id symbol shares bought_at')
+
+class FencedOut(Exception):
+    """
+    Raised by a flush whose lease was taken over by another flusher since.
+    """
+
+def cents(amount):
+    """
+    `amount` in integer cents, rounded the way Postgres rounds it into a
+    `Numeric(scale=2)` column.
+    """
+    return int(Decimal(repr(float(amount))).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP) * 100)
+
+def dollars(amount):
+    return Decimal(int(amount)).scaleb(-2)
+
+class TradeJournal:
+    """
+    Optional write-behind path for single trades.
+
+    Trades are checked against a ledger of each account held in Redis
+    (cash, equity and positions, loaded from the database on first use)
+    and appended, with the state they leave the account in, to a Redis
+    Stream in the same script. The client is answered as soon as that
+    returns. A flusher thread, run by one process at a time under a lease,
+    reads the stream through a consumer group and writes the trades,
+    positions and balances to Postgres in large batches: trades are copied
+    into a staging table and upserted, positions and accounts are written
+    with multi-row statements. Entries are acknowledged and deleted only
+    once committed, so after a crash the next flusher claims the pending
+    entries and writes them again, which is idempotent since trade and
+    position ids are allocated up front from their sequences.
+
+    Each new lease holder takes the next epoch of the `journal_fence` row,
+    and every flush locks that row and checks it still holds the current
+    epoch before writing. A flusher that lost its lease mid-flush therefore
+    can't commit after its successor, whose balances are newer.
+
+    Trades are as durable as Redis is configured to be (AOF with
+    `appendfsync`), and reach the database, and therefore the other
+    endpoints, one flush later.
+
+    Every other write to an account (batches, order fills, transfers,
+    deletion) runs in `exclusive`, which holds off new journal trades of
+    the user, waits for the pending ones to be flushed and drops the
+    ledger so it is reloaded afterwards.
+
+    Entries the database rejects (constraint violations, bad values) are
+    isolated by bisecting the batch and parked in a dead letter stream,
+    with the later entries of their users. Those users are put on hold:
+    their trades and other account writes are refused until the entries
+    are requeued or discarded (see `resolve`).
+    """
+    def __init__(self, db, executor):
+        self.db = db
+        self.executor = executor
+        self.redis = None
+        self.enabled = False
+        self.batch_size = 1000
+        self.flush_interval = 0.05
+        self.lease = 10
+        self.ledger_ttl = 86400
+        self.lock_timeout = 10
+        self.lock_wait = 5
+        self.poll_interval = 0.01
+        self.id_block = 1000
+        self.stream = 'journal:trades'
+        self.dead_letters = 'journal:dead'
+        # User of each entry in the stream, for entries deleted before
+        # they were written.
+        self.owners = 'journal:owners'
+        self.group = 'flusher'
+
+        self._append = None
+        self._load = None
+        self._lease = None
+        self._release = None
+        self._resolve = None
+        self._pid = None
+        self._thread = None
+        self._consumer = None
+        self._epoch = None
+        self._recovering = True
+
+    def init_app(self, app):
+        self.redis = self.db.redis
+        self.enabled = app.config.get('TRADE_JOURNAL_ENABLED', self.enabled)
+        self.batch_size = app.config.get('TRADE_JOURNAL_BATCH_SIZE', self.batch_size)
+        self.flush_interval = app.config.get('TRADE_JOURNAL_FLUSH_INTERVAL', self.flush_interval)
+        self.lease = app.config.get('TRADE_JOURNAL_LEASE', self.lease)
+        self.ledger_ttl = app.config.get('TRADE_JOURNAL_LEDGER_TTL', self.ledger_ttl)
+        self.lock_timeout = app.config.get('TRADE_JOURNAL_LOCK_TIMEOUT', self.lock_timeout)
+        self.lock_wait = app.config.get('TRADE_JOURNAL_LOCK_WAIT', self.lock_wait)
+        self.id_block = app.config.get('TRADE_JOURNAL_ID_BLOCK', self.id_block)
+        if not self.enabled:
+            return
+
+        self._append = self.redis.register_script(APPEND)
+        self._load = self.redis.register_script(LOAD)
+        self._lease = self.redis.register_script(LEASE)
+        self._release = self.redis.register_script(RELEASE)
+        self._resolve = self.redis.register_script(RESOLVE)
+        self.executor.journal = self
+
+    def keys(self, user_id):
+        return {name: 'journal:{}:{}'.format(name, user_id) for name in ('ledger', 'lock', 'pending', 'epoch',
+            'parked')}
+
+    def trade(self, user_id, account_id, data, open_position=False):
+        """
+        Check a trade against the ledger of `user_id` and append it to the
+        journal. Arguments are those of `TradeExecutor.trade`.
+
+        Returns a `TradeResult`, or None if the trade has to be executed
+        against the database instead, e.g. because the account isn't the
+        user's or is being written to directly. Raises a `TradeError` if the
+        user is on hold.
+        """
+        if data.get('trade_type') not in ('buy', 'sell'):
+            return None
+
+        keys = self.keys(user_id)
+        process_date = data.get('process_date') or clock.now()
+        args = [account_id, data['symbol'], data['trade_type'], int(data['shares']), cents(data['price']),
+            cents(data['amount']), cents(Account.BROKERAGE_FEE), int(open_position), process_date.isoformat(),
+            self.ledger_ttl]
+        try:
+            for _ in range(3):
+                reply = self._append(keys=[keys['ledger'], keys['lock'], keys['pending'], self.stream,
+                    'journal:ids:stocks', 'journal:ids:trades', keys['parked'], self.owners], args=args)
+                status = reply[0].decode()
+                if status == 'ok':
+                    stock_id, trade_id, cash, equity, initial = reply[1:]
+                    account = LedgerAccount(int(account_id), user_id, float(dollars(cash)),
+                        float(dollars(equity)), float(dollars(initial)))
+                    shares = data['shares'] if data['trade_type'] == 'buy' else -data['shares']
+                    return TradeResult(account, int(stock_id), int(trade_id),
+                        fills=[(data['symbol'], shares, data['price'])])
+                if status == 'rejected':
+                    raise TradeRejected(REJECTIONS[reply[1].decode()])
+                if status == 'error':
+                    raise TradeError(*ERRORS[reply[1].decode()])
+                if status == 'parked':
+                    raise TradeError(ResponseErrors.ACCOUNT_ON_HOLD, HTTPStatus.SERVICE_UNAVAILABLE)
+                if status == 'missing':
+                    if not self.load_ledger(user_id):
+                        return None
+                elif status == 'ids':
+                    self.allocate_ids()
+                else:
+                    return None
+        except RedisError as e:
+            logging.error({'exception': str(e), 'user_id': user_id})
+        return None
+
+    def load_ledger(self, user_id):
+        """
+        Load the ledger of `user_id` from the database. Returns False if the
+        user has no account or the ledger can't be loaded right now.
+        """
+        keys = self.keys(user_id)
+        epoch = (self.redis.get(keys['epoch']) or b'0').decode()
+        with self.db.session_scope() as session:
+            account = session.query(Account).filter(Account.user_id == user_id).first()
+            if account is None:
+                return False
+            positions = session.query(Stock.id, Stock.symbol, Stock.shares, Stock.bought_at, Stock.initial_cost,
+                Stock.bought_on).filter(Stock.account_id == account.id).all()
+
+        fields = ['account_id', account.id, 'user_id', account.user_id, 'cash', cents(account.cash_amount),
+            'equity', cents(account.equity_amount), 'initial', cents(account.initial_amount)]
+        for p in positions:
+            fields.extend(('pos:' + p.symbol, '{},{},{},{},{}'.format(p.id, p.shares, cents(p.bought_at),
+                cents(p.initial_cost), p.bought_on.isoformat())))
+        status = self._load(keys=[keys['ledger'], keys['lock'], keys['pending'], keys['epoch']],
+            args=[epoch, self.ledger_ttl] + fields)
+        return status == b'ok'
+
+    def get_portfolio(self, user_id):
+        """
+        The account of `user_id` and its positions as of its latest journal
+        trade, in the shape of `PortfolioRepository.get_portfolio`. The
+        ledger is ahead of the database until pending entries are flushed,
+        and up to date as long as it exists.
+
+        Returns None if the user has no ledger, in which case the database
+        is up to date.
+        """
+        if not self.enabled:
+            return None
+        try:
+            ledger = self.redis.hgetall(self.keys(user_id)['ledger'])
+        except RedisError as e:
+            logging.error({'exception': str(e), 'user_id': user_id})
+            return None
+        if not ledger:
+            return None
+
+        ledger = {k.decode(): v.decode() for k, v in ledger.items()}
+        account = LedgerAccount(int(ledger['account_id']), int(ledger['user_id']), float(dollars(ledger['cash'])),
+            float(dollars(ledger['equity'])), float(dollars(ledger['initial'])))
+        positions = []
+        for field, value in ledger.items():
+            if field.startswith('pos:'):
+                stock_id, shares, bought_at = value.split(',')[:3]
+                positions.append(LedgerPosition(int(stock_id), field[4:], int(shares), float(dollars(bought_at))))
+        return account, sorted(positions, key=lambda p: p.symbol)
+
+    def allocate_ids(self):
+        """
+        Draw a block of ids from the `stocks` and `trades` sequences for the
+        positions and trades of journal entries.
+        """
+        query = text('SELECT nextval(pg_get_serial_sequence(:table, \'id\')) FROM generate_series(1, :n)')
+        with self.db.engine.connect() as conn:
+            stock_ids = [row[0] for row in conn.execute(query, table='stocks', n=self.id_block)]
+            trade_ids = [row[0] for row in conn.execute(query, table='trades', n=self.id_block)]
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.rpush('journal:ids:stocks', *stock_ids)
+        pipe.rpush('journal:ids:trades', *trade_ids)
+        pipe.execute()
+
+    @contextmanager
+    def exclusive(self, user_id):
+        """
+        Write to the account of `user_id` directly in the database: new
+        journal trades of the user wait or go to the database too, and the
+        pending ones are flushed first. The ledger is dropped, to be
+        reloaded with the outcome on the next journal trade. Users on hold
+        can't be written to until their dead letters are resolved.
+        """
+        keys, token = self.keys(user_id), uuid.uuid4().hex
+        deadline = time.monotonic() + self.lock_wait
+        try:
+            while not self.redis.set(keys['lock'], token, nx=True, px=int(self.lock_timeout*1000)):
+                if time.monotonic() > deadline:
+                    raise TradeError(ResponseErrors.TRADE_UNAVAILABLE, HTTPStatus.SERVICE_UNAVAILABLE)
+                time.sleep(self.poll_interval)
+            while self.redis.scard(keys['pending']):
+                if time.monotonic() > deadline:
+                    self._release(keys=[keys['lock']], args=[token])
+                    raise TradeError(ResponseErrors.TRADE_UNAVAILABLE, HTTPStatus.SERVICE_UNAVAILABLE)
+                time.sleep(self.poll_interval)
+            # Set before parked entries leave `pending`, see `flush`.
+            if self.redis.exists(keys['parked']):
+                self._release(keys=[keys['lock']], args=[token])
+                raise TradeError(ResponseErrors.ACCOUNT_ON_HOLD, HTTPStatus.SERVICE_UNAVAILABLE)
+            # Loads that read the database before this write are refused.
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.delete(keys['ledger'])
+            pipe.incr(keys['epoch'])
+            pipe.execute()
+        except RedisError as e:
+            logging.error({'exception': str(e), 'user_id': user_id})
+            raise TradeError(ResponseErrors.TRADE_UNAVAILABLE, HTTPStatus.SERVICE_UNAVAILABLE)
+
+        try:
+            yield
+        finally:
+            try:
+                self._release(keys=[keys['lock']], args=[token])
+            except RedisError as e:
+                # The lock expires after `lock_timeout` anyway.
+                logging.error({'exception': str(e), 'user_id': user_id})
+
+    def start(self):
+        """
+        Start the flusher thread in this process. Only the process holding
+        the lease flushes; the others stand by to take over.
+        """
+        if not self.enabled or self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._consumer = '{}:{}'.format(socket.gethostname(), self._pid)
+        self._recovering = True
+        self._thread = threading.Thread(target=self._run, name='trade-journal', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                if self._lead():
+                    self.flush()
+                else:
+                    time.sleep(self.lease / 3)
+            except FencedOut:
+                logging.warning({'message': 'Trade journal flusher lost its lease', 'consumer': self._consumer})
+                self._epoch = None
+                self._recovering = True
+            except Exception as e:
+                logging.error({'exception': str(e), 'message': 'Trade journal flush failed'})
+                self._recovering = True
+                time.sleep(1)
+
+    def _lead(self):
+        acquired = self._lease(keys=['journal:flusher'], args=[self._consumer, int(self.lease*1000)])
+        if acquired == 1:
+            logging.info({'message': 'Trade journal flusher started', 'consumer': self._consumer})
+            self._epoch = None
+        if acquired and self._epoch is None:
+            self._ensure_group()
+            self._epoch = self.take_epoch()
+            self._recovering = True
+        return acquired > 0
+
+    def take_epoch(self):
+        """
+        Start a new flusher epoch. From then on, flushes of the previous
+        lease holder fail their fence check, and one already holding the
+        fence commits before this returns.
+        """
+        fence = JournalFence.__table__
+        stmt = insert(fence).values(id=1, epoch=1)
+        stmt = stmt.on_conflict_do_update(index_elements=['id'], set_={'epoch': fence.c.epoch + 1})
+        with self.db.engine.begin() as conn:
+            return conn.execute(stmt.returning(fence.c.epoch)).scalar()
+
+    def flush(self):
+        """
+        Write the next batch of entries, starting with those left pending by
+        a previous flusher or a failed flush. Returns the number of entries
+        written.
+        """
+        if self._recovering:
+            self._claim_pending()
+            reply = self.redis.xreadgroup(self.group, self._consumer, {self.stream: '0'}, count=self.batch_size)
+        else:
+            reply = self.redis.xreadgroup(self.group, self._consumer, {self.stream: '>'}, count=self.batch_size,
+                block=int(self.flush_interval*1000))
+        entries = reply[0][1] if reply else []
+        if not entries:
+            self._recovering = False
+            return 0
+
+        # Entries deleted from the stream come back without their fields.
+        written = [(entry_id.decode(), {k.decode(): v.decode() for k, v in fields.items()})
+            for entry_id, fields in entries if fields]
+        deleted = [entry_id.decode() for entry_id, fields in entries if not fields]
+        owners = self.redis.hmget(self.owners, deleted) if deleted else []
+        if deleted:
+            logging.error({'message': 'Trade journal entries deleted before they were written', 'entries': deleted,
+                'users': sorted({user_id.decode() for user_id in owners if user_id is not None})})
+
+        users = sorted({e['user_id'] for _, e in written})
+        pipe = self.redis.pipeline(transaction=False)
+        for user_id in users:
+            pipe.exists(self.keys(user_id)['parked'])
+        held = {user_id for user_id, parked in zip(users, pipe.execute()) if parked}
+
+        failed = {entry_id: 'Follows a parked entry' for entry_id, e in written if e['user_id'] in held}
+        results, errors = self._write_isolated([(entry_id, e) for entry_id, e in written if entry_id not in failed])
+        failed.update(errors)
+
+        pipe = self.redis.pipeline(transaction=False)
+        # Users are put on hold before their entries leave `pending`, so
+        # `exclusive` can't write to them in between.
+        for entry_id, e in written:
+            if entry_id in failed:
+                pipe.set(self.keys(e['user_id'])['parked'], failed[entry_id], nx=True)
+        for entry_id, e in written:
+            if entry_id in failed:
+                pipe.xadd(self.dead_letters, dict(e, entry_id=entry_id, error=failed[entry_id]))
+            pipe.srem(self.keys(e['user_id'])['pending'], entry_id)
+        # Or `exclusive` would wait on them forever.
+        for entry_id, user_id in zip(deleted, owners):
+            if user_id is not None:
+                pipe.srem(self.keys(user_id.decode())['pending'], entry_id)
+        ids = [entry_id for entry_id, _ in entries]
+        pipe.xack(self.stream, self.group, *ids)
+        pipe.xdel(self.stream, *ids)
+        pipe.hdel(self.owners, *ids)
+        pipe.execute()
+
+        if errors:
+            logging.error({'message': 'Trade journal entries parked', 'errors': errors,
+                'users': sorted({e['user_id'] for entry_id, e in written if entry_id in failed})})
+        for result in results:
+            self.executor._notify(result)
+        return len(written) - len(failed)
+
+    def _write_isolated(self, batch):
+        """
+        Write `batch`, a list of (entry id, entry) pairs, bisecting it on data
+        errors down to the entries the database rejects. Those are left out
+        with the later entries of their users, whose balances build on them.
+
+        Returns the results of the written entries and the errors of the
+        others by entry id.
+        """
+        try:
+            return self.write([e for _, e in batch]), {}
+        except DATA_ERRORS as e:
+            if len(batch) == 1:
+                return [], {batch[0][0]: str(getattr(e, 'orig', e)).strip()}
+
+        half = len(batch) // 2
+        results, failed = self._write_isolated(batch[:half])
+        users = {e['user_id'] for entry_id, e in batch[:half] if entry_id in failed}
+        failed.update({entry_id: 'Follows a parked entry' for entry_id, e in batch[half:] if e['user_id'] in users})
+        more, errors = self._write_isolated([(entry_id, e) for entry_id, e in batch[half:] if entry_id not in failed])
+        failed.update(errors)
+        return results + more, failed
+
+    def parked(self):
+        """
+        Users on hold, with the number of their dead letters and the error
+        of the first one.
+        """
+        users = {}
+        for _, fields in self.redis.xrange(self.dead_letters):
+            count, error = users.get(fields[b'user_id'].decode(), (0, fields[b'error'].decode()))
+            users[fields[b'user_id'].decode()] = (count + 1, error)
+        return users
+
+    def resolve(self, user_id, requeue=True):
+        """
+        Take `user_id` off hold, either writing its dead letters again (once
+        whatever the database rejected them for is fixed) or dropping them,
+        in which case the ledger is reloaded from the database. Returns the
+        number of entries, or None if the user still has entries in flight.
+        """
+        keys = self.keys(user_id)
+        count = self._resolve(keys=[self.dead_letters, self.stream, keys['pending'], keys['parked'], keys['ledger'],
+            keys['epoch'], self.owners], args=[user_id, 'requeue' if requeue else 'discard'])
+        return count if count >= 0 else None
+
+    def write(self, entries):
+        """
+        Write journal `entries`, in stream order, to the database in one
+        transaction. Returns a `TradeResult` per account with its final
+        balances and the fills of the batch.
+
+        Raises `FencedOut` if the flusher epoch moved on from ours.
+        """
+        if not entries:
+            return []
+
+        stocks, accounts, fills = {}, {}, {}
+        for e in entries:
+            stocks[e['stock_id']] = e
+            accounts[e['account_id']] = e
+            shares = int(e['shares']) if e['trade_type'] == 'buy' else -int(e['shares'])
+            fills.setdefault(e['account_id'], []).append((e['symbol'], shares, float(dollars(e['price']))))
+
+        stock_table, fence = Stock.__table__, JournalFence.__table__
+        with self.db.engine.begin() as conn:
+            # Held until commit, so epochs can't change while we write.
+            epoch = conn.execute(select([fence.c.epoch]).where(fence.c.id == 1).with_for_update()).scalar()
+            if epoch is None or epoch != self._epoch:
+                raise FencedOut('Flusher epoch {} was superseded by {}'.format(self._epoch, epoch))
+
+            self._copy_trades(conn, entries)
+
+            # Free the (account_id, symbol) keys before positions are reopened.
+            closed = [int(stock_id) for stock_id, e in stocks.items() if e['closed'] == '1']
+            if closed:
+                conn.execute(stock_table.delete().where(stock_table.c.id.in_(closed)))
+            held = [{
+                'id': int(stock_id),
+                'account_id': int(e['account_id']),
+                'symbol': e['symbol'],
+                'bought_at': dollars(e['bought_at']),
+                'bought_on': e['bought_on'],
+                'initial_cost': dollars(e['initial_cost']),
+                'shares': int(e['held'])
+            } for stock_id, e in stocks.items() if e['closed'] != '1']
+            if held:
+                stmt = insert(stock_table).values(held)
+                conn.execute(stmt.on_conflict_do_update(index_elements=['id'],
+                    set_={'shares': stmt.excluded.shares}))
+
+            params, values = {}, []
+            for i, (account_id, e) in enumerate(accounts.items()):
+                values.append('(:id{0}, :cash{0}, :equity{0})'.format(i))
+                params.update({'id' + str(i): int(account_id), 'cash' + str(i): dollars(e['cash']),
+                    'equity' + str(i): dollars(e['equity'])})
+            conn.execute(text('UPDATE accounts SET cash_amount = v.cash, equity_amount = v.equity '
+                'FROM (VALUES {}) AS v (id, cash, equity) WHERE accounts.id = v.id'.format(', '.join(values))),
+                params)
+
+        return [TradeResult(LedgerAccount(int(account_id), int(e['user_id']), float(dollars(e['cash'])),
+            float(dollars(e['equity'])), float(dollars(e['initial']))), fills=fills[account_id])
+            for account_id, e in accounts.items()]
+
+    def _copy_trades(self, conn, entries):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for e in entries:
+            writer.writerow((e['trade_id'], e['user_id'], e['account_id'], e['stock_id'], e['symbol'],
+                e['trade_type'], e['process_date'], dollars(e['price']), e['shares']))
+        buffer.seek(0)
+
+        columns = ', '.join(TRADE_COLUMNS)
+        cursor = conn.connection.cursor()
+        try:
+            cursor.execute('CREATE TEMP TABLE IF NOT EXISTS journal_trades '
+                '(LIKE trades INCLUDING DEFAULTS) ON COMMIT DELETE ROWS')
+            cursor.copy_expert('COPY journal_trades ({}) FROM STDIN WITH (FORMAT csv)'.format(columns), buffer)
+            # Entries written again after a crash are already there.
+            cursor.execute('INSERT INTO trades ({0}) SELECT {0} FROM journal_trades ON CONFLICT DO NOTHING'.format(
+                columns))
+        finally:
+            cursor.close()
+
+    def _ensure_group(self):
+        try:
+            self.redis.xgroup_create(self.stream, self.group, id='0', mkstream=True)
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    def _claim_pending(self):
+        """
+        Take over the entries other consumers read but didn't acknowledge.
+        Only the lease holder flushes, so they belong to a flusher that died
+        or lost its lease.
+        """
+        start, consumer, previous = '-', self._consumer.encode(), set()
+        while True:
+            pending = self.redis.xpending_range(self.stream, self.group, start, '+', self.batch_size)
+            others = [p['message_id'] for p in pending if p['consumer'] != consumer]
+            if others:
+                self.redis.xclaim(self.stream, self.group, self._consumer, 0, others)
+                previous.update(p['consumer'] for p in pending if p['consumer'] != consumer)
+            if len(pending) < self.batch_size:
+                break
+            ms, seq = pending[-1]['message_id'].decode().split('-')
+            start = '{}-{}'.format(ms, int(seq) + 1)
+        for name in previous:
+            self.redis.xgroup_delconsumer(self.stream, self.group, name)
@@ -0,0 +1,278 @@
+import logging
+
+from redis import RedisError
+from sqlalchemy import select
+
+from trader.models import Account, Stock, User
+
+# Shared by the scripts below: the return of an account in percent.
+SCORE = """
+local function score(key)
+    local v = redis.call('HMGET', key, 'cash', 'value', 'initial')
+    local initial = tonumber(v[3]) or 0
+    if initial <= 0 then
+        return 0
+    end
+    return ((tonumber(v[1]) or 0) + (tonumber(v[2]) or 0) - initial) / initial * 100
+end
+"""
+
+# ARGV: account_id, user_id, cash, initial, name, then (symbol, shares, price)
+# for every fill. Shares are deltas, negative for sells. The market value of
+# the account is recomputed from its positions and the last known prices.
+UPDATE_ACCOUNT = SCORE + """
+local id = ARGV[1]
+local key = 'lb:account:' .. id
+redis.call('HSET', key, 'user_id', ARGV[2], 'cash', ARGV[3], 'initial', ARGV[4])
+if ARGV[5] ~= '' then
+    redis.call('HSET', key, 'name', ARGV[5])
+end
+redis.call('HSET', 'lb:users', ARGV[2], id)
+
+for i = 6, #ARGV, 3 do
+    local symbol = ARGV[i]
+    local shares = redis.call('HINCRBY', key, 'pos:' .. symbol, ARGV[i + 1])
+    if shares > 0 then
+        redis.call('HSET', 'lb:holders:' .. symbol, id, shares)
+        redis.call('HSETNX', 'lb:prices', symbol, ARGV[i + 2])
+        redis.call('SADD', 'lb:symbols', symbol)
+    else
+        redis.call('HDEL', key, 'pos:' .. symbol)
+        redis.call('HDEL', 'lb:holders:' .. symbol, id)
+        if redis.call('EXISTS', 'lb:holders:' .. symbol) == 0 then
+            redis.call('SREM', 'lb:symbols', symbol)
+        end
+    end
+end
+
+local fields = redis.call('HGETALL', key)
+local value = 0
+for i = 1, #fields, 2 do
+    if string.sub(fields[i], 1, 4) == 'pos:' then
+        local price = tonumber(redis.call('HGET', 'lb:prices', string.sub(fields[i], 5))) or 0
+        value = value + tonumber(fields[i + 1]) * price
+    end
+end
+redis.call('HSET', key, 'value', value)
+redis.call('ZADD', 'lb:accounts', score(key), id)
+"""
+
+# ARGV: (symbol, price) pairs. Only the holders of a symbol whose price moved
+# are touched, by the change in value of their position.
+TICK = SCORE + """
+for i = 1, #ARGV, 2 do
+    local symbol, price = ARGV[i], tonumber(ARGV[i + 1])
+    local old = tonumber(redis.call('HGET', 'lb:prices', symbol))
+    if old ~= price and redis.call('EXISTS', 'lb:holders:' .. symbol) == 1 then
+        redis.call('HSET', 'lb:prices', symbol, ARGV[i + 1])
+        local holders = redis.call('HGETALL', 'lb:holders:' .. symbol)
+        for j = 1, #holders, 2 do
+            local key = 'lb:account:' .. holders[j]
+            redis.call('HINCRBYFLOAT', key, 'value', tonumber(holders[j + 1]) * (price - (old or 0)))
+            redis.call('ZADD', 'lb:accounts', score(key), holders[j])
+        end
+    end
+end
+"""
+
+# ARGV: account_id
+REMOVE_ACCOUNT = """
+local id = ARGV[1]
+local key = 'lb:account:' .. id
+local fields = redis.call('HGETALL', key)
+for i = 1, #fields, 2 do
+    if string.sub(fields[i], 1, 4) == 'pos:' then
+        local symbol = string.sub(fields[i], 5)
+        redis.call('HDEL', 'lb:holders:' .. symbol, id)
+        if redis.call('EXISTS', 'lb:holders:' .. symbol) == 0 then
+            redis.call('SREM', 'lb:symbols', symbol)
+        end
+    end
+end
+local user_id = redis.call('HGET', key, 'user_id')
+if user_id then
+    redis.call('HDEL', 'lb:users', user_id)
+end
+redis.call('DEL', key)
+redis.call('ZREM', 'lb:accounts', id)
+"""
+
+class Leaderboard:
+    """
+    Ranks accounts by return since their initial deposit, kept in a Redis
+    sorted set.
+
+    Every account has a hash with its cash, initial amount, market value and
+    shares per symbol, and every held symbol a hash of the accounts holding
+    it. Trades and transfers update the account they touch; price ticks only
+    update the holders of the symbols that moved. All of it runs in Lua
+    scripts so each update is atomic, and reads are sorted set rank and
+    range lookups that never touch Postgres.
+    """
+    def __init__(self):
+        self.redis = None
+        self.stream = None
+        self.enabled = True
+        self._update = None
+        self._tick = None
+        self._remove = None
+
+    def init_app(self, app, redis, executor=None, stream=None):
+        self.redis = redis
+        self.stream = stream
+        self.enabled = app.config.get('LEADERBOARD_ENABLED', self.enabled)
+        if not self.enabled:
+            return
+
+        self._update = redis.register_script(UPDATE_ACCOUNT)
+        self._tick = redis.register_script(TICK)
+        self._remove = redis.register_script(REMOVE_ACCOUNT)
+        if executor is not None:
+            executor.add_listener(self.on_trade)
+        if stream is not None:
+            stream.add_listener(self.on_quotes, symbols=self.held_symbols)
+
+    def update_account(self, account, fills=(), name=None):
+        """
+        Record the cash and initial amount of `account` and apply `fills`,
+        a list of `(symbol, shares, price)` with negative shares for sells.
+        """
+        args = [account.id, account.user_id, account.cash_amount, account.initial_amount, name or '']
+        for symbol, shares, price in fills:
+            args.extend((symbol.upper(), int(shares), price))
+        self._call(self._update, args)
+
+    def remove_account(self, account_id):
+        self._call(self._remove, [account_id])
+
+    def on_trade(self, result):
+        self.update_account(result.account, result.fills)
+
+    def on_quotes(self, quotes):
+        args = []
+        for symbol, quote in quotes.items():
+            if quote.get('latestPrice') is not None:
+                args.extend((symbol.upper(), quote['latestPrice']))
+        if args:
+            self._call(self._tick, args)
+
+    def held_symbols(self):
+        return [symbol.decode() for symbol in self.redis.smembers('lb:symbols')]
+
+    def get(self, user_id=None, limit=10, around=5):
+        """
+        Get the top `limit` accounts and, for `user_id`, their own entry and
+        the `around` accounts ranked immediately above and below them.
+        """
+        if self.stream is not None:
+            self.stream.start()
+
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zrevrange('lb:accounts', 0, limit - 1, withscores=True)
+        pipe.zcard('lb:accounts')
+        if user_id is not None:
+            pipe.hget('lb:users', user_id)
+        top, total, *account_id = pipe.execute()
+
+        me, window = None, []
+        if account_id and account_id[0] is not None:
+            account_id = account_id[0]
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.zrevrank('lb:accounts', account_id)
+            pipe.zscore('lb:accounts', account_id)
+            rank, score = pipe.execute()
+            if rank is not None:
+                me = (account_id, score, rank)
+                start = max(0, rank - around)
+                window = [(m, s, start + i) for i, (m, s) in
+                    enumerate(self.redis.zrevrange('lb:accounts', start, rank + around, withscores=True))]
+
+        top = [(m, s, i) for i, (m, s) in enumerate(top)]
+        names = self._names({entry[0] for entry in top + window + ([me] if me else [])})
+        return {
+            'total': total,
+            'top': [self._entry(entry, names) for entry in top],
+            'me': self._entry(me, names) if me else None,
+            'around': [self._entry(entry, names) for entry in window]
+        }
+
+    def rebuild(self, db, api, chunk_size=10000):
+        """
+        Load every account and position from Postgres, replacing the current
+        leaderboard. Used to seed the leaderboard and to recover from drift.
+        """
+        for pattern in ('lb:account:*', 'lb:holders:*'):
+            for key in self.redis.scan_iter(pattern, count=1000):
+                self.redis.delete(key)
+        self.redis.delete('lb:accounts', 'lb:users', 'lb:prices', 'lb:symbols')
+
+        with db.session_scope() as session:
+            held = [s for s, in session.query(Stock.symbol).distinct()]
+        quotes = api.get_quotes(held) if held else {}
+        prices = {s: q.get('latestPrice') for s, q in (quotes or {}).items()}
+
+        query = select([
+                Account.id, Account.user_id, Account.cash_amount, Account.initial_amount,
+                User.first_name, User.last_name, Stock.symbol, Stock.shares, Stock.bought_at
+            ]).\
+            select_from(Account.__table__.join(User.__table__, User.id == Account.user_id).
+                outerjoin(Stock.__table__, Stock.account_id == Account.id)).\
+            order_by(Account.id)
+
+        accounts = 0
+        with db.engine.connect() as conn:
+            result = conn.execution_options(stream_results=True).execute(query)
+            pipe = self.redis.pipeline(transaction=False)
+            current, fills = None, []
+            for row in result:
+                if current is not None and row.id != current.id:
+                    self._queue_rebuild(pipe, current, fills)
+                    accounts += 1
+                    current, fills = None, []
+                    if accounts % chunk_size == 0:
+                        pipe.execute()
+                current = row
+                if row.symbol is not None:
+                    fills.append((row.symbol, row.shares, prices.get(row.symbol) or row.bought_at))
+            if current is not None:
+                self._queue_rebuild(pipe, current, fills)
+                accounts += 1
+            pipe.execute()
+        return accounts
+
+    def _queue_rebuild(self, pipe, row, fills):
+        # Prices first, so the positions are valued at the latest quote.
+        for symbol, shares, price in fills:
+            pipe.hset('lb:prices', symbol, price)
+        args = [row.id, row.user_id, row.cash_amount, row.initial_amount, self.display_name(row)]
+        for symbol, shares, price in fills:
+            args.extend((symbol, shares, price))
+        self._update(args=args, client=pipe)
+
+    def display_name(self, user):
+        first, last = user.first_name or '', user.last_name or ''
+        return '{} {}.'.format(first, last[:1]).strip() if last else first
+
+    def _names(self, account_ids):
+        account_ids = list(account_ids)
+        pipe = self.redis.pipeline(transaction=False)
+        for account_id in account_ids:
+            pipe.hget('lb:account:' + account_id.decode(), 'name')
+        return {a: (n.decode() if n else None) for a, n in zip(account_ids, pipe.execute())}
+
+    def _entry(self, entry, names):
+        account_id, score, rank = entry
+        return {
+            'rank': rank + 1,
+            'account_id': int(account_id),
+            'name': names.get(account_id),
+            'pct_change': round(score, 2)
+        }
+
+    def _call(self, script, args):
+        if not self.enabled:
+            return
+        try:
+            script(args=args)
+        except RedisError as e:
+            logging.error({'exception': str(e), 'args': args[:5]})
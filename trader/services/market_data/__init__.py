@@ -0,0 +1 @@
+""" Market data sources and local storage """
@@ -0,0 +1,32 @@
+class MarketDataProvider:
+    """
+    Upstream of `IEXApi`. Providers answer IEX batch and search calls in the
+    shape of IEX responses, so the cache, the batcher and the price store
+    work the same whatever the data comes from.
+    """
+    def init_app(self, app):
+        pass
+
+    def batch(self, symbols, types, params):
+        """
+        Get `types` of data for `symbols` as `{symbol: {type: payload}}`,
+        like the IEX `/stock/market/batch` endpoint. Unknown symbols are left
+        out. Returns False if the data couldn't be retrieved.
+
+        Params
+        ------
+        symbols : list of str
+            Upper case stock symbols.
+        types : list of str
+            'quote', 'chart' or 'news'.
+        params : dict
+            Parameters of the types, e.g. `range` and `last`.
+        """
+        raise NotImplementedError
+
+    def search(self, fragment):
+        """
+        Get the symbols matching `fragment` in the shape of IEX search
+        results, or False if the search failed.
+        """
+        raise NotImplementedError
@@ -0,0 +1,307 @@
+import os
+import json
+import logging
+import threading
+
+import requests
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from trader.services.market_data.base import MarketDataProvider
+from trader.services.market_data.synthetic import SyntheticMarket
+
+def payload_key(type, params):
+    """
+    Key a dataset of `type` is recorded under. Charts of different ranges
+    are different payloads, news is recorded once and cut to `last`.
+    """
+    if type == 'chart':
+        return 'chart:{}'.format(params.get('range', '1m'))
+    return type
+
+class IEXProvider(MarketDataProvider):
+    """
+    The IEX Cloud API over a pooled, retrying HTTP session.
+    """
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self):
+        self.base_url = None
+        self.token = None
+        self.session = None
+        self.timeout = None
+
+    def init_app(self, app):
+        self.base_url = app.config['IEX_API_URL']
+        self.token = app.config['IEX_SECRET_TOKEN']
+        self.timeout = (app.config.get('IEX_CONNECT_TIMEOUT', 3.05), app.config.get('IEX_READ_TIMEOUT', 10))
+
+        retry = Retry(
+            total=app.config.get('IEX_MAX_RETRIES', 2),
+            backoff_factor=app.config.get('IEX_RETRY_BACKOFF', 0.2),
+            status_forcelist=self.RETRY_STATUSES,
+            method_whitelist=frozenset(['GET']),
+            raise_on_status=False
+        )
+        pool_size = app.config.get('IEX_POOL_SIZE', 10)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def batch(self, symbols, types, params):
+        params = dict(params, symbols=','.join(symbols), types=','.join(types))
+        return self._get(f"{self.base_url}/stock/market/batch", params)
+
+    def search(self, fragment):
+        return self._get(f"{self.base_url}/search/{fragment}")
+
+    def _get(self, url, params=None):
+        """
+        GET `url` through the pooled session and decode the JSON body.
+        Returns False if the request failed or the body isn't valid JSON.
+        """
+        params = dict(params or {}, token=self.token)
+        res = None
+        try:
+            res = self.session.get(url, params=params, timeout=self.timeout)
+            res.raise_for_status()
+            data = res.json()
+        except Exception as e:
+            logging.error({'exception': str(e), 'res': res.content if res is not None else None})
+            return False
+
+        return data
+
+class YFinanceProvider(MarketDataProvider):
+    """
+    Yahoo Finance through `yfinance`. Quotes are built from the last two
+    daily bars, so they are end of day rather than real time, and there is
+    no news.
+    """
+    # yfinance periods covering the IEX chart ranges.
+    PERIODS = {'5d': '5d', '1m': '1mo', '3m': '3mo', '6m': '6mo', 'ytd': 'ytd', '1y': '1y', '2y': '2y',
+        '5y': '5y', 'max': 'max'}
+
+    def batch(self, symbols, types, params):
+        import yfinance
+
+        period = self.PERIODS.get(params.get('range', '1m'), '1mo') if 'chart' in types else '5d'
+        try:
+            frame = yfinance.download(symbols, period=period, group_by='ticker', progress=False,
+                auto_adjust=False, threads=True)
+        except Exception as e:
+            logging.error({'exception': str(e), 'symbols': symbols})
+            return False
+
+        result = {}
+        for symbol in symbols:
+            bars = frame[symbol] if len(symbols) > 1 else frame
+            bars = bars.dropna(subset=['Close'])
+            if bars.empty:
+                continue
+            payload = {}
+            if 'quote' in types:
+                payload['quote'] = self._quote(symbol, bars)
+            if 'chart' in types:
+                payload['chart'] = [{
+                    'date': ts.strftime('%Y-%m-%d'),
+                    'open': round(float(bar['Open']), 2),
+                    'high': round(float(bar['High']), 2),
+                    'low': round(float(bar['Low']), 2),
+                    'close': round(float(bar['Close']), 2),
+                    'volume': int(bar['Volume'])
+                } for ts, bar in bars.iterrows()]
+            if 'news' in types:
+                payload['news'] = []
+            result[symbol] = payload
+        return result
+
+    def search(self, fragment):
+        data = self.batch([fragment.upper()], ['quote'], {})
+        if data is False:
+            return False
+        return [{'symbol': s, 'securityName': s, 'securityType': 'cs', 'region': 'US'} for s in data]
+
+    def _quote(self, symbol, bars):
+        last = bars.iloc[-1]
+        price = round(float(last['Close']), 2)
+        previous = round(float(bars['Close'].iloc[-2]), 2) if len(bars) > 1 else price
+        return {
+            'symbol': symbol,
+            'calculationPrice': 'close',
+            'open': round(float(last['Open']), 2),
+            'high': round(float(last['High']), 2),
+            'low': round(float(last['Low']), 2),
+            'latestPrice': price,
+            'latestSource': 'Close',
+            'latestUpdate': int(bars.index[-1].timestamp() * 1000),
+            'volume': int(last['Volume']),
+            'previousClose': previous,
+            'change': round(price - previous, 2),
+            'changePercent': round((price - previous) / previous, 5) if previous else None
+        }
+
+class InMemoryProvider(MarketDataProvider):
+    """
+    Fixed responses held in memory, for tests and for serving recordings.
+
+    Params
+    ------
+    data : dict, optional
+        `{symbol: {key: payload}}` with keys from `payload_key`, e.g.
+        `{'AAPL': {'quote': {...}, 'chart:1m': [...], 'news': [...]}}`.
+    searches : dict, optional
+        `{fragment: results}`.
+    """
+    def __init__(self, data=None, searches=None):
+        self.data = {s.upper(): dict(payloads) for s, payloads in (data or {}).items()}
+        self.searches = {f.upper(): results for f, results in (searches or {}).items()}
+        self._lock = threading.Lock()
+
+    def set(self, symbol, type, payload, **params):
+        with self._lock:
+            self.data.setdefault(symbol.upper(), {})[payload_key(type, params)] = payload
+
+    def batch(self, symbols, types, params):
+        result = {}
+        with self._lock:
+            for symbol in symbols:
+                recorded = self.data.get(symbol.upper())
+                if recorded is None:
+                    continue
+                payload = {}
+                for type in types:
+                    value = recorded.get(payload_key(type, params))
+                    if value is not None:
+                        payload[type] = value[:int(params.get('last', 5))] if type == 'news' else value
+                result[symbol.upper()] = payload
+        return result
+
+    def search(self, fragment):
+        fragment = fragment.upper()
+        with self._lock:
+            if fragment in self.searches:
+                return self.searches[fragment]
+            return [{'symbol': s, 'securityName': p.get('quote', {}).get('companyName', s), 'securityType': 'cs',
+                'region': 'US'} for s, p in sorted(self.data.items()) if s.startswith(fragment)]
+
+class Recordings:
+    """
+    IEX responses recorded to a directory: one `stock/<SYMBOL>.json` file of
+    `{key: payload}` per symbol and one `search/<FRAGMENT>.json` file per
+    search.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Read every recording into `(data, searches)` for an
+        `InMemoryProvider`.
+        """
+        return self._read_dir('stock'), self._read_dir('search')
+
+    def save_batch(self, types, params, data):
+        with self._lock:
+            for symbol, payload in data.items():
+                path = self._file('stock', symbol)
+                recorded = self._read(path) or {}
+                recorded.update({payload_key(t, params): v for t, v in payload.items()})
+                self._write(path, recorded)
+
+    def save_search(self, fragment, results):
+        with self._lock:
+            self._write(self._file('search', fragment), results)
+
+    def _file(self, kind, name):
+        return os.path.join(self.path, kind, '{}.json'.format(name.upper()))
+
+    def _read_dir(self, kind):
+        directory = os.path.join(self.path, kind)
+        if not os.path.isdir(directory):
+            return {}
+        return {name[:-5]: self._read(os.path.join(directory, name))
+            for name in sorted(os.listdir(directory)) if name.endswith('.json')}
+
+    def _read(self, path):
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def _write(self, path, value):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(value, f)
+        os.replace(tmp, path)
+
+class RecordedProvider(InMemoryProvider):
+    """
+    Replays the responses recorded in `MARKET_DATA_RECORDINGS`.
+    """
+    def __init__(self, path=None):
+        super().__init__()
+        self.path = path
+
+    def init_app(self, app):
+        self.path = app.config.get('MARKET_DATA_RECORDINGS', self.path)
+        self.load()
+
+    def load(self):
+        data, searches = Recordings(self.path).load()
+        with self._lock:
+            self.data = data
+            self.searches = searches
+        logging.info({'message': 'Loaded market data recordings', 'symbols': len(data), 'path': self.path})
+
+class Recorder(MarketDataProvider):
+    """
+    Records the responses of another provider to `Recordings` as they go
+    through, e.g. to capture IEX traffic for a `RecordedProvider`.
+    """
+    def __init__(self, provider, recordings):
+        self.provider = provider
+        self.recordings = recordings
+
+    def init_app(self, app):
+        self.provider.init_app(app)
+
+    def batch(self, symbols, types, params):
+        data = self.provider.batch(symbols, types, params)
+        if data is not False:
+            self.recordings.save_batch(types, params, data)
+        return data
+
+    def search(self, fragment):
+        results = self.provider.search(fragment)
+        if results is not False:
+            self.recordings.save_search(fragment, results)
+        return results
+
+PROVIDERS = {
+    'iex': IEXProvider,
+    'yfinance': YFinanceProvider,
+    'recorded': RecordedProvider,
+    'memory': InMemoryProvider,
+    'synthetic': SyntheticMarket
+}
+
+def create_provider(app):
+    """
+    Create the provider named by `MARKET_DATA_SOURCE`, wrapped in a
+    `Recorder` when `MARKET_DATA_RECORD` is set.
+    """
+    source = app.config.get('MARKET_DATA_SOURCE', 'iex')
+    if source not in PROVIDERS:
+        raise ValueError('Unknown MARKET_DATA_SOURCE {!r}, expected one of {}'.format(source, ', '.join(PROVIDERS)))
+
+    provider = PROVIDERS[source]()
+    if app.config.get('MARKET_DATA_RECORD', False):
+        provider = Recorder(provider, Recordings(app.config['MARKET_DATA_RECORDINGS']))
+    provider.init_app(app)
+    return provider
@@ -0,0 +1,346 @@
+import os
+import fcntl
+import queue
+import logging
+import tempfile
+import threading
+
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+class PriceStore:
+    """
+    On-disk OHLCV bar store, one directory per symbol and one `.npy` file
+    per symbol and year.
+
+    Partitions are read through memory maps, so reading a range inside a
+    single partition returns a view onto the file without copying. Writes
+    merge new bars into the affected partitions by timestamp, which makes
+    ingesting the same data again a no-op, and replace each partition
+    atomically so concurrent readers never see a partial file. Writes of a
+    symbol are serialized between threads and, through a lock file, between
+    processes, so concurrent merges can't drop each other's bars.
+    """
+    FIELDS = ('open', 'high', 'low', 'close', 'volume')
+    DTYPE = np.dtype([('ts', 'datetime64[s]')] + [(f, 'f8') for f in FIELDS])
+
+    # Calendar days covered by the IEX chart ranges
+    RANGES = {'5d': 7, '1m': 31, '3m': 92, '6m': 183, '1y': 366, '2y': 731, '5y': 1827}
+
+    def __init__(self, root=None):
+        self.root = root
+        self.max_staleness = 4
+        self.queue_size = 256
+        self._maps = {}
+        self._lock = threading.Lock()
+        self._write_locks = {}
+        self._queue = None
+        self._pid = None
+        self._writer = None
+
+    def init_app(self, app):
+        self.root = app.config.get('PRICE_STORE_PATH', './data/prices')
+        self.max_staleness = app.config.get('PRICE_STORE_MAX_STALENESS', self.max_staleness)
+        self.queue_size = app.config.get('PRICE_STORE_QUEUE_SIZE', self.queue_size)
+
+    def symbols(self):
+        if not self.root or not os.path.isdir(self.root):
+            return []
+        return sorted(d for d in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, d)))
+
+    def write(self, symbol, bars):
+        """
+        Merge `bars` into the store. Bars with a timestamp already stored
+        replace the stored bar.
+
+        Params
+        ------
+        symbol : str
+            Stock symbol.
+        bars : ndarray or DataFrame
+            Structured array of `DTYPE`, or a frame with a datetime index (or
+            `date` column) and `open`, `high`, `low`, `close`, `volume`
+            columns.
+
+        Returns the number of bars that were added or changed.
+        """
+        bars = self._to_bars(bars)
+        if not len(bars):
+            return 0
+
+        symbol = symbol.upper()
+        directory = os.path.join(self.root, symbol)
+        os.makedirs(directory, exist_ok=True)
+        years = bars['ts'].astype('datetime64[Y]').astype(int) + 1970
+
+        written = 0
+        with self._write_lock(symbol):
+            for year in np.unique(years):
+                new = bars[years == year]
+                path = self._path(symbol, year)
+                existing = self._load(path)
+                changed = self._changed(existing, new)
+                if not changed:
+                    continue
+
+                merged = self._merge(existing, new)
+                with tempfile.NamedTemporaryFile(dir=directory, suffix='.tmp', delete=False) as f:
+                    try:
+                        np.save(f, merged)
+                    except:
+                        os.unlink(f.name)
+                        raise
+                os.replace(f.name, path)
+                with self._lock:
+                    self._maps.pop(path, None)
+                written += changed
+        return written
+
+    def write_later(self, symbol, bars):
+        """
+        Queue `bars` to be merged into the store by a background thread, so
+        request threads don't wait on the disk. Bars are dropped if the
+        queue is full; what they would have added is fetched again on a
+        later miss.
+        """
+        with self._lock:
+            self._ensure_started()
+        try:
+            self._queue.put_nowait((symbol, bars))
+        except queue.Full:
+            logging.warning({'message': 'Price store write queue is full', 'symbol': symbol})
+
+    def read(self, symbol, start=None, end=None):
+        """
+        Get the bars of `symbol` with `start <= ts <= end`, as a structured
+        array of `DTYPE`. Ranges within one partition are zero-copy views
+        onto the memory-mapped file.
+        """
+        symbol = symbol.upper()
+        start = np.datetime64(start, 's') if start is not None else None
+        end = np.datetime64(end, 's') if end is not None else None
+
+        parts = []
+        for year in self._years(symbol):
+            if start is not None and year < start.astype('datetime64[Y]').astype(int) + 1970:
+                continue
+            if end is not None and year > end.astype('datetime64[Y]').astype(int) + 1970:
+                continue
+            bars = self._load(self._path(symbol, year))
+            if bars is None:
+                continue
+            lo = np.searchsorted(bars['ts'], start, 'left') if start is not None else 0
+            hi = np.searchsorted(bars['ts'], end, 'right') if end is not None else len(bars)
+            if hi > lo:
+                parts.append(bars[lo:hi])
+
+        if not parts:
+            return np.empty(0, dtype=self.DTYPE)
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def read_panel(self, symbols, start=None, end=None, field='close'):
+        """
+        Get one field for several symbols as a frame indexed by timestamp
+        with one column per symbol, NaN where a symbol has no bar.
+        """
+        symbols = [s.upper() for s in symbols]
+        reads = [self.read(symbol, start, end) for symbol in symbols]
+        index = np.unique(np.concatenate([bars['ts'] for bars in reads])) if reads else \
+            np.empty(0, dtype='datetime64[s]')
+
+        values = np.full((len(index), len(symbols)), np.nan)
+        for i, bars in enumerate(reads):
+            values[np.searchsorted(index, bars['ts']), i] = bars[field]
+        return pd.DataFrame(values, index=pd.DatetimeIndex(index, name='date'), columns=symbols)
+
+    def first_timestamp(self, symbol):
+        for year in self._years(symbol.upper()):
+            bars = self._load(self._path(symbol.upper(), year))
+            if bars is not None and len(bars):
+                return bars['ts'][0]
+        return None
+
+    def last_timestamp(self, symbol):
+        for year in reversed(self._years(symbol.upper())):
+            bars = self._load(self._path(symbol.upper(), year))
+            if bars is not None and len(bars):
+                return bars['ts'][-1]
+        return None
+
+    def chart(self, symbol, range='1m', today=None):
+        """
+        Get daily bars of `symbol` for an IEX chart `range`, in the shape of
+        an IEX chart response. Returns None if the store doesn't cover the
+        range up to the last few days, so the caller can go upstream.
+        """
+        days = self.RANGES.get(range)
+        if days is None:
+            return None
+        today = np.datetime64(today or datetime.utcnow().date(), 's')
+        start = today - np.timedelta64(days, 'D')
+
+        last = self.last_timestamp(symbol)
+        if last is None or last < today - np.timedelta64(self.max_staleness, 'D'):
+            return None
+        if self.first_timestamp(symbol) > start + np.timedelta64(self.max_staleness, 'D'):
+            return None
+
+        bars = self.read(symbol, start)
+        return [{
+            'date': str(bar['ts'].astype('datetime64[D]')),
+            'open': float(bar['open']),
+            'high': float(bar['high']),
+            'low': float(bar['low']),
+            'close': float(bar['close']),
+            'volume': float(bar['volume'])
+        } for bar in bars]
+
+    def ingest_iex_chart(self, symbol, chart, wait=True):
+        """
+        Store bars from an IEX chart response. Unless `wait` is set, they are
+        only queued (see `write_later`) and None is returned.
+        """
+        if not chart:
+            return 0
+        frame = pd.DataFrame(chart)
+        frame['date'] = pd.to_datetime(frame['date'])
+        if not wait:
+            self.write_later(symbol, frame)
+            return None
+        return self.write(symbol, frame)
+
+    def ingest_csv(self, path, symbol=None):
+        """
+        Store bars from a CSV file with `date`, `open`, `high`, `low`,
+        `close` and `volume` columns, and a `symbol` column unless `symbol`
+        is given.
+
+        Returns the number of bars added or changed.
+        """
+        frame = pd.read_csv(path)
+        frame.columns = [c.lower() for c in frame.columns]
+        frame['date'] = pd.to_datetime(frame['date'])
+        if symbol is not None:
+            return self.write(symbol, frame)
+        return sum(self.write(s, group) for s, group in frame.groupby('symbol'))
+
+    def ingest_yfinance(self, symbols, start=None, end=None):
+        """
+        Download daily bars from Yahoo Finance and store them. Only bars
+        after the last stored bar of each symbol are requested unless
+        `start` is given.
+        """
+        import yfinance
+
+        written = 0
+        for symbol in symbols:
+            since = start
+            if since is None:
+                last = self.last_timestamp(symbol)
+                since = (last.astype(datetime) + timedelta(days=1)).date() if last is not None else None
+            frame = yfinance.download(symbol, start=since, end=end, progress=False, auto_adjust=False)
+            if frame is None or frame.empty:
+                continue
+            frame.columns = [c.lower() for c in frame.columns]
+            written += self.write(symbol, frame)
+        return written
+
+    @contextmanager
+    def _write_lock(self, symbol):
+        with self._lock:
+            lock = self._write_locks.setdefault(symbol, threading.Lock())
+        with lock, open(os.path.join(self.root, symbol, '.lock'), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _ensure_started(self):
+        # Threads don't survive a fork, so start the writer again in each worker.
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        self._writer = threading.Thread(target=self._run, name='price-store-writer', daemon=True)
+        self._writer.start()
+
+    def _run(self):
+        while True:
+            symbol, bars = self._queue.get()
+            try:
+                self.write(symbol, bars)
+            except Exception as e:
+                logging.error({'exception': str(e), 'symbol': symbol})
+
+    def _to_bars(self, bars):
+        if isinstance(bars, np.ndarray) and bars.dtype == self.DTYPE:
+            data = bars
+        else:
+            frame = bars
+            if 'date' in frame.columns:
+                frame = frame.set_index('date')
+            data = np.empty(len(frame), dtype=self.DTYPE)
+            data['ts'] = pd.DatetimeIndex(frame.index).tz_localize(None).values.astype('datetime64[s]')
+            for field in self.FIELDS:
+                data[field] = frame[field].to_numpy(dtype=np.float64) if field in frame else np.nan
+        data = data[~np.isnat(data['ts'])]
+        if (np.diff(data['ts']) > np.timedelta64(0, 's')).all():
+            # Already sorted without duplicates, as generated and vendor bars are.
+            return data
+        return self._dedupe(data[np.argsort(data['ts'], kind='stable')])
+
+    def _dedupe(self, bars):
+        # Keep the last of the bars sharing a timestamp, in timestamp order.
+        _, last = np.unique(bars['ts'][::-1], return_index=True)
+        return bars[len(bars) - 1 - last]
+
+    def _changed(self, existing, new):
+        # Number of bars in `new` which aren't already stored as they are.
+        if existing is None or not len(existing):
+            return len(new)
+        idx = np.minimum(np.searchsorted(existing['ts'], new['ts']), len(existing) - 1)
+        stored = existing[idx]
+        same = stored['ts'] == new['ts']
+        for field in self.FIELDS:
+            same &= (stored[field] == new[field]) | (np.isnan(stored[field]) & np.isnan(new[field]))
+        return int(len(new) - np.count_nonzero(same))
+
+    def _merge(self, existing, new):
+        if existing is None or not len(existing):
+            return new
+        if new['ts'][0] > existing['ts'][-1]:
+            # Fast path for the usual append-only ingest.
+            return np.concatenate((existing, new))
+        merged = np.concatenate((existing, new))
+        return self._dedupe(merged[np.argsort(merged['ts'], kind='stable')])
+
+    def _years(self, symbol):
+        directory = os.path.join(self.root, symbol)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(int(name[:-4]) for name in os.listdir(directory) if name.endswith('.npy'))
+
+    def _path(self, symbol, year):
+        return os.path.join(self.root, symbol, '{}.npy'.format(year))
+
+    def _load(self, path):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            cached = self._maps.get(path)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+        try:
+            bars = np.load(path, mmap_mode='r')
+        except (OSError, ValueError) as e:
+            logging.error({'exception': str(e), 'path': path})
+            return None
+        with self._lock:
+            self._maps[path] = (mtime, bars)
+        return bars
@@ -0,0 +1,134 @@
+import json
+import random
+import logging
+import threading
+import time
+
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+
+class StubServer:
+    """
+    A local stand-in for IEX Cloud serving the responses of a provider
+    (usually a `RecordedProvider`) over the IEX batch and search endpoints,
+    so the whole request path, HTTP client and retries included, can be
+    performance tested against a reproducible upstream.
+
+    Every response is delayed by `latency` seconds give or take a normally
+    distributed `jitter`, and a fraction `error_rate` of requests fail with
+    `error_status`.
+
+    Params
+    ------
+    provider : MarketDataProvider
+        Source of the responses.
+    host, port : str, int
+        Address to listen on. Port 0 picks a free port.
+    latency, jitter : float
+        Mean and standard deviation of the delay of a response, in seconds.
+    error_rate : float
+        Fraction of requests answered with `error_status`.
+    error_status : int
+        HTTP status of injected errors, e.g. 429 or 503.
+    seed : int, optional
+        Seed of the latency and error draws.
+    """
+    def __init__(self, provider, host='127.0.0.1', port=8765, latency=0.0, jitter=0.0, error_rate=0.0,
+            error_status=HTTPStatus.SERVICE_UNAVAILABLE, seed=None):
+        self.provider = provider
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = int(error_status)
+        self.requests = 0
+        self.errors = 0
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+
+    @property
+    def url(self):
+        """
+        Base URL to set as `IEX_API_URL`.
+        """
+        host, port = self.httpd.server_address[:2]
+        return 'http://{}:{}/stable'.format(host, port)
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def start(self):
+        """
+        Serve from a background thread.
+        """
+        self._thread = threading.Thread(target=self.serve_forever, name='iex-stub', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def respond(self, path, query):
+        """
+        Get the `(status, body)` answering a GET of `path` with the parsed
+        `query`.
+        """
+        with self._lock:
+            self.requests += 1
+            delay = max(self._random.gauss(self.latency, self.jitter), 0) if self.latency or self.jitter else 0
+            fail = self._random.random() < self.error_rate
+            if fail:
+                self.errors += 1
+        if delay:
+            time.sleep(delay)
+        if fail:
+            return self.error_status, {'error': 'Injected error'}
+
+        if path.endswith('/stock/market/batch'):
+            symbols = [s.upper() for s in query.get('symbols', '').split(',') if s]
+            types = [t for t in query.get('types', '').split(',') if t]
+            params = {k: v for k, v in query.items() if k not in ('symbols', 'types', 'token')}
+            data = self.provider.batch(symbols, types, params)
+        elif '/search/' in path:
+            data = self.provider.search(unquote(path.rsplit('/search/', 1)[1]))
+        else:
+            return HTTPStatus.NOT_FOUND, {'error': 'Unknown endpoint'}
+
+        if data is False:
+            return HTTPStatus.BAD_GATEWAY, {'error': 'Provider failed'}
+        return HTTPStatus.OK, data
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body are written separately, which Nagle's
+            # algorithm would hold back on a kept-alive connection.
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                try:
+                    status, data = server.respond(url.path, query)
+                except Exception as e:
+                    logging.error({'exception': str(e), 'path': self.path})
+                    status, data = HTTPStatus.INTERNAL_SERVER_ERROR, {'error': str(e)}
+
+                body = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug({'message': format % args, 'client': self.client_address[0]})
+
+        return Handler
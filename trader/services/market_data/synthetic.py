@@ -0,0 +1,385 @@
+import math
+import time
+import zlib
+import threading
+
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from trader.services.market_data.base import MarketDataProvider
+from trader.services.market_data.store import PriceStore
+
+TRADING_DAYS = 252
+MINUTES_PER_DAY = 390
+# Trading seconds in a year, the time unit of the drift and volatility.
+TRADING_SECONDS = TRADING_DAYS * MINUTES_PER_DAY * 60
+
+def trading_index(start, periods, freq='1d'):
+    """
+    Timestamps of `periods` bars from `start`: one per business day, or one
+    per minute from 09:30 to 15:59 of every business day for `'1min'`.
+    """
+    if freq == '1d':
+        return pd.bdate_range(start, periods=periods).values.astype('datetime64[s]')
+    days = pd.bdate_range(start, periods=math.ceil(periods / MINUTES_PER_DAY)).values.astype('datetime64[s]')
+    minutes = (np.arange(MINUTES_PER_DAY) * 60 + 34200).astype('timedelta64[s]')
+    return (days[:, None] + minutes).ravel()[:periods]
+
+def simulate_returns(rng, n_steps, n_symbols, dt, mu=0.07, sigma=0.3, correlation=0.3,
+        jump_intensity=2.0, jump_mean=-0.02, jump_std=0.05, market=None, dtype=np.float64):
+    """
+    Log returns of correlated geometric Brownian motions with Merton jumps.
+
+    Symbols are correlated through a single market factor, which gives every
+    pair a `correlation` without factoring a covariance matrix of thousands
+    of symbols.
+
+    Params
+    ------
+    rng : numpy.random.Generator
+        Source of randomness.
+    n_steps, n_symbols : int
+        Shape of the result.
+    dt : float
+        Length of a step in years.
+    mu, sigma : float or array
+        Annual drift and volatility, scalars or one per symbol.
+    correlation : float
+        Correlation of the diffusion of any two symbols.
+    jump_intensity : float
+        Expected number of jumps per year.
+    jump_mean, jump_std : float
+        Mean and standard deviation of the log size of a jump.
+    market : ndarray, optional
+        Standard normal market factor shocks, one per step, so symbols
+        simulated in separate chunks stay correlated.
+
+    Returns an `(n_steps, n_symbols)` array.
+    """
+    if market is None:
+        market = rng.standard_normal(n_steps, dtype=dtype)
+    sigma = np.asarray(sigma, dtype=dtype)
+    shocks = rng.standard_normal((n_steps, n_symbols), dtype=dtype)
+    shocks *= math.sqrt(1 - correlation)
+    shocks += math.sqrt(correlation) * market[:, None]
+
+    returns = shocks * (sigma * math.sqrt(dt))
+    returns += (np.asarray(mu, dtype=dtype) - 0.5 * sigma**2) * dt
+
+    if jump_intensity:
+        jumps = rng.poisson(jump_intensity * dt, size=(n_steps, n_symbols))
+        hit = np.nonzero(jumps)
+        n = jumps[hit]
+        returns[hit] += n * jump_mean + np.sqrt(n) * jump_std * rng.standard_normal(len(n))
+    return returns
+
+def returns_to_bars(rng, timestamps, returns, start_price, sigma, dt, base_volume):
+    """
+    Build OHLCV bars from log returns, one structured array of
+    `PriceStore.DTYPE` per column of `returns`. Each bar opens at the
+    previous close, with high and low spread around the open and close by
+    the volatility of a step.
+
+    Returns the bars and the last close of every symbol.
+    """
+    close = start_price * np.exp(np.cumsum(returns, axis=0))
+    opens = np.empty_like(close)
+    opens[0] = start_price
+    opens[1:] = close[:-1]
+
+    spread = np.abs(rng.standard_normal((2,) + close.shape)) * (np.asarray(sigma) * math.sqrt(dt) * 0.5)
+    high = np.maximum(opens, close) * (1 + spread[0])
+    low = np.minimum(opens, close) * (1 - spread[1])
+    volume = np.round(base_volume * rng.lognormal(0, 0.5, close.shape))
+
+    # One contiguous row per symbol makes the copies into the bars cheap.
+    columns = [np.ascontiguousarray(a.T) for a in (opens, high, low, close, volume)]
+    bars = []
+    for i in range(close.shape[1]):
+        column = np.empty(len(timestamps), dtype=PriceStore.DTYPE)
+        column['ts'] = timestamps
+        for field, values in zip(PriceStore.FIELDS, columns):
+            column[field] = values[i]
+        bars.append(column)
+    return bars, close[-1]
+
+class SyntheticMarket(MarketDataProvider):
+    """
+    Offline market data with the same shape as IEX batch responses, so the
+    app can run and be load tested without network access.
+
+    Every symbol gets deterministic parameters (starting price, volatility,
+    volume, name) from a hash of its name and the seed, and a daily history
+    ending today. Live quotes carry on from the last close, moving along a
+    correlated jump diffusion as wall-clock time passes (scaled by `speed`).
+
+    The live path only depends on the seed, the symbol and the number of
+    `tick` second buckets since midnight, so every worker quotes the same
+    price at the same time. Each process only keeps the current block of
+    `BLOCK_SIZE` buckets of each symbol.
+    """
+    EXCHANGES = ('NASDAQ', 'NEW YORK STOCK EXCHANGE, INC.')
+    HEADLINES = (
+        '{name} shares move as traders weigh outlook',
+        '{name} announces quarterly results',
+        'Analysts revisit price targets for {name}',
+        '{name} ({symbol}) sees unusual options activity',
+        'What to watch for {name} this week'
+    )
+    BLOCK_SIZE = 300
+
+    def __init__(self, seed=0, mu=0.07, sigma=(0.15, 0.6), correlation=0.3, jump_intensity=2.0,
+            jump_mean=-0.02, jump_std=0.05, history_days=5 * TRADING_DAYS, speed=1.0, tick=1.0):
+        self.seed = seed
+        self.mu = mu
+        self.sigma = sigma
+        self.correlation = correlation
+        self.jump_intensity = jump_intensity
+        self.jump_mean = jump_mean
+        self.jump_std = jump_std
+        self.history_days = history_days
+        self.speed = speed
+        self.tick = tick
+
+        self._history = {}
+        self._live = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.seed = app.config.get('SYNTHETIC_SEED', self.seed)
+        self.correlation = app.config.get('SYNTHETIC_CORRELATION', self.correlation)
+        self.jump_intensity = app.config.get('SYNTHETIC_JUMP_INTENSITY', self.jump_intensity)
+        self.speed = app.config.get('SYNTHETIC_SPEED', self.speed)
+        self.tick = app.config.get('SYNTHETIC_TICK', self.tick)
+
+    def params(self, symbol):
+        """
+        Deterministic `(start_price, sigma, base_volume, name)` of `symbol`.
+        """
+        rng = np.random.default_rng([self.seed, zlib.crc32(symbol.encode())])
+        start_price = float(np.exp(rng.uniform(np.log(5), np.log(500))))
+        sigma = float(rng.uniform(*self.sigma))
+        base_volume = float(np.exp(rng.uniform(np.log(1e5), np.log(5e7))))
+        return start_price, sigma, base_volume, '{} Corp.'.format(symbol.capitalize())
+
+    def history(self, symbol):
+        """
+        Daily bars of `symbol` over the last `history_days` business days.
+        """
+        symbol = symbol.upper()
+        today = datetime.now().date()
+        with self._lock:
+            cached = self._history.get(symbol)
+        # Histories end on the previous business day, so they move on at midnight.
+        if cached is not None and cached[0] == today:
+            return cached[1]
+
+        start_price, sigma, base_volume, _ = self.params(symbol)
+        end = pd.Timestamp(today) - pd.offsets.BDay(1)
+        timestamps = pd.bdate_range(end=end, periods=self.history_days).values.astype('datetime64[s]')
+        dt = 1 / TRADING_DAYS
+
+        # The market factor only depends on the seed, so histories of
+        # different symbols are correlated.
+        market = np.random.default_rng([self.seed, len(timestamps)]).standard_normal(len(timestamps))
+        rng = np.random.default_rng([self.seed, zlib.crc32(symbol.encode()), 1])
+        returns = simulate_returns(rng, len(timestamps), 1, dt, self.mu, sigma, self.correlation,
+            self.jump_intensity, self.jump_mean, self.jump_std, market=market)
+        (bars,), _ = returns_to_bars(rng, timestamps, returns, start_price, sigma, dt, base_volume)
+
+        with self._lock:
+            self._history[symbol] = (today, bars)
+        return bars
+
+    def quotes(self, symbols):
+        """
+        Current quotes of `symbols` in the shape of IEX quotes.
+        """
+        now = time.time()
+        return {s: self._quote(s, self._live_state(s, now), now) for s in (s.upper() for s in symbols)}
+
+    def chart(self, symbol, range='1m'):
+        """
+        Daily bars of `symbol` in the shape of an IEX chart.
+        """
+        bars = self.history(symbol)
+        days = PriceStore.RANGES.get(range, 31)
+        bars = bars[bars['ts'] >= bars['ts'][-1] - np.timedelta64(days, 'D')]
+        return [{
+            'date': str(bar['ts'].astype('datetime64[D]')),
+            'open': round(float(bar['open']), 2),
+            'high': round(float(bar['high']), 2),
+            'low': round(float(bar['low']), 2),
+            'close': round(float(bar['close']), 2),
+            'volume': int(bar['volume'])
+        } for bar in bars]
+
+    def news(self, symbol, last=5):
+        symbol = symbol.upper()
+        name = self.params(symbol)[3]
+        today = datetime.now().replace(minute=0, second=0, microsecond=0)
+        return [{
+            'datetime': int((today - timedelta(hours=6 * i)).timestamp() * 1000),
+            'headline': self.HEADLINES[(zlib.crc32(symbol.encode()) + i) % len(self.HEADLINES)].format(
+                name=name, symbol=symbol),
+            'source': 'Synthetic Wire',
+            'url': '',
+            'summary': '',
+            'related': symbol,
+            'image': '',
+            'lang': 'en',
+            'hasPaywall': False
+        } for i in range(int(last))]
+
+    def search(self, fragment):
+        """
+        Matches for a symbol search, in the shape of IEX search results. Any
+        symbol is tradable, so the fragment itself always matches.
+        """
+        symbol = fragment.upper()[:5]
+        return [{
+            'symbol': symbol,
+            'securityName': self.params(symbol)[3],
+            'securityType': 'cs',
+            'region': 'US',
+            'exchange': self.EXCHANGES[zlib.crc32(symbol.encode()) % len(self.EXCHANGES)]
+        }]
+
+    def batch(self, symbols, types, params):
+        """
+        Answer an IEX `/stock/market/batch` call for `types` of `symbols`.
+        """
+        quotes = self.quotes(symbols) if 'quote' in types else {}
+        result = {}
+        for symbol in symbols:
+            symbol = symbol.upper()
+            payload = {}
+            if 'quote' in types:
+                payload['quote'] = quotes[symbol]
+            if 'chart' in types:
+                payload['chart'] = self.chart(symbol, params.get('range', '1m'))
+            if 'news' in types:
+                payload['news'] = self.news(symbol, params.get('last', 5))
+            result[symbol] = payload
+        return result
+
+    def write_history(self, store, symbols, start, periods, freq='1min', chunk_steps=MINUTES_PER_DAY * TRADING_DAYS,
+            chunk_symbols=250):
+        """
+        Generate `periods` bars of `symbols` from `start` into `store`.
+
+        Bars are generated `chunk_steps` at a time for `chunk_symbols`
+        symbols at a time, carrying the last close forward, so years of
+        minute bars for thousands of symbols fit in a fixed amount of
+        memory. The market factor of a time chunk is shared by all symbol
+        chunks.
+
+        Returns the number of bars written.
+        """
+        symbols = [s.upper() for s in symbols]
+        steps_per_year = TRADING_DAYS * (MINUTES_PER_DAY if freq == '1min' else 1)
+        dt = 1 / steps_per_year
+
+        params = [self.params(s) for s in symbols]
+        last = np.array([p[0] for p in params])
+        sigma = np.array([p[1] for p in params])
+        volume = np.array([p[2] for p in params]) / (MINUTES_PER_DAY if freq == '1min' else 1)
+
+        timestamps = trading_index(start, periods, freq)
+        written = 0
+        for t in range(0, periods, chunk_steps):
+            ts = timestamps[t:t + chunk_steps]
+            market = np.random.default_rng([self.seed, 2, t]).standard_normal(len(ts), dtype=np.float32)
+            for i in range(0, len(symbols), chunk_symbols):
+                group = slice(i, i + chunk_symbols)
+                rng = np.random.default_rng([self.seed, 3, t, i])
+                returns = simulate_returns(rng, len(ts), len(symbols[group]), dt, self.mu, sigma[group],
+                    self.correlation, self.jump_intensity, self.jump_mean, self.jump_std,
+                    market=market, dtype=np.float32)
+                bars, last[group] = returns_to_bars(rng, ts, returns, last[group], sigma[group], dt, volume[group])
+                for symbol, column in zip(symbols[group], bars):
+                    written += store.write(symbol, column)
+        return written
+
+    def _live_state(self, symbol, now):
+        """
+        Live `price`, `previous` close, `open`, `high`, `low` and `volume` of
+        `symbol` at `now`.
+        """
+        day = datetime.fromtimestamp(now).date()
+        bucket = int((now - datetime.combine(day, datetime.min.time()).timestamp()) // self.tick)
+        block, offset = divmod(bucket, self.BLOCK_SIZE)
+
+        with self._lock:
+            state = self._live.get(symbol)
+        if state is None or state['day'] != day or state['block'] > block:
+            close = float(self.history(symbol)['close'][-1])
+            start = math.log(close)
+            state = {'day': day, 'block': 0, 'close': close, 'start': start, 'high': start, 'low': start,
+                'path': start + np.cumsum(self._block_returns(symbol, day, 0))}
+        else:
+            state = dict(state)
+
+        # Carry the path over the blocks completed since the last quote.
+        while state['block'] < block:
+            path = state['path']
+            state['high'] = max(state['high'], float(path.max()))
+            state['low'] = min(state['low'], float(path.min()))
+            state['start'] = float(path[-1])
+            state['block'] += 1
+            state['path'] = state['start'] + np.cumsum(self._block_returns(symbol, day, state['block']))
+        with self._lock:
+            self._live[symbol] = state
+
+        seen = state['path'][:offset + 1]
+        close = round(state['close'], 2)
+        return {
+            'price': round(math.exp(seen[-1]), 2),
+            'previous': close,
+            'open': close,
+            'high': round(math.exp(max(state['high'], float(seen.max()))), 2),
+            'low': round(math.exp(min(state['low'], float(seen.min()))), 2),
+            'volume': int(bucket * self.tick * self.speed * 100)
+        }
+
+    def _block_returns(self, symbol, day, block):
+        # Seeded by day and block only, the market factor is shared by all
+        # symbols, which keeps their live moves correlated.
+        day = day.toordinal()
+        market = np.random.default_rng([self.seed, 4, day, block]).standard_normal(self.BLOCK_SIZE)
+        rng = np.random.default_rng([self.seed, zlib.crc32(symbol.encode()), 5, day, block])
+        dt = self.tick * self.speed / TRADING_SECONDS
+        return simulate_returns(rng, self.BLOCK_SIZE, 1, dt, self.mu, self.params(symbol)[1], self.correlation,
+            self.jump_intensity, self.jump_mean, self.jump_std, market=market)[:, 0]
+
+    def _quote(self, symbol, state, now):
+        _, _, base_volume, name = self.params(symbol)
+        bars = self.history(symbol)
+        year = bars[-TRADING_DAYS:]
+        price, previous = state['price'], state['previous']
+        return {
+            'symbol': symbol,
+            'companyName': name,
+            'primaryExchange': self.EXCHANGES[zlib.crc32(symbol.encode()) % len(self.EXCHANGES)],
+            'calculationPrice': 'tops',
+            'open': state['open'],
+            'high': state['high'],
+            'low': state['low'],
+            'latestPrice': price,
+            'latestSource': 'IEX real time price',
+            'latestTime': datetime.fromtimestamp(now).strftime('%I:%M:%S %p'),
+            'latestUpdate': int(now * 1000),
+            'latestVolume': state['volume'],
+            'volume': state['volume'],
+            'previousClose': previous,
+            'change': round(price - previous, 2),
+            'changePercent': round((price - previous) / previous, 5),
+            'avgTotalVolume': int(base_volume),
+            'marketCap': int(price * base_volume * 200),
+            'peRatio': round(10 + (zlib.crc32(symbol.encode()) % 300) / 10, 2),
+            'week52High': round(float(max(year['high'].max(), state['high'])), 2),
+            'week52Low': round(float(min(year['low'].min(), state['low'])), 2),
+            'isUSMarketOpen': True
+        }
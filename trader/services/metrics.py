@@ -0,0 +1,395 @@
+import os
+import sys
+import hmac
+import time
+import random
+import bisect
+import logging
+import threading
+
+from functools import wraps
+from contextlib import contextmanager
+from collections import Counter as Tally
+
+from flask import g, request, has_request_context, abort, Response
+from marshmallow import Schema
+from sqlalchemy import event
+
+from trader.services.market_data.base import MarketDataProvider
+
+# Seconds, from a fast cache hit to a slow upstream call.
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# Per-request phases reported in the `Server-Timing` header.
+PHASES = ('db', 'market_data', 'auth', 'serialize')
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def expose(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} counter'.format(self.name)]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append('{}{} {}'.format(self.name, _labels(self.labels, labels), value))
+        return lines
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                # One count per bucket plus +Inf, then the sum.
+                counts = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def expose(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} histogram'.format(self.name)]
+        with self._lock:
+            values = sorted((labels, list(counts)) for labels, counts in self._values.items())
+        for labels, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(self.name,
+                    _labels(self.labels + ('le',), labels + (str(bound),)), cumulative))
+            lines.append('{}_sum{} {}'.format(self.name, _labels(self.labels, labels), round(counts[-1], 6)))
+            lines.append('{}_count{} {}'.format(self.name, _labels(self.labels, labels), cumulative))
+        return lines
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ('{}="{}"'.format(n, str(v).replace('\\', '\\\\').replace('"', '\\"')) for n, v in zip(names, values))
+    return '{' + ','.join(pairs) + '}'
+
+class RequestStats:
+    """
+    What a request spent its time on, kept on `flask.g`.
+    """
+    __slots__ = ('started', 'queries', 'phases', 'profiler')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.profiler = None
+
+class InstrumentedProvider(MarketDataProvider):
+    """
+    Times the calls made to an upstream market data provider.
+    """
+    def __init__(self, provider, metrics):
+        self.provider = provider
+        self.metrics = metrics
+
+    def init_app(self, app):
+        self.provider.init_app(app)
+
+    def batch(self, symbols, types, params):
+        return self._call('batch', self.provider.batch, symbols, types, params)
+
+    def search(self, fragment):
+        return self._call('search', self.provider.search, fragment)
+
+    def _call(self, call, method, *args):
+        started = time.perf_counter()
+        result = False
+        try:
+            result = method(*args)
+            return result
+        finally:
+            outcome = 'error' if result is False else 'ok'
+            self.metrics.upstream_seconds.observe(time.perf_counter() - started, call, outcome)
+
+class SamplingProfiler:
+    """
+    Samples the stack of one thread every `interval` seconds from a
+    background thread, counting stacks in the folded format read by
+    flamegraph tools.
+    """
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Tally()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def folded(self):
+        return '\n'.join('{} {}'.format(stack, count) for stack, count in self.stacks.most_common()) + '\n'
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{}:{}'.format(os.path.basename(code.co_filename), code.co_name))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+class Metrics:
+    """
+    Request-level instrumentation exposed in the Prometheus text format on
+    `/metrics`.
+
+    Hooks the Flask request cycle, SQLAlchemy cursor execution, the market
+    data provider and marshmallow schema dumps, and records per-endpoint
+    latency, query counts and the time each request spent in the database,
+    market data, authentication and serialization. With
+    `METRICS_TIMING_HEADERS`, the per-request breakdown is also returned in
+    `Server-Timing` and `X-Query-Count` headers. Queries slower than
+    `METRICS_SLOW_QUERY_MS` are logged.
+
+    `/metrics` requires `Authorization: Bearer <METRICS_TOKEN>`. Without a
+    token it is only served in debug mode.
+
+    Requests sent with an `X-Profile: 1` header (when
+    `METRICS_PROFILING_ENABLED`), or a `METRICS_PROFILE_RATE` fraction of
+    all requests, are run under a sampling profiler and their stacks
+    written to `METRICS_PROFILE_DIR`.
+
+    Metrics are kept per process.
+    """
+    def __init__(self):
+        self.enabled = True
+        self.token = None
+        self.public = False
+        self.timing_headers = False
+        self.slow_query_ms = 200
+        self.profiling_enabled = False
+        self.profile_rate = 0.0
+        self.profile_interval = 0.005
+        self.profile_dir = None
+        self._local = threading.local()
+
+        self.request_seconds = Histogram('trader_request_duration_seconds', 'Time to handle a request.',
+            ('endpoint', 'method', 'status'))
+        self.request_queries = Histogram('trader_request_queries', 'SQL statements executed by a request.',
+            ('endpoint',), COUNT_BUCKETS)
+        self.phase_seconds = Histogram('trader_request_phase_seconds', 'Time a request spent in each phase.',
+            ('endpoint', 'phase'))
+        self.query_seconds = Histogram('trader_db_query_duration_seconds', 'Time to execute a SQL statement.',
+            ('operation',))
+        self.slow_queries = Counter('trader_db_slow_queries_total', 'SQL statements slower than the threshold.',
+            ('operation',))
+        self.upstream_seconds = Histogram('trader_upstream_duration_seconds', 'Time of market data provider calls.',
+            ('call', 'outcome'))
+        self.schema_seconds = Histogram('trader_schema_dump_duration_seconds', 'Time to dump a schema.',
+            ('schema',))
+        self.auth_seconds = Histogram('trader_auth_duration_seconds', 'Time to authenticate credentials.',
+            ('method',))
+        self.collectors = [self.request_seconds, self.request_queries, self.phase_seconds, self.query_seconds,
+            self.slow_queries, self.upstream_seconds, self.schema_seconds, self.auth_seconds]
+
+    def init_app(self, app, db, market_data):
+        self.enabled = app.config.get('METRICS_ENABLED', self.enabled)
+        self.token = app.config.get('METRICS_TOKEN') or None
+        self.public = app.debug
+        self.timing_headers = app.config.get('METRICS_TIMING_HEADERS', self.timing_headers)
+        self.slow_query_ms = app.config.get('METRICS_SLOW_QUERY_MS', self.slow_query_ms)
+        self.profiling_enabled = app.config.get('METRICS_PROFILING_ENABLED', self.profiling_enabled)
+        self.profile_rate = app.config.get('METRICS_PROFILE_RATE', self.profile_rate)
+        self.profile_interval = app.config.get('METRICS_PROFILE_INTERVAL', self.profile_interval)
+        self.profile_dir = app.config.get('METRICS_PROFILE_DIR', self.profile_dir)
+        if not self.enabled:
+            return
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        app.add_url_rule('/metrics', 'metrics', self.export)
+
+        for engine in db.engines:
+            if not event.contains(engine, 'before_cursor_execute', self._before_cursor_execute):
+                event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+                event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+                event.listen(engine, 'handle_error', self._handle_error)
+
+        if not isinstance(market_data.provider, InstrumentedProvider):
+            market_data.provider = InstrumentedProvider(market_data.provider, self)
+        # Provider calls run on the batcher's threads, so the request side
+        # is timed around the calls that wait on them.
+        for name in ('fetch', 'search_symbol'):
+            self._time_method(market_data, name, 'market_data')
+        self._instrument_schemas()
+
+    @contextmanager
+    def timer(self, phase, histogram=None, *labels):
+        """
+        Time a block, adding it to `phase` of the current request and to
+        `histogram` if given.
+        """
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            if histogram is not None:
+                histogram.observe(elapsed, *labels)
+            stats = self._stats()
+            if stats is not None:
+                stats.phases[phase] += elapsed
+
+    def export(self):
+        if self.token is None:
+            if not self.public:
+                abort(404)
+        else:
+            auth = request.headers.get('Authorization', '')
+            if not hmac.compare_digest(auth.encode(), 'Bearer {}'.format(self.token).encode()):
+                abort(401)
+        lines = []
+        for collector in self.collectors:
+            lines.extend(collector.expose())
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+    def _stats(self):
+        return getattr(g, 'request_stats', None) if has_request_context() else None
+
+    def _before_request(self):
+        stats = g.request_stats = RequestStats()
+        if (self.profiling_enabled and request.headers.get('X-Profile') == '1') or \
+                (self.profile_rate and random.random() < self.profile_rate):
+            stats.profiler = SamplingProfiler(threading.get_ident(), self.profile_interval).start()
+
+    def _after_request(self, response):
+        stats = self._stats()
+        if stats is None or request.endpoint == 'metrics':
+            return response
+
+        elapsed = time.perf_counter() - stats.started
+        endpoint = request.endpoint or 'unmatched'
+        self.request_seconds.observe(elapsed, endpoint, request.method, str(response.status_code))
+        self.request_queries.observe(stats.queries, endpoint)
+        for phase, seconds in stats.phases.items():
+            if seconds:
+                self.phase_seconds.observe(seconds, endpoint, phase)
+
+        if self.timing_headers:
+            timings = ['{};dur={:.1f}'.format(p, s * 1000) for p, s in stats.phases.items() if s]
+            timings.append('total;dur={:.1f}'.format(elapsed * 1000))
+            response.headers['Server-Timing'] = ', '.join(timings)
+            response.headers['X-Query-Count'] = str(stats.queries)
+
+        if stats.profiler is not None:
+            stats.profiler.stop()
+            path = self._write_profile(endpoint, stats.profiler)
+            stats.profiler = None
+            if path:
+                response.headers['X-Profile-File'] = path
+        return response
+
+    def _teardown_request(self, exception=None):
+        # Requests failing with an exception skip `after_request`.
+        stats = self._stats()
+        if stats is not None and stats.profiler is not None:
+            stats.profiler.stop()
+            stats.profiler = None
+
+    def _write_profile(self, endpoint, profiler):
+        if not self.profile_dir:
+            logging.info({'message': 'Request profile', 'endpoint': endpoint, 'stacks': profiler.folded()})
+            return None
+        os.makedirs(self.profile_dir, exist_ok=True)
+        path = os.path.join(self.profile_dir, '{}-{}-{}.folded'.format(
+            int(time.time() * 1000), endpoint.replace('.', '_'), threading.get_ident()))
+        with open(path, 'w') as f:
+            f.write(profiler.folded())
+        return path
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_started'].pop()
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'OTHER'
+        if operation not in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'COPY', 'WITH'):
+            operation = 'OTHER'
+        self.query_seconds.observe(elapsed, operation)
+
+        stats = self._stats()
+        if stats is not None:
+            stats.queries += 1
+            stats.phases['db'] += elapsed
+        if elapsed * 1000 >= self.slow_query_ms:
+            self.slow_queries.inc(operation)
+            logging.warning({
+                'message': 'Slow query',
+                'ms': round(elapsed * 1000, 1),
+                'statement': statement[:2000],
+                'endpoint': request.endpoint if has_request_context() else None
+            })
+
+    def _handle_error(self, context):
+        # Failed statements never reach `after_cursor_execute`; drop their
+        # start time so it doesn't stay on the pooled connection.
+        if context.statement is not None and context.connection is not None:
+            started = context.connection.info.get('query_started')
+            if started:
+                started.pop()
+
+    def _time_method(self, obj, name, phase):
+        method = getattr(obj, name)
+        if getattr(method, 'instrumented', False):
+            return
+
+        @wraps(method)
+        def timed(*args, **kwargs):
+            with self.timer(phase):
+                return method(*args, **kwargs)
+        timed.instrumented = True
+        setattr(obj, name, timed)
+
+    def _instrument_schemas(self):
+        dump = Schema.dump
+        if getattr(dump, 'instrumented', False):
+            return
+        metrics, local = self, self._local
+
+        @wraps(dump)
+        def timed_dump(schema, obj, *args, **kwargs):
+            # Nested schemas are timed as part of their parent.
+            if getattr(local, 'dumping', False):
+                return dump(schema, obj, *args, **kwargs)
+            local.dumping = True
+            try:
+                with metrics.timer('serialize', metrics.schema_seconds, type(schema).__name__):
+                    return dump(schema, obj, *args, **kwargs)
+            finally:
+                local.dumping = False
+        timed_dump.instrumented = True
+        Schema.dump = timed_dump
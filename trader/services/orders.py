@@ -0,0 +1,233 @@
+import os
+import time
+import heapq
+import logging
+import itertools
+import threading
+
+from sqlalchemy import update
+
+from trader.lib import clock
+from trader.models import Order
+
+# Directions in which the price has to cross an order's threshold.
+ABOVE, BELOW = 1, -1
+
+class OpenOrder:
+    """
+    What the engine keeps in memory of an open order.
+    """
+    __slots__ = ('id', 'symbol', 'trade_type', 'order_type', 'limit_price', 'stop_price', 'triggered')
+
+    def __init__(self, id, symbol, trade_type, order_type, limit_price=None, stop_price=None, triggered=False):
+        self.id = id
+        self.symbol = symbol.upper()
+        self.trade_type = trade_type
+        self.order_type = order_type
+        self.limit_price = limit_price
+        self.stop_price = stop_price
+        self.triggered = triggered
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(row.id, row.symbol, row.trade_type, row.order_type, row.limit_price, row.stop_price,
+            row.triggered_at is not None)
+
+    def trigger(self):
+        """
+        Get the `(direction, price)` the market has to cross for this order
+        to act: buy limits and sell stops fire at or below their price, sell
+        limits and buy stops at or above it. A stop-limit order waits on its
+        stop price, then on its limit price once triggered.
+        """
+        buy = self.trade_type == 'buy'
+        if self.order_type == 'limit' or (self.order_type == 'stop_limit' and self.triggered):
+            return (BELOW if buy else ABOVE), self.limit_price
+        return (ABOVE if buy else BELOW), self.stop_price
+
+class OrderIndex:
+    """
+    Open orders of every symbol in two heaps ordered by trigger price: a
+    min-heap of orders firing when the price rises to their threshold, and
+    a max-heap of those firing when it falls to it. A tick pops only the
+    orders whose threshold it crossed, in O(k log n).
+
+    Removed orders are dropped lazily when they reach the top of a heap.
+    """
+    def __init__(self):
+        self._above = {}
+        self._below = {}
+        self._live = {}
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return len(self._live)
+
+    def __contains__(self, order_id):
+        return order_id in self._live
+
+    def add(self, order_id, symbol, direction, threshold):
+        seq = next(self._seq)
+        self._live[order_id] = seq
+        if direction == ABOVE:
+            heapq.heappush(self._above.setdefault(symbol, []), (threshold, seq, order_id))
+        else:
+            heapq.heappush(self._below.setdefault(symbol, []), (-threshold, seq, order_id))
+
+    def remove(self, order_id):
+        self._live.pop(order_id, None)
+
+    def crossed(self, symbol, price):
+        """
+        Remove and return the ids of the orders of `symbol` whose threshold
+        `price` reached.
+        """
+        ids = []
+        heap = self._above.get(symbol)
+        while heap and heap[0][0] <= price:
+            _, seq, order_id = heapq.heappop(heap)
+            if self._live.get(order_id) == seq:
+                del self._live[order_id]
+                ids.append(order_id)
+
+        heap = self._below.get(symbol)
+        while heap and -heap[0][0] >= price:
+            _, seq, order_id = heapq.heappop(heap)
+            if self._live.get(order_id) == seq:
+                del self._live[order_id]
+                ids.append(order_id)
+        return ids
+
+    def symbols(self):
+        return [s for s in set(self._above) | set(self._below) if self._above.get(s) or self._below.get(s)]
+
+class OrderEngine:
+    """
+    Triggers resting limit, stop and stop-limit orders as quotes arrive from
+    the price stream.
+
+    The database is the source of truth: every process loads the open orders
+    into an `OrderIndex` when it starts and again every
+    `ORDER_RELOAD_INTERVAL` seconds, so it also picks up orders placed by
+    other processes. Fills go through `TradeExecutor.fill_order`, which
+    claims the order row, so an order triggered in several processes is
+    still filled once.
+    """
+    def __init__(self, db, executor):
+        self.db = db
+        self.executor = executor
+        self.stream = None
+        self.enabled = True
+        self.reload_interval = 30
+
+        self.index = OrderIndex()
+        self._orders = {}
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._pid = None
+
+    def init_app(self, app, stream):
+        self.stream = stream
+        self.enabled = app.config.get('ORDERS_ENABLED', self.enabled)
+        self.reload_interval = app.config.get('ORDER_RELOAD_INTERVAL', self.reload_interval)
+        if self.enabled:
+            stream.add_listener(self.on_quotes, symbols=self.symbols)
+
+    def start(self):
+        """
+        Load the open orders and start polling quotes in this process.
+        """
+        if not self.enabled or self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self.load()
+        self.stream.start()
+
+    def load(self):
+        """
+        Rebuild the index from the open orders in the database.
+        """
+        with self.db.session_scope() as session:
+            rows = session.query(Order.id, Order.symbol, Order.trade_type, Order.order_type,
+                Order.limit_price, Order.stop_price, Order.triggered_at).\
+                filter(Order.status == 'open').all()
+
+        index, orders = OrderIndex(), {}
+        for row in rows:
+            order = OpenOrder.from_row(row)
+            orders[order.id] = order
+            index.add(order.id, order.symbol, *order.trigger())
+        last_id = max(orders, default=0)
+
+        with self._lock:
+            # Keep orders added while the query ran.
+            for order in self._orders.values():
+                if order.id > last_id and order.id in self.index:
+                    orders[order.id] = order
+                    index.add(order.id, order.symbol, *order.trigger())
+            self.index, self._orders = index, orders
+            self._loaded_at = time.monotonic()
+        logging.info({'message': 'Loaded open orders', 'orders': len(orders)})
+
+    def add(self, order):
+        """
+        Index an open `Order` (or `OpenOrder`).
+        """
+        if not isinstance(order, OpenOrder):
+            order = OpenOrder.from_row(order)
+        with self._lock:
+            self._orders[order.id] = order
+            self.index.add(order.id, order.symbol, *order.trigger())
+
+    def remove(self, order_id):
+        with self._lock:
+            self._orders.pop(order_id, None)
+            self.index.remove(order_id)
+
+    def symbols(self):
+        with self._lock:
+            return self.index.symbols()
+
+    def on_quotes(self, quotes):
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at > self.reload_interval:
+            self.load()
+
+        for symbol, quote in quotes.items():
+            price = quote.get('latestPrice')
+            if price is not None:
+                self.tick(symbol.upper(), float(price))
+
+    def tick(self, symbol, price):
+        """
+        Act on the orders of `symbol` crossed by `price`. Triggered
+        stop-limit orders become limit orders and may fill on the same tick.
+        """
+        while True:
+            with self._lock:
+                orders = [self._orders.pop(i) for i in self.index.crossed(symbol, price)]
+            if not orders:
+                return
+
+            for order in orders:
+                try:
+                    if order.order_type == 'stop_limit' and not order.triggered:
+                        self._trigger(order)
+                    else:
+                        self._fill(order, price)
+                except Exception as e:
+                    logging.error({'exception': str(e), 'order_id': order.id})
+
+    def _trigger(self, order):
+        with self.db.session_scope() as session:
+            session.execute(update(Order.__table__).
+                where(Order.id == order.id).
+                where(Order.status == 'open').
+                where(Order.triggered_at.is_(None)).
+                values(triggered_at=clock.now()))
+        order.triggered = True
+        self.add(order)
+
+    def _fill(self, order, price):
+        result = self.executor.fill_order(order.id, price)
+        if result.orders:
+            logging.info(dict(result.orders[0], message='Order closed', price=price))
@@ -0,0 +1,96 @@
+from sqlalchemy import tuple_
+from sqlalchemy.orm import joinedload
+
+from trader.models import Account, Stock, Trade
+
+class PortfolioRepository:
+    """
+    Read queries for accounts and their stock positions.
+
+    Positions are looked up by `(account_id, symbol)` through the
+    `stocks_akey` unique index instead of loading and scanning the whole
+    `Account.stocks` collection.
+    """
+    POSITION_COLUMNS = (Stock.id, Stock.symbol, Stock.shares, Stock.bought_at)
+
+    def __init__(self, session):
+        self.session = session
+
+    def get_account(self, account_id=None, user_id=None, with_stocks=False):
+        """
+        Get an account by `account_id` or by owner `user_id`. Positions are
+        eagerly loaded in the same query if `with_stocks` is set.
+        """
+        query = self.session.query(Account)
+        if with_stocks:
+            query = query.options(joinedload(Account.stocks))
+        if account_id is not None:
+            query = query.filter(Account.id == account_id)
+        if user_id is not None:
+            query = query.filter(Account.user_id == user_id)
+        return query.first()
+
+    def get_portfolio(self, user_id):
+        """
+        Get the account of `user_id` along with lightweight rows (`id`,
+        `symbol`, `shares`, `bought_at`) for each of its positions, in a
+        single round trip.
+
+        Returns a tuple of `(account, positions)`, or `(None, [])` if the
+        user has no account.
+        """
+        rows = self.session.query(Account, *self.POSITION_COLUMNS).\
+            outerjoin(Stock, Stock.account_id == Account.id).\
+            filter(Account.user_id == user_id).\
+            order_by(Stock.symbol).all()
+        if not rows:
+            return None, []
+
+        account = rows[0][0]
+        positions = [row for row in rows if row.id is not None]
+        return account, positions
+
+    def get_position(self, account_id, symbol, for_update=False):
+        """
+        Get the position in `symbol` held by `account_id`, if any.
+        """
+        query = self.session.query(Stock).filter(Stock.account_id == account_id, Stock.symbol == symbol)
+        if for_update:
+            query = query.with_for_update()
+        return query.first()
+
+    def get_positions(self, account_id, symbols, for_update=False):
+        """
+        Get lightweight rows for the positions of `account_id` in any of
+        `symbols`.
+        """
+        query = self.session.query(*self.POSITION_COLUMNS).\
+            filter(Stock.account_id == account_id, Stock.symbol.in_(list(symbols)))
+        if for_update:
+            query = query.with_for_update()
+        return query.all()
+
+    def has_position(self, account_id, symbol):
+        return self.session.query(
+            self.session.query(Stock.id).filter(Stock.account_id == account_id, Stock.symbol == symbol).exists()
+        ).scalar()
+
+    def get_trades(self, account_id, limit, before=None):
+        """
+        Get up to `limit` trades of `account_id`, newest first, using keyset
+        pagination on `(process_date, id)` so that every page is an index
+        range scan regardless of how deep it is.
+
+        Params
+        ------
+        account_id : int
+            Account identifier.
+        limit : int
+            Maximum number of trades to return.
+        before : tuple, optional
+            `(process_date, id)` of the last trade of the previous page.
+        """
+        query = self.session.query(Trade).filter(Trade.account_id == account_id)
+        if before is not None:
+            query = query.filter(tuple_(Trade.process_date, Trade.id) < tuple_(*before))
+        return query.order_by(Trade.process_date.desc(), Trade.id.desc()).limit(limit).all()
@@ -0,0 +1,376 @@
+import os
+import uuid
+import asyncio
+import logging
+import threading
+
+from http import HTTPStatus
+
+import numpy as np
+
+from trader.lib import clock
+from trader.lib.definitions import ResponseErrors
+from trader.services.orders import OpenOrder, OrderIndex
+from trader.services.streaming import Subscription
+from trader.services.trading import TradeError, Position, apply_balance
+
+class ReplayError(TradeError):
+    """
+    Raised when a replay session can't be created or used.
+    """
+
+class PaperAccount:
+    """
+    Cash and equity of a replay session, checked by the same `apply_balance`
+    rules as real accounts.
+    """
+    def __init__(self, cash):
+        self.cash_amount = cash
+        self.equity_amount = 0.0
+        self.initial_amount = cash
+
+class ReplaySession:
+    """
+    A paper account trading against historical bars, bound to its own
+    `ReplayClock`.
+
+    Quotes, trades, resting orders and valuations all resolve against the
+    bar at the session's clock. Nothing is written to the database, so a
+    replay never affects the user's real account.
+
+    Params
+    ------
+    user_id : int
+        Owner of the session.
+    prices : DataFrame
+        Close prices indexed by timestamp with one column per symbol.
+    cash : float
+        Starting cash.
+    speed : float
+        Simulated seconds per real second.
+    """
+    def __init__(self, user_id, prices, cash, speed):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.symbols = list(prices.columns)
+        self.timestamps = prices.index.to_pydatetime()
+        self.closes = prices.ffill().to_numpy()
+        self.speed = speed
+        self.step = 0
+        self.clock = clock.ReplayClock(self.timestamps[0])
+        self.paused = False
+        self.finished = False
+
+        self.account = PaperAccount(cash)
+        self.positions = {}
+        self.trades = []
+        self.orders = {}
+        self.index = OrderIndex()
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.task = None
+
+    def price(self, symbol):
+        try:
+            price = self.closes[self.step, self.symbols.index(symbol.upper())]
+        except ValueError:
+            return None
+        return None if np.isnan(price) else float(price)
+
+    def quotes(self):
+        """
+        Quotes at the session clock, in the shape of IEX quotes.
+        """
+        update = int(self.clock.now().timestamp() * 1000)
+        return {s: {'symbol': s, 'latestPrice': self.price(s), 'latestUpdate': update} for s in self.symbols}
+
+    def trade(self, data):
+        """
+        Buy or sell at the current replay price. `data` is a trade loaded
+        through `TradeSchema` with its price set from `price()`.
+        """
+        with self.lock:
+            if self.finished:
+                raise ReplayError(ResponseErrors.REPLAY_FINISHED)
+            return self._apply(data)
+
+    def place_order(self, data):
+        """
+        Rest an order loaded through `OrderSchema` until a bar crosses it.
+        """
+        with self.lock:
+            if self.finished:
+                raise ReplayError(ResponseErrors.REPLAY_FINISHED)
+            order = OpenOrder(len(self.orders) + 1, data['symbol'], data['trade_type'], data['order_type'],
+                data.get('limit_price'), data.get('stop_price'))
+            self.orders[order.id] = dict(data, id=order.id, status='open', created_at=self.clock.now(), _order=order)
+            self.index.add(order.id, order.symbol, *order.trigger())
+            return self._order_state(order.id)
+
+    def cancel_order(self, order_id):
+        with self.lock:
+            order = self.orders.get(order_id)
+            if order is None:
+                raise ReplayError(ResponseErrors.ORDER_DNE, HTTPStatus.NOT_FOUND)
+            if order['status'] != 'open':
+                raise ReplayError(ResponseErrors.ORDER_NOT_OPEN)
+            order['status'] = 'cancelled'
+            order['closed_at'] = self.clock.now()
+            self.index.remove(order_id)
+
+    def advance(self):
+        """
+        Move the clock to the next bar and act on the resting orders it
+        crosses. Returns False once the last bar has been reached.
+        """
+        with self.lock:
+            if self.step + 1 >= len(self.timestamps):
+                self.finished = True
+                return False
+            self.step += 1
+            self.clock.advance_to(self.timestamps[self.step])
+
+            for symbol in self.symbols:
+                price = self.price(symbol)
+                if price is not None:
+                    self._cross(symbol, price)
+            self.publish('bar', self._state())
+            return True
+
+    def next_delay(self, max_delay):
+        """
+        Real seconds to wait before the next bar.
+        """
+        if self.step + 1 >= len(self.timestamps):
+            return 0
+        gap = (self.timestamps[self.step + 1] - self.timestamps[self.step]).total_seconds()
+        return min(max(gap / self.speed, 0), max_delay)
+
+    def state(self):
+        """
+        Valuation of the session at its clock.
+        """
+        with self.lock:
+            return self._state()
+
+    def _state(self):
+        positions = {}
+        market_value = 0.0
+        for symbol, position in self.positions.items():
+            price = self.price(symbol) or position.bought_at
+            value = price * position.shares
+            market_value += value
+            positions[symbol] = {
+                'symbol': symbol,
+                'shares': position.shares,
+                'bought_at': round(position.bought_at, 2),
+                'price': round(price, 2),
+                'value': round(value, 2)
+            }
+
+        initial = self.account.initial_amount
+        total = self.account.cash_amount + market_value
+        return {
+            'id': self.id,
+            'clock': self.clock.now().isoformat(),
+            'step': self.step,
+            'steps': len(self.timestamps),
+            'speed': self.speed,
+            'paused': self.paused,
+            'finished': self.finished,
+            'cash_amount': round(self.account.cash_amount, 2),
+            'market_value': round(market_value, 2),
+            'total_amount': round(total, 2),
+            'pct_change': round((total - initial) / initial * 100, 2) if initial else 0,
+            'positions': positions
+        }
+
+    def order_list(self):
+        with self.lock:
+            return [self._order_state(order_id) for order_id in sorted(self.orders, reverse=True)]
+
+    def subscribe(self, queue_size):
+        subscription = Subscription(self.symbols, queue_size)
+        with self.lock:
+            self.subscribers.add(subscription)
+            subscription.put({'event': 'state', 'data': self._state()})
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+
+    def publish(self, event, data):
+        for subscription in self.subscribers:
+            subscription.put({'event': event, 'data': data})
+
+    def _apply(self, data):
+        symbol = data['symbol'].upper()
+        data = dict(data, symbol=symbol, process_date=self.clock.now())
+        position = self.positions.get(symbol)
+        closed = apply_balance(self.account, position, data)
+        if position is None:
+            self.positions[symbol] = Position(symbol, data['shares'], data['price'], bought_on=data['process_date'],
+                initial_cost=data['amount'])
+        elif closed:
+            del self.positions[symbol]
+
+        trade = {
+            'symbol': symbol,
+            'trade_type': data['trade_type'],
+            'shares': data['shares'],
+            'price': data['price'],
+            'process_date': data['process_date'].isoformat()
+        }
+        self.trades.append(trade)
+        self.publish('trade', trade)
+        return trade
+
+    def _cross(self, symbol, price):
+        while True:
+            crossed = self.index.crossed(symbol, price)
+            if not crossed:
+                return
+            for order_id in crossed:
+                order = self.orders[order_id]
+                open_order = order['_order']
+                if open_order.order_type == 'stop_limit' and not open_order.triggered:
+                    open_order.triggered = True
+                    order['triggered_at'] = self.clock.now()
+                    self.index.add(order_id, symbol, *open_order.trigger())
+                    continue
+
+                data = {
+                    'symbol': symbol,
+                    'shares': order['shares'],
+                    'price': price,
+                    'trade_type': order['trade_type'],
+                    'amount': round(order['shares'] * price, 2)
+                }
+                try:
+                    self._apply(data)
+                except TradeError as err:
+                    order['status'] = 'rejected'
+                    order['message'] = err.message
+                else:
+                    order['status'] = 'filled'
+                    order['fill_price'] = price
+                order['closed_at'] = self.clock.now()
+                self.publish('order', self._order_state(order_id))
+
+    def _order_state(self, order_id):
+        order = {k: v for k, v in self.orders[order_id].items() if not k.startswith('_')}
+        for key in ('created_at', 'triggered_at', 'closed_at'):
+            if order.get(key) is not None:
+                order[key] = order[key].isoformat()
+        return order
+
+class ReplayEngine:
+    """
+    Runs replay sessions over bars from the local price store.
+
+    Every session is a coroutine on a single asyncio event loop per process
+    that sleeps until its next bar is due, so hundreds of sessions replaying
+    different periods at different speeds share one thread and never call
+    IEX. Sessions live in the memory of the process that created them.
+    """
+    def __init__(self):
+        self.store = None
+        self.max_sessions = 500
+        self.max_sessions_per_user = 3
+        self.max_symbols = 20
+        self.max_step_delay = 5
+        self.default_speed = 86400
+        self.session_ttl = 600
+        self.queue_size = 100
+
+        self.sessions = {}
+        self._lock = threading.Lock()
+        self._loop = None
+        self._pid = None
+
+    def init_app(self, app, store):
+        self.store = store
+        self.max_sessions = app.config.get('REPLAY_MAX_SESSIONS', self.max_sessions)
+        self.max_sessions_per_user = app.config.get('REPLAY_MAX_SESSIONS_PER_USER', self.max_sessions_per_user)
+        self.max_symbols = app.config.get('REPLAY_MAX_SYMBOLS', self.max_symbols)
+        self.max_step_delay = app.config.get('REPLAY_MAX_STEP_DELAY', self.max_step_delay)
+        self.default_speed = app.config.get('REPLAY_DEFAULT_SPEED', self.default_speed)
+        self.session_ttl = app.config.get('REPLAY_SESSION_TTL', self.session_ttl)
+        self.queue_size = app.config.get('STREAM_QUEUE_SIZE', self.queue_size)
+
+    def create(self, user_id, symbols, start, end=None, speed=None, cash=100000.0):
+        """
+        Start a replay of `symbols` from `start` to `end`.
+
+        Params
+        ------
+        user_id : int
+            Owner of the session.
+        symbols : list of str
+            Symbols to replay, which must be in the price store.
+        start, end : datetime
+            Period to replay.
+        speed : float, optional
+            Simulated seconds per real second, `REPLAY_DEFAULT_SPEED` by
+            default (one day per second).
+        cash : float
+            Starting cash of the paper account.
+        """
+        if len(symbols) > self.max_symbols:
+            raise ReplayError(ResponseErrors.STREAM_TOO_MANY_SYMBOLS)
+        with self._lock:
+            if len(self.sessions) >= self.max_sessions or \
+                    sum(s.user_id == user_id for s in self.sessions.values()) >= self.max_sessions_per_user:
+                raise ReplayError(ResponseErrors.REPLAY_TOO_MANY, HTTPStatus.TOO_MANY_REQUESTS)
+
+        prices = self.store.read_panel(symbols, start, end)
+        if prices.empty or prices.isna().all().any():
+            raise ReplayError(ResponseErrors.REPLAY_NO_DATA)
+
+        session = ReplaySession(user_id, prices, cash, speed or self.default_speed)
+        with self._lock:
+            self._ensure_loop()
+            self.sessions[session.id] = session
+        session.task = asyncio.run_coroutine_threadsafe(self._drive(session), self._loop)
+        return session
+
+    def get(self, session_id, user_id):
+        session = self.sessions.get(session_id)
+        if session is None or session.user_id != user_id:
+            raise ReplayError(ResponseErrors.REPLAY_DNE, HTTPStatus.NOT_FOUND)
+        return session
+
+    def stop(self, session):
+        with self._lock:
+            self.sessions.pop(session.id, None)
+        if session.task is not None:
+            session.task.cancel()
+
+    def _ensure_loop(self):
+        # Threads don't survive a fork, so start the loop again in each worker.
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, name='replay-loop', daemon=True).start()
+
+    async def _drive(self, session):
+        try:
+            while True:
+                await asyncio.sleep(session.next_delay(self.max_step_delay))
+                while session.paused:
+                    await asyncio.sleep(0.25)
+                if not session.advance():
+                    break
+            with session.lock:
+                session.publish('finished', session._state())
+            # Keep the final state around for a while.
+            await asyncio.sleep(self.session_ttl)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logging.error({'exception': str(e), 'session': session.id})
+        finally:
+            with self._lock:
+                self.sessions.pop(session.id, None)
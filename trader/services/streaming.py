@@ -0,0 +1,177 @@
+import os
+import time
+import queue
+import logging
+import threading
+
+class Subscription:
+    """
+    A single client's subscription to price updates for a set of symbols.
+    Updates are buffered in a bounded queue; if the client falls behind, the
+    oldest updates are dropped.
+    """
+    def __init__(self, symbols, maxsize=100):
+        self.symbols = frozenset(s.upper() for s in symbols)
+        self.queue = queue.Queue(maxsize=maxsize)
+
+    def put(self, event):
+        while True:
+            try:
+                self.queue.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        """
+        Wait up to `timeout` seconds for the next update. Returns None if
+        nothing arrived in time.
+        """
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+class PriceStream:
+    """
+    Fans out quote updates to subscribed clients.
+
+    A single background poller per process fetches the quotes for the union
+    of all subscribed symbols and pushes the ones that changed to the
+    subscribers of each symbol, so upstream load depends on the number of
+    distinct symbols rather than the number of connected clients.
+    """
+    def __init__(self):
+        self.api = None
+        self.interval = 5
+        self.heartbeat = 15
+        self.queue_size = 100
+        self.max_symbols = 50
+
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._sources = []
+        self._subscribers = {}
+        self._last = {}
+        self._pid = None
+        self._poller = None
+
+    def init_app(self, app, api):
+        self.api = api
+        self.interval = app.config.get('STREAM_POLL_INTERVAL', self.interval)
+        self.heartbeat = app.config.get('STREAM_HEARTBEAT', self.heartbeat)
+        self.queue_size = app.config.get('STREAM_QUEUE_SIZE', self.queue_size)
+        self.max_symbols = app.config.get('STREAM_MAX_SYMBOLS', self.max_symbols)
+
+    def subscribe(self, symbols):
+        """
+        Register a new subscription and send it the latest known quote of
+        each of its symbols.
+        """
+        subscription = Subscription(symbols, self.queue_size)
+        with self._lock:
+            self._ensure_started()
+            for symbol in subscription.symbols:
+                self._subscribers.setdefault(symbol, set()).add(subscription)
+                if symbol in self._last:
+                    subscription.put(self._event(symbol, self._last[symbol]))
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for symbol in subscription.symbols:
+                subscribers = self._subscribers.get(symbol)
+                if subscribers is None:
+                    continue
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[symbol]
+                    self._last.pop(symbol, None)
+
+    def add_listener(self, listener, symbols=None):
+        """
+        Call `listener(quotes)` with the `{symbol: quote}` that changed on
+        every poll. `symbols`, if given, is a callable returning extra
+        symbols to poll even when no client is subscribed to them.
+        """
+        with self._lock:
+            self._listeners.append(listener)
+            if symbols is not None:
+                self._sources.append(symbols)
+
+    def start(self):
+        """
+        Start polling in this process without waiting for a subscriber.
+        """
+        with self._lock:
+            self._ensure_started()
+
+    def symbols(self):
+        with self._lock:
+            symbols = set(self._subscribers)
+            sources = list(self._sources)
+        for source in sources:
+            try:
+                symbols.update(source())
+            except Exception as e:
+                logging.error({'exception': str(e)})
+        return list(symbols)
+
+    def _ensure_started(self):
+        # Threads don't survive a fork, so start the poller again in each worker.
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._poller = threading.Thread(target=self._run, name='price-stream', daemon=True)
+        self._poller.start()
+
+    def _run(self):
+        while True:
+            started = time.monotonic()
+            try:
+                self.poll()
+            except Exception as e:
+                logging.error({'exception': str(e)})
+            time.sleep(max(0, self.interval - (time.monotonic() - started)))
+
+    def poll(self):
+        """
+        Fetch quotes for every subscribed symbol and publish the ones that
+        changed since the last poll.
+        """
+        symbols = self.symbols()
+        if not symbols:
+            return
+
+        quotes = self.api.get_quotes(symbols)
+        if not quotes:
+            return
+
+        changed = {}
+        with self._lock:
+            for symbol, quote in quotes.items():
+                previous = self._last.get(symbol)
+                if previous is not None and self._same(previous, quote):
+                    continue
+                self._last[symbol] = quote
+                changed[symbol] = quote
+                event = self._event(symbol, quote)
+                for subscription in self._subscribers.get(symbol, ()):
+                    subscription.put(event)
+            listeners = list(self._listeners) if changed else []
+
+        for listener in listeners:
+            try:
+                listener(changed)
+            except Exception as e:
+                logging.error({'exception': str(e), 'listener': repr(listener)})
+
+    def _same(self, previous, quote):
+        return previous.get('latestPrice') == quote.get('latestPrice') and \
+            previous.get('latestUpdate') == quote.get('latestUpdate')
+
+    def _event(self, symbol, quote):
+        return {'symbol': symbol, 'quote': quote}
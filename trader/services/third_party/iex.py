@@ -1,33 +1,216 @@
-import requests
 import logging
 
-from flask import current_app as app
+from trader.lib.serialization import RawJSON, dumps, raw_object
+from trader.services.batcher import BatchFetcher
+from trader.services.market_data.providers import create_provider
+
+class Dataset:
+    """
+    A kind of data that can be requested for a symbol in an IEX batch call.
+    The `key` identifies the dataset and its parameters, and is used both
+    for caching and as the key of the dataset in fetch results.
+    """
+    type = None
+
+    def __init__(self, **params):
+        self.params = params
+        self.key = ':'.join([self.type] + [str(v) for v in params.values()])
+
+    def parse(self, payload):
+        """
+        Extract this dataset from the batch response for one symbol.
+        """
+        return payload.get(self.type)
+
+    def __eq__(self, other):
+        return isinstance(other, Dataset) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __repr__(self):
+        return '<{} {}>'.format(type(self).__name__, self.key)
+
+class Quote(Dataset):
+    type = 'quote'
+
+class Chart(Dataset):
+    type = 'chart'
+
+    def __init__(self, range='1m'):
+        super().__init__(range=range)
+
+    def parse(self, payload):
+        return payload.get(self.type) or []
+
+class News(Dataset):
+    type = 'news'
+
+    def __init__(self, last=5):
+        super().__init__(last=last)
+
+    def parse(self, payload):
+        return payload.get(self.type) or []
 
 class IEXApi:
+    """
+    Client for IEX-shaped market data.
 
+    A single instance is shared by every resource in the process (see
+    `trader.extensions`). Batch and search calls go to the provider named
+    by `MARKET_DATA_SOURCE` (IEX Cloud by default, see
+    `trader.services.market_data.providers`), behind the quote cache, the
+    batcher and the local price store.
+    """
     def __init__(self):
-        self.base_url = app.config['IEX_API_URL']
-        self.token = app.config['IEX_SECRET_TOKEN']
-    
+        self.cache = None
+        self.store = None
+        self.provider = None
+        self.batcher = None
+
+    def init_app(self, app, cache=None, store=None, provider=None):
+        """
+        Set up the market data `provider`, created from the app
+        configuration unless given, and the batcher in front of it. Charts
+        are served from the local price `store` when it covers them.
+        """
+        self.cache = cache
+        self.store = store
+        self.provider = provider or create_provider(app)
+
+        # IEX accepts at most 100 symbols per batch call.
+        timeout = app.config.get('IEX_CONNECT_TIMEOUT', 3.05) + app.config.get('IEX_READ_TIMEOUT', 10)
+        self.batcher = BatchFetcher(
+            self._fetch_batch,
+            window=app.config.get('IEX_BATCH_WINDOW', 0.005),
+            limit=app.config.get('IEX_BATCH_LIMIT', 100),
+            max_workers=app.config.get('IEX_BATCH_WORKERS', 4),
+            timeout=timeout * (app.config.get('IEX_MAX_RETRIES', 2) + 1)
+        )
+
     def search_symbol(self, symbol):
-        url = f"{self.base_url}/search/{symbol}?token={self.token}"
-        try:
-            res = requests.get(url)
-            data = res.json()
-        except Exception as e:
-            logging.error({'exception': str(e), 'res': res.content})
-            return False
-        
+        return self.provider.search(symbol)
+
+    def fetch(self, symbols, *datasets, raw=False):
+        """
+        Get only the requested `datasets` for `symbols`, served from the quote
+        cache where possible.
+
+        Params
+        ------
+        symbols : iterable of str
+            Stock symbols.
+        datasets : Dataset
+            E.g. `Quote()`, `Chart(range='1m')`, `News(last=5)`.
+        raw : bool
+            Return each data as `RawJSON`, passing cached upstream bytes
+            through without decoding them.
+
+        Returns a dict of `{symbol: {dataset.key: data}}`, or False if the
+        data couldn't be retrieved.
+        """
+        by_key = {d.key: d for d in datasets}
+        if len({d.type for d in datasets}) != len(datasets):
+            raise ValueError('Only one dataset of each type can be fetched at once')
+
+        def loader(symbols, keys):
+            return self._fetch_datasets(symbols, tuple(by_key[k] for k in keys))
+
+        if self.cache is not None:
+            return self.cache.get_many(symbols, tuple(by_key), loader, raw=raw)
+        data = loader(symbols, tuple(by_key))
+        if raw and data is not False:
+            return {s: {k: RawJSON(dumps(v)) for k, v in values.items()} for s, values in data.items()}
         return data
 
-    def get_stock_data(self, symbols):
-        symbols_str = ','.join(symbols)
-        url = f"{self.base_url}/stock/market/batch?symbols={symbols_str}&types=quote,news,chart&range=1m&last=5&token={self.token}"
-        try:
-            res = requests.get(url)
-            data = res.json()
-        except Exception as e:
-            logging.error({'exception': str(e), 'res': res.content})
+    def get_quotes(self, symbols):
+        """
+        Get only the quote of each symbol, as `{symbol: quote}`.
+        """
+        return self._fetch_one(symbols, Quote())
+
+    def get_charts(self, symbols, range='1m'):
+        """
+        Get the daily chart of each symbol, as `{symbol: chart}`. Charts are
+        read from the local price store where it is up to date; the rest are
+        fetched from IEX and queued to be written to the store.
+        """
+        charts = self._stored_charts(symbols, range)
+        missing = [s for s in symbols if s.upper() not in charts]
+        if missing:
+            fetched = self._fetch_one(missing, Chart(range))
+            if fetched is False:
+                return charts or False
+            self._store_charts(fetched)
+            charts.update(fetched)
+        return charts
+
+    def get_news(self, symbols, last=5):
+        return self._fetch_one(symbols, News(last))
+
+    def get_stock_data(self, symbols, raw=False):
+        """
+        Get quote, news and chart data for `symbols`, keyed by IEX type name
+        as in the IEX batch response.
+
+        With `raw` set, the whole result is returned as `RawJSON` built
+        from the cached encodings of the quotes and news.
+        """
+        datasets = (Quote(), News(5))
+        data = self.fetch(symbols, *datasets, raw=raw)
+        if data is False:
             return False
+        result = {s: {d.type: values[d.key] for d in datasets if d.key in values} for s, values in data.items()}
 
-        return data
\ No newline at end of file
+        charts = self.get_charts(list(result), '1m') or {}
+        for symbol, chart in charts.items():
+            result[symbol]['chart'] = chart
+        if raw:
+            return raw_object({symbol: raw_object(values) for symbol, values in result.items()})
+        return result
+
+    def _fetch_one(self, symbols, dataset):
+        data = self.fetch(symbols, dataset)
+        if data is False:
+            return False
+        return {s: values[dataset.key] for s, values in data.items() if dataset.key in values}
+
+    def _stored_charts(self, symbols, range):
+        if self.store is None:
+            return {}
+        charts = {}
+        for symbol in symbols:
+            chart = self.store.chart(symbol, range)
+            if chart is not None:
+                charts[symbol.upper()] = chart
+        return charts
+
+    def _store_charts(self, charts):
+        if self.store is None:
+            return
+        for symbol, chart in charts.items():
+            try:
+                self.store.ingest_iex_chart(symbol, chart, wait=False)
+            except Exception as e:
+                logging.error({'exception': str(e), 'symbol': symbol})
+
+    def _fetch_datasets(self, symbols, datasets):
+        """
+        Fetch `datasets` for `symbols` through the batcher, which merges this
+        call with concurrent ones and splits it along the IEX batch limit.
+        """
+        return self.batcher.fetch([s.upper() for s in symbols], datasets)
+
+    def _fetch_batch(self, symbols, datasets):
+        params = {}
+        for dataset in datasets:
+            params.update(dataset.params)
+
+        data = self.provider.batch(symbols, [d.type for d in datasets], params)
+        if data is False:
+            return False
+        result = {}
+        for symbol, payload in data.items():
+            parsed = ((d.key, d.parse(payload)) for d in datasets)
+            result[symbol] = {key: value for key, value in parsed if value is not None}
+        return result
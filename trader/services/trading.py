@@ -0,0 +1,484 @@
+import time
+import random
+import logging
+
+from contextlib import nullcontext
+
+from http import HTTPStatus
+from sqlalchemy import update
+from sqlalchemy.exc import DBAPIError
+
+from trader.lib import clock
+from trader.lib.definitions import ResponseErrors
+from trader.models import Account, Stock, Trade, Order
+from trader.services.portfolio import PortfolioRepository
+
+# Postgres serialization_failure and deadlock_detected
+RETRYABLE_PGCODES = ('40001', '40P01')
+
+class TradeError(Exception):
+    """
+    Raised when a trade or cash transfer can't be processed, e.g. the
+    account doesn't exist or doesn't belong to the user.
+    """
+    def __init__(self, message, status_code=HTTPStatus.BAD_REQUEST):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+class TradeRejected(TradeError):
+    """
+    Raised when a valid trade is refused by the account rules, e.g. not
+    enough cash or shares.
+    """
+    def __init__(self, message):
+        super().__init__(message, HTTPStatus.OK)
+
+def apply_balance(account, stock, data):
+    """
+    Check a trade against the account rules and apply it to the cash and
+    equity of `account` and the shares of `stock`, in memory. `stock` is None
+    when a buy opens a new position.
+
+    Returns True if the trade closes the position.
+    """
+    trade_type = data.get('trade_type')
+    if trade_type == 'buy':
+        cost = data['amount'] + Account.BROKERAGE_FEE
+        if account.cash_amount < cost:
+            raise TradeRejected(ResponseErrors.NOT_ENOUGH_FUNDS)
+        if stock is not None:
+            stock.shares += data['shares']
+        account.cash_amount -= cost
+        account.equity_amount += data['amount']
+        return False
+    elif trade_type == 'sell':
+        if stock is None:
+            raise TradeError(ResponseErrors.STOCK_DNE, HTTPStatus.NOT_FOUND)
+        if account.cash_amount < Account.BROKERAGE_FEE:
+            raise TradeRejected(ResponseErrors.NOT_ENOUGH_FUNDS)
+        if stock.shares < data['shares']:
+            raise TradeRejected(ResponseErrors.TOO_MANY_SHARES)
+        closed = stock.shares == data['shares']
+        if closed:
+            stock.sold_on = data['process_date']
+        stock.shares -= data['shares']
+        account.cash_amount -= Account.BROKERAGE_FEE
+        account.cash_amount += data['amount']
+        account.equity_amount -= (stock.bought_at*data['shares'])
+        return closed
+    raise TradeError(ResponseErrors.TRADE_INVALID_TYPE, HTTPStatus.BAD_REQUEST)
+
+class TradeResult:
+    """
+    Outcome of a committed trade or transfer. `fills` lists the position
+    changes it made as `(symbol, shares, price)`, with negative shares for
+    sells.
+    """
+    def __init__(self, account, stock_id=None, trade_id=None, lock_wait=0.0, attempts=1, orders=None, fills=()):
+        self.account = account
+        self.stock_id = stock_id
+        self.trade_id = trade_id
+        self.lock_wait = lock_wait
+        self.attempts = attempts
+        self.orders = orders
+        self.fills = list(fills)
+
+def fill(order):
+    shares = order['shares'] if order['trade_type'] == 'buy' else -order['shares']
+    return order['symbol'], shares, order['price']
+
+class Position:
+    """
+    In-memory stand-in for a `Stock` row while a batch of orders is applied.
+    """
+    def __init__(self, symbol, shares, bought_at, id=None, bought_on=None, initial_cost=None):
+        self.id = id
+        self.symbol = symbol
+        self.shares = shares
+        self.bought_at = bought_at
+        self.bought_on = bought_on
+        self.initial_cost = initial_cost
+        self.sold_on = None
+        self.changed = False
+        self.closed = False
+
+class TradeExecutor:
+    """
+    Applies trades and cash transfers to an account as one short transaction.
+
+    The account row is locked with `SELECT ... FOR UPDATE` (or changed with a
+    single conditional `UPDATE`) before any balance is checked, so concurrent
+    trades on the same account are serialized by Postgres instead of racing
+    on values read into Python. Locks are always taken account first, then
+    position, to avoid deadlocks between trades. Transactions failing with a
+    serialization failure or deadlock are retried with jittered backoff.
+
+    Params
+    ------
+    db : TraderDB
+        Database handle used to open sessions.
+    max_retries : int
+        Number of times a transaction is retried after a serialization
+        failure or deadlock.
+    lock_wait_warning : float
+        Lock waits longer than this (seconds) are logged.
+    """
+    def __init__(self, db, max_retries=3, lock_wait_warning=0.5):
+        self.db = db
+        self.max_retries = max_retries
+        self.lock_wait_warning = lock_wait_warning
+        self.listeners = []
+        self.journal = None
+
+    def init_app(self, app):
+        self.max_retries = app.config.get('TRADE_MAX_RETRIES', self.max_retries)
+        self.lock_wait_warning = app.config.get('TRADE_LOCK_WAIT_WARNING', self.lock_wait_warning)
+
+    def add_listener(self, listener):
+        """
+        Call `listener(result)` with the `TradeResult` of every trade, batch
+        and transfer once it has been committed.
+        """
+        if listener not in self.listeners:
+            self.listeners.append(listener)
+
+    def exclusive(self, user_id):
+        """
+        Context in which the account of `user_id` is written to directly,
+        bypassing the trade journal when it is enabled. See
+        `TradeJournal.exclusive`.
+        """
+        if self.journal is None or user_id is None:
+            return nullcontext()
+        return self.journal.exclusive(user_id)
+
+    def trade(self, user_id, account_id, data, open_position=False):
+        """
+        Buy or sell shares of a stock.
+
+        Params
+        ------
+        user_id : int
+            User placing the trade, who must own the account.
+        account_id : int
+            Account identifier.
+        data : dict
+            Trade loaded through `TradeSchema`.
+        open_position : bool
+            Whether the trade opens a new position, which must not already
+            exist, rather than changing an existing one.
+
+        With the trade journal enabled, the trade is acknowledged once
+        journaled and written to the database later.
+        """
+        if self.journal is not None:
+            result = self.journal.trade(user_id, account_id, data, open_position)
+            if result is not None:
+                return result
+
+        def apply(session):
+            account, lock_wait = self.lock_account(session, user_id, account_id=account_id)
+            stock_id, trade_id = self.apply_trade(session, account, data, open_position)
+            return TradeResult(account, stock_id, trade_id, lock_wait, fills=[fill(data)])
+
+        with self.exclusive(user_id):
+            result = self._run(apply)
+        return self._notify(result)
+
+    def trade_batch(self, user_id, account_id, orders):
+        """
+        Apply a list of orders to an account in a single transaction.
+
+        Orders are checked in sequence against the running balance, so each
+        order sees the effect of the ones before it. Orders refused by the
+        account rules are reported and skipped without affecting the others.
+        Position and trade rows are written with bulk statements at the end.
+
+        Params
+        ------
+        user_id : int
+            User placing the orders, who must own the account.
+        account_id : int
+            Account identifier.
+        orders : list of dict
+            Trades loaded through `TradeSchema(many=True)`.
+
+        Returns a `TradeResult` whose `orders` holds one result per order.
+        """
+        def apply(session):
+            account, lock_wait = self.lock_account(session, user_id, account_id=account_id)
+            results = self.apply_batch(session, account, orders)
+            fills = [fill(orders[r['index']]) for r in results if r['success']]
+            return TradeResult(account, lock_wait=lock_wait, orders=results, fills=fills)
+
+        with self.exclusive(user_id):
+            result = self._run(apply)
+        return self._notify(result)
+
+    def apply_batch(self, session, account, orders):
+        """
+        Apply `orders` to an account already locked in `session`. See
+        `trade_batch`.
+        """
+        symbols = {order['symbol'] for order in orders}
+        rows = PortfolioRepository(session).get_positions(account.id, symbols, for_update=True)
+        positions = {row.symbol: Position(row.symbol, row.shares, row.bought_at, id=row.id) for row in rows}
+        existing = list(positions.values())
+        opened = []
+
+        results, trades = [], []
+        for index, order in enumerate(orders):
+            position = positions.get(order['symbol'])
+            if position is not None and position.closed:
+                position = None
+            try:
+                closed = apply_balance(account, position, order)
+            except TradeError as err:
+                results.append({'index': index, 'symbol': order['symbol'], 'success': False,
+                    'result': err.message})
+                continue
+
+            if position is None:
+                position = Position(order['symbol'], order['shares'], order['price'],
+                    bought_on=order['process_date'], initial_cost=order['amount'])
+                positions[order['symbol']] = position
+                opened.append(position)
+            position.changed = True
+            position.closed = closed
+            trades.append((position, order))
+            results.append({'index': index, 'symbol': order['symbol'], 'success': True, 'result': 'ok'})
+
+        if trades:
+            self._write_batch(session, account, existing, opened, trades)
+        return results
+
+    def _write_batch(self, session, account, existing, opened, trades):
+        stock_table = Stock.__table__
+
+        updated = [{'id': p.id, 'shares': p.shares} for p in existing if p.changed and not p.closed]
+        if updated:
+            session.bulk_update_mappings(Stock, updated)
+
+        # Free the (account_id, symbol) keys before positions are reopened.
+        closed_ids = [p.id for p in existing if p.closed]
+        if closed_ids:
+            session.execute(stock_table.delete().where(stock_table.c.id.in_(closed_ids)))
+
+        if opened:
+            rows = session.execute(stock_table.insert().values([{
+                'account_id': account.id,
+                'symbol': p.symbol,
+                'bought_at': p.bought_at,
+                'bought_on': p.bought_on,
+                'initial_cost': p.initial_cost,
+                'shares': p.shares
+            } for p in opened]).returning(stock_table.c.id)).fetchall()
+            # Serial ids are drawn in VALUES order.
+            for position, row in zip(opened, sorted(rows, key=lambda r: r.id)):
+                position.id = row.id
+
+            opened_closed = [p.id for p in opened if p.closed]
+            if opened_closed:
+                session.execute(stock_table.delete().where(stock_table.c.id.in_(opened_closed)))
+
+        now = clock.now()
+        session.execute(Trade.__table__.insert().values([{
+            'user_id': account.user_id,
+            'account_id': account.id,
+            'stock_id': position.id,
+            'symbol': position.symbol,
+            'trade_type': order['trade_type'],
+            'process_date': now,
+            'price': order['price'],
+            'shares': order['shares']
+        } for position, order in trades]))
+        session.flush()
+
+    def fill_order(self, order_id, price):
+        """
+        Execute a triggered resting order at `price`.
+
+        The order row is claimed (`SELECT ... FOR UPDATE SKIP LOCKED` on an
+        open order) before the account is locked, so an order triggered by
+        several processes at once is filled only once. Orders refused by the
+        account rules, e.g. for lack of cash, are marked rejected.
+
+        Returns a `TradeResult` whose `orders` holds the final state of the
+        order, or whose `account` is None if the order was no longer open.
+        """
+        def apply(session):
+            order = session.query(Order).filter(Order.id == order_id, Order.status == 'open').\
+                with_for_update(skip_locked=True).first()
+            if order is None:
+                return TradeResult(None)
+
+            now = clock.now()
+            data = {
+                'symbol': order.symbol,
+                'shares': order.shares,
+                'price': price,
+                'trade_type': order.trade_type,
+                'process_date': now,
+                'amount': round(float(order.shares*price), 2)
+            }
+            account, lock_wait = self.lock_account(session, order.user_id, account_id=order.account_id)
+            open_position = order.trade_type == 'buy' and \
+                not PortfolioRepository(session).has_position(account.id, order.symbol)
+
+            result = TradeResult(account, lock_wait=lock_wait)
+            try:
+                result.stock_id, result.trade_id = self.apply_trade(session, account, data, open_position)
+            except TradeError as err:
+                order.status = 'rejected'
+                order.message = err.message
+            else:
+                order.status = 'filled'
+                order.fill_price = price
+                order.trade_id = result.trade_id
+                result.fills = [fill(data)]
+            order.closed_at = now
+            result.orders = [{'id': order.id, 'status': order.status, 'message': order.message}]
+            return result
+
+        user_id = None
+        if self.journal is not None:
+            with self.db.session_scope() as session:
+                user_id = session.query(Order.user_id).filter(Order.id == order_id).scalar()
+        with self.exclusive(user_id):
+            result = self._run(apply)
+        return self._notify(result) if result.fills else result
+
+    def deposit(self, user_id, amount):
+        with self.exclusive(user_id):
+            result = self._run(lambda session: self._transfer(session, user_id, amount))
+        return self._notify(result)
+
+    def withdraw(self, user_id, amount):
+        with self.exclusive(user_id):
+            result = self._run(lambda session: self._transfer(session, user_id, -amount))
+        return self._notify(result)
+
+    def lock_account(self, session, user_id, account_id=None):
+        """
+        Lock and return the account of `user_id` (optionally checking it is
+        `account_id`), along with the time spent waiting for the lock.
+        """
+        started = time.perf_counter()
+        query = session.query(Account)
+        if account_id is not None:
+            query = query.filter(Account.id == account_id)
+        else:
+            query = query.filter(Account.user_id == user_id)
+        account = query.with_for_update().first()
+        lock_wait = self._lock_waited(started, account_id)
+
+        if not account:
+            raise TradeError(ResponseErrors.ACCOUNT_DNE, HTTPStatus.NOT_FOUND)
+        if account.user_id != user_id:
+            raise TradeError(ResponseErrors.ACCOUNT_NO_ACCESS, HTTPStatus.FORBIDDEN)
+        return account, lock_wait
+
+    def apply_trade(self, session, account, data, open_position=False):
+        """
+        Apply a trade to an account already locked in `session`, updating
+        cash, equity and the position, and recording the `Trade`.
+
+        Returns a tuple of `(stock_id, trade_id)`.
+        """
+        portfolio = PortfolioRepository(session)
+        if open_position:
+            if portfolio.has_position(account.id, data['symbol']):
+                raise TradeError(ResponseErrors.STOCK_EXISTS, HTTPStatus.METHOD_NOT_ALLOWED)
+            stock = None
+        else:
+            stock = portfolio.get_position(account.id, data['symbol'], for_update=True)
+            if not stock:
+                raise TradeError(ResponseErrors.STOCK_DNE, HTTPStatus.NOT_FOUND)
+
+        delete_flag = apply_balance(account, stock, data)
+        if stock is None:
+            stock = Stock(
+                account_id=account.id,
+                bought_at=data['price'],
+                bought_on=data['process_date'],
+                initial_cost=data['amount'],
+                shares=data['shares'],
+                symbol=data['symbol']
+            )
+            session.add(stock)
+        session.flush()
+
+        trade = Trade(
+            user_id=account.user_id,
+            account_id=account.id,
+            stock_id=stock.id,
+            symbol=stock.symbol,
+            trade_type=data['trade_type'],
+            price=data['price'],
+            shares=data['shares'],
+        )
+        session.add(trade)
+        if delete_flag:
+            session.delete(stock)
+        session.flush()
+
+        return stock.id, trade.id
+
+    def _transfer(self, session, user_id, amount):
+        """
+        Add `amount` (negative for withdrawals) to the cash of the account of
+        `user_id` with a single conditional update, refusing to overdraw.
+        """
+        started = time.perf_counter()
+        stmt = update(Account.__table__).\
+            where(Account.user_id == user_id).\
+            values(cash_amount=Account.cash_amount + amount).\
+            returning(Account.id, Account.user_id, Account.cash_amount, Account.equity_amount,
+                Account.initial_amount)
+        if amount < 0:
+            stmt = stmt.where(Account.cash_amount >= -amount)
+        row = session.execute(stmt).first()
+        lock_wait = self._lock_waited(started, user_id)
+
+        if row is None:
+            exists = session.query(Account.id).filter(Account.user_id == user_id).first()
+            if not exists:
+                raise TradeError(ResponseErrors.ACCOUNT_DNE, HTTPStatus.NOT_FOUND)
+            raise TradeError(ResponseErrors.ACCOUNT_INSUFFICIENTFUNDS, HTTPStatus.BAD_REQUEST)
+
+        return TradeResult(row, lock_wait=lock_wait)
+
+    def _lock_waited(self, started, ref):
+        lock_wait = time.perf_counter() - started
+        if lock_wait > self.lock_wait_warning:
+            logging.warning({'message': 'Slow account lock', 'ref': ref, 'lock_wait': lock_wait})
+        return lock_wait
+
+    def _notify(self, result):
+        for listener in self.listeners:
+            try:
+                listener(result)
+            except Exception as e:
+                logging.error({'exception': str(e), 'listener': repr(listener)})
+        return result
+
+    def _run(self, apply):
+        """
+        Run `apply(session)` in its own transaction, retrying it when
+        Postgres aborts it because of a serialization failure or deadlock.
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                with self.db.session_scope() as session:
+                    result = apply(session)
+                result.attempts = attempt
+                return result
+            except DBAPIError as e:
+                pgcode = getattr(e.orig, 'pgcode', None)
+                if pgcode not in RETRYABLE_PGCODES or attempt > self.max_retries:
+                    raise
+                logging.warning({'message': 'Retrying trade transaction', 'pgcode': pgcode, 'attempt': attempt})
+                time.sleep(random.uniform(0, 0.01 * 2**attempt))
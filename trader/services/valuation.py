@@ -0,0 +1,182 @@
+import time
+import logging
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+
+from trader.lib import clock
+from trader.models import Account, AccountValuation, Stock
+
+class ValuationError(Exception):
+    """
+    Raised when the valuation job can't get the prices it needs.
+    """
+
+class ValuationJob:
+    """
+    Marks every account to market in one pass.
+
+    Accounts and their positions are streamed from a server-side cursor in
+    account order and converted chunk by chunk into flat arrays, so memory
+    use is bounded by `VALUATION_CHUNK_SIZE` rather than by the number of
+    positions. Quotes are fetched once for the deduplicated set of held
+    symbols, per-account totals are computed with grouped NumPy reductions
+    and the results are upserted into `account_valuations` in bulk.
+    """
+    OUTPUT_COLUMNS = ('account_id', 'cash_amount', 'cost_basis', 'market_value', 'unrealized_pnl',
+        'total_amount', 'pct_change', 'positions')
+
+    def __init__(self, db, api):
+        self.db = db
+        self.api = api
+        self.chunk_size = 100000
+        self.write_batch = 5000
+
+    def init_app(self, app):
+        self.chunk_size = app.config.get('VALUATION_CHUNK_SIZE', self.chunk_size)
+        self.write_batch = app.config.get('VALUATION_WRITE_BATCH', self.write_batch)
+
+    def run(self, prices=None):
+        """
+        Value every account and write the results to `account_valuations`.
+
+        Params
+        ------
+        prices : dict, optional
+            `{symbol: price}` to value positions at. Latest quotes are
+            fetched when not given.
+
+        Returns a dict summarizing the run.
+        """
+        started = time.perf_counter()
+        valued_at = clock.now()
+
+        symbols, symbol_prices = self._prices(prices)
+        accounts = positions = 0
+        with self.db.engine.connect() as conn:
+            result = conn.execution_options(stream_results=True).execute(self._positions_query())
+            carry = None
+            while True:
+                rows = result.fetchmany(self.chunk_size)
+                chunk = self._to_arrays(rows, symbols, symbol_prices) if rows else None
+                if carry is not None:
+                    chunk = carry if chunk is None else {k: np.concatenate((carry[k], chunk[k])) for k in chunk}
+                if chunk is None:
+                    break
+
+                # The last account of a chunk may continue in the next one, so
+                # hold its rows back until the cursor is exhausted.
+                done = len(rows) < self.chunk_size
+                cut = len(chunk['account_id']) if done else self._last_group_start(chunk['account_id'])
+                carry = None if done else {k: v[cut:] for k, v in chunk.items()}
+                if cut:
+                    totals = self.value({k: v[:cut] for k, v in chunk.items()})
+                    self._write(totals, valued_at)
+                    accounts += len(totals['account_id'])
+                    positions += int(totals['positions'].sum())
+                if done:
+                    break
+
+        summary = {
+            'accounts': accounts,
+            'positions': positions,
+            'symbols': len(symbols),
+            'unpriced_symbols': int(np.isnan(symbol_prices).sum()),
+            'seconds': round(time.perf_counter() - started, 3)
+        }
+        logging.info(dict(summary, message='Valued accounts'))
+        return summary
+
+    def value(self, chunk):
+        """
+        Compute per-account totals from position-level arrays sorted by
+        `account_id`. Accounts without positions have a single row with zero
+        shares. Positions without a price are valued at cost.
+        """
+        account_id = chunk['account_id']
+        starts = np.flatnonzero(np.r_[True, account_id[1:] != account_id[:-1]])
+
+        cost = chunk['shares'] * chunk['bought_at']
+        value = np.where(np.isnan(chunk['price']), cost, chunk['shares'] * chunk['price'])
+        cost_basis = np.add.reduceat(cost, starts)
+        market_value = np.add.reduceat(value, starts)
+        cash = chunk['cash_amount'][starts]
+        initial = chunk['initial_amount'][starts]
+        total = cash + market_value
+
+        pct_change = np.zeros_like(total)
+        np.divide(total - initial, initial, out=pct_change, where=initial > 0)
+
+        return {
+            'account_id': account_id[starts],
+            'cash_amount': cash.round(2),
+            'cost_basis': cost_basis.round(2),
+            'market_value': market_value.round(2),
+            'unrealized_pnl': (market_value - cost_basis).round(2),
+            'total_amount': total.round(2),
+            'pct_change': (pct_change * 100).round(2),
+            'positions': np.add.reduceat((chunk['shares'] > 0).astype(np.int64), starts)
+        }
+
+    def _prices(self, prices):
+        """
+        Get the sorted array of held symbols and the matching price array,
+        NaN where no price is known.
+        """
+        with self.db.session_scope() as session:
+            held = sorted(s for s, in session.query(Stock.symbol).distinct())
+        if prices is None and held:
+            quotes = self.api.get_quotes(held)
+            if quotes is False:
+                raise ValuationError('Could not fetch quotes for {} symbols'.format(len(held)))
+            prices = {s: q.get('latestPrice') for s, q in quotes.items()}
+
+        prices = {s.upper(): p for s, p in (prices or {}).items()}
+        symbols = np.array(held, dtype='<U5')
+        values = np.array([prices.get(s) if prices.get(s) is not None else np.nan for s in held], dtype=np.float64)
+        return symbols, values
+
+    def _positions_query(self):
+        return select([
+                Account.id, Account.cash_amount, Account.initial_amount,
+                Stock.symbol, Stock.shares, Stock.bought_at
+            ]).\
+            select_from(Account.__table__.outerjoin(Stock.__table__, Stock.account_id == Account.id)).\
+            order_by(Account.id)
+
+    def _to_arrays(self, rows, symbols, symbol_prices):
+        account_id, cash, initial, symbol, shares, bought_at = zip(*rows)
+        symbol = np.array([s or '' for s in symbol], dtype='<U5')
+
+        price = np.full(len(rows), np.nan)
+        if len(symbols):
+            idx = np.minimum(np.searchsorted(symbols, symbol), len(symbols) - 1)
+            found = symbols[idx] == symbol
+            price[found] = symbol_prices[idx[found]]
+
+        return {
+            'account_id': np.array(account_id, dtype=np.int64),
+            'cash_amount': np.array(cash, dtype=np.float64),
+            'initial_amount': np.array(initial, dtype=np.float64),
+            'shares': np.array([s or 0 for s in shares], dtype=np.int64),
+            'bought_at': np.array([b or 0 for b in bought_at], dtype=np.float64),
+            'price': price
+        }
+
+    def _last_group_start(self, account_id):
+        return int(np.flatnonzero(np.r_[True, account_id[1:] != account_id[:-1]])[-1])
+
+    def _write(self, totals, valued_at):
+        columns = [totals[c].tolist() for c in self.OUTPUT_COLUMNS]
+        rows = [dict(zip(self.OUTPUT_COLUMNS, values), valued_at=valued_at) for values in zip(*columns)]
+
+        table = AccountValuation.__table__
+        with self.db.engine.begin() as conn:
+            for i in range(0, len(rows), self.write_batch):
+                stmt = insert(table).values(rows[i:i + self.write_batch])
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[table.c.account_id],
+                    set_={c.name: stmt.excluded[c.name] for c in table.c if c.name != 'account_id'}
+                )
+                conn.execute(stmt)
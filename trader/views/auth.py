@@ -4,20 +4,37 @@ from flask import Flask, Blueprint, request, redirect, render_template, url_for
 from flask_login import current_user, login_user, logout_user
 
 from trader.models import User
-from trader.extensions import db
+from trader.extensions import db, credential_cache, metrics
 from trader.lib.definitions import ResponseErrors
 from trader.schemas.forms import LoginForm, RegisterForm
 
 auth_bp = Blueprint('auth', __name__)
 
 def authenticate_user(email, password):
+    """
+    Verify `email` and `password` and log the user in. Credentials verified
+    recently are accepted from the credential cache without running bcrypt.
+    """
+    with metrics.timer('auth', metrics.auth_seconds, 'cache'):
+        user = credential_cache.get_user(email, password)
+    if user:
+        login_user(user)
+        return user
+
     with db.session_scope() as session:
-        user = session.query(User).filter_by(email=email).first()
+        user_id = session.query(User.id).filter_by(email=email).scalar()
+        if user_id is None:
+            return False
+        # Read before the password, see `CredentialCache.remember`.
+        version = credential_cache.version(user_id)
+        user = session.query(User).filter_by(id=user_id).first()
         if not user:
             return False
 
-        password = bcrypt.hashpw(password.encode(), user.salt)
-        if password == user.password:
+        with metrics.timer('auth', metrics.auth_seconds, 'bcrypt'):
+            hashed_pw = bcrypt.hashpw(password.encode(), user.salt)
+        if hashed_pw == user.password:
+            credential_cache.remember(email, password, user, version)
             login_user(user)
             return user
         return False